@@ -0,0 +1,102 @@
+"""
+Delivery of the notification outbox.
+
+``dispatch`` takes the due PENDING rows and leases them: one conditional
+UPDATE stamps its own ``lease`` on the rows that are still due and pushes
+``next_attempt_at`` past the delivery, then it reads back the rows carrying
+its lease. A row is due for at most one dispatcher at a time, so dispatchers
+running side by side never claim the same row, on any database. Rows that
+are still pending when the lease runs out, because the dispatcher died
+mid-batch, come due again. It then sends one batch per
+recipient through the sink. If a recipient has several notices for one
+token, only the most urgent is sent and the rest are marked sent with it.
+Notices about tokens that have since left the queue (called, cancelled,
+skipped) are DROPPED unsent.
+
+A failed batch is retried with exponential backoff
+(``NOTIFICATION_RETRY_SECONDS`` doubled per attempt). After
+``NOTIFICATION_MAX_ATTEMPTS`` attempts it is marked FAILED.
+"""
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from queues.models import Token
+from .models import Notification
+from .sinks import get_sink
+
+
+# How long a claimed batch is left to its dispatcher before it is due again
+LEASE = timedelta(minutes=5)
+
+
+def _claim(batch_size, now):
+    due = Notification.objects.filter(status='PENDING', next_attempt_at__lte=now)
+    ids = list(due.order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+
+    # Rows another dispatcher claimed since the read are no longer due
+    lease = uuid.uuid4().hex
+    due.filter(id__in=ids).update(lease=lease, next_attempt_at=now + LEASE, attempts=F('attempts') + 1)
+    return list(Notification.objects.filter(id__in=ids, lease=lease).order_by('id'))
+
+
+def _drop_outdated(rows):
+    """Mark notices whose token is no longer waiting DROPPED; returns the others."""
+    token_ids = {row.payload['token_id'] for row in rows if 'token_id' in row.payload}
+    waiting = set(Token.objects.filter(id__in=token_ids, status='WAITING').values_list('id', flat=True))
+    outdated = {row.id for row in rows if 'token_id' in row.payload and row.payload['token_id'] not in waiting}
+    Notification.objects.filter(id__in=outdated).update(status='DROPPED')
+    return [row for row in rows if row.id not in outdated]
+
+
+def _batch(rows):
+    """Messages for one recipient: the most urgent notice per token."""
+    urgent = {}
+    for row in rows:
+        key = row.payload.get('token_id', f"notification:{row.id}")
+        if key not in urgent or row.payload.get('people_ahead', 0) < urgent[key].payload.get('people_ahead', 0):
+            urgent[key] = row
+    return [
+        {"id": row.id, "kind": row.kind, **row.payload}
+        for row in sorted(urgent.values(), key=lambda row: row.id)
+    ]
+
+
+def dispatch(sink=None, batch_size=500):
+    """Deliver one batch of due notifications; returns ``(sent, failed, dropped)`` row counts."""
+    sink = sink or get_sink()
+    now = timezone.now()
+    claimed = _claim(batch_size, now)
+    rows = _drop_outdated(claimed)
+
+    by_recipient = defaultdict(list)
+    for row in rows:
+        by_recipient[row.recipient_id].append(row)
+
+    sent, failed = [], []
+    for recipient_id, recipient_rows in by_recipient.items():
+        try:
+            sink.deliver(recipient_id, _batch(recipient_rows))
+        except Exception as error:
+            for row in recipient_rows:
+                row.last_error = f"{type(error).__name__}: {error}"[:1000]
+                if row.attempts >= settings.NOTIFICATION_MAX_ATTEMPTS:
+                    row.status = 'FAILED'
+                else:
+                    backoff = settings.NOTIFICATION_RETRY_SECONDS * 2 ** (row.attempts - 1)
+                    row.next_attempt_at = timezone.now() + timedelta(seconds=backoff)
+            failed.extend(recipient_rows)
+        else:
+            sent.extend(row.id for row in recipient_rows)
+
+    if sent:
+        Notification.objects.filter(id__in=sent).update(status='SENT', sent_at=timezone.now(), last_error='')
+    if failed:
+        Notification.objects.bulk_update(failed, ['status', 'next_attempt_at', 'last_error'])
+    return len(sent), len(failed), len(claimed) - len(rows)
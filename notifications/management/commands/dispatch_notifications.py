@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from notifications.dispatcher import dispatch
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver due notifications from the outbox through NOTIFICATION_SINK, one batch "
+        "per recipient. Failed batches are retried with backoff."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--interval', type=float,
+            help="Keep running and dispatch every INTERVAL seconds",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            # Drain everything that is due before sleeping
+            while True:
+                sent, failed, dropped = dispatch(batch_size=options['batch_size'])
+                if sent or failed or dropped or options['verbosity'] > 1:
+                    self.stdout.write(f"Sent {sent} notification(s), {failed} failed, {dropped} outdated")
+                if sent + failed + dropped < options['batch_size']:
+                    break
+
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='lease',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.contrib.auth.models import User
+from django.db import models
+from django.utils import timezone
+
+
+class Notification(models.Model):
+    """Outbox row: written in the transaction of the change it reports, delivered later
+    by ``dispatch_notifications``.
+
+    ``dedupe_key`` is unique, so enqueueing the same notice twice keeps one.
+    """
+
+    STATUS_CHOICES = (
+        ('PENDING', 'Pending'),
+        ('SENT', 'Sent'),
+        ('FAILED', 'Failed'),
+        ('DROPPED', 'Dropped'),  # outdated before it could be sent
+    )
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notifications")
+    kind = models.CharField(max_length=30)
+    payload = models.JSONField(default=dict)
+    dedupe_key = models.CharField(max_length=100, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    # Due time of the next delivery attempt; pushed forward while one is in flight
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # Set by the dispatcher that claimed the row for its current attempt
+    lease = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The dispatcher's scan for due rows
+            models.Index(fields=['status', 'next_attempt_at'], name='notification_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} for {self.recipient_id} ({self.status})"
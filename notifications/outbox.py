@@ -0,0 +1,59 @@
+"""
+"Your turn is near" notices, enqueued in the transaction that moves a queue.
+
+When ``call_next`` advances a doctor's queue (or a priority change reorders
+it), the first waiting tokens in call order are read in one indexed query
+(as many as the largest threshold of ``NOTIFY_PEOPLE_AHEAD``, plus one).
+A token whose people-ahead count is at or below a threshold it hasn't been
+told about gets a notice for the smallest such threshold. A jump past several thresholds at once, after
+cancellations, sends only the most urgent notice. The dedupe key is
+(token, threshold), so every token hears about each threshold at most once.
+"""
+from django.conf import settings
+
+from queues.models import Token
+from .models import Notification
+
+
+TURN_NEAR = 'TURN_NEAR'
+
+
+def _message(doctor, people_ahead):
+    if people_ahead == 0:
+        return f"You are next for Dr. {doctor.name}"
+    noun = "patient" if people_ahead == 1 else "patients"
+    return f"{people_ahead} {noun} ahead of you for Dr. {doctor.name}"
+
+
+def enqueue_turn_notices(doctor, day):
+    """Queue notices for the waiting tokens of ``doctor``'s ``day`` that reached a threshold.
+
+    Call inside the transaction of the change.
+    """
+    thresholds = sorted(settings.NOTIFY_PEOPLE_AHEAD)
+    if not thresholds:
+        return
+
+    upcoming = Token.objects.filter(
+        doctor=doctor, date=day, status='WAITING',
+    ).order_by('ranked_at', 'token_number').values_list('id', 'patient_id', 'token_number')[:thresholds[-1] + 1]
+
+    notices = []
+    for people_ahead, (token_id, patient_id, token_number) in enumerate(upcoming):
+        threshold = next(t for t in thresholds if t >= people_ahead)
+        notices.append(Notification(
+            recipient_id=patient_id,
+            kind=TURN_NEAR,
+            dedupe_key=f"turn:{token_id}:{threshold}",
+            payload={
+                "doctor_id": doctor.id,
+                "doctor_name": doctor.name,
+                "token_id": token_id,
+                "token_number": token_number,
+                "people_ahead": people_ahead,
+                "message": _message(doctor, people_ahead),
+            },
+        ))
+
+    # Notices already queued are dropped by their unique dedupe key
+    Notification.objects.bulk_create(notices, ignore_conflicts=True)
@@ -0,0 +1,49 @@
+"""
+Where the dispatcher hands notifications over (``NOTIFICATION_SINK``).
+
+A sink has one method, ``deliver(recipient_id, messages)``, which sends
+one batch to one recipient and raises on failure. Every message carries
+its notification ``id``. A batch that was delivered but not yet marked
+sent when the dispatcher died comes again, so receivers drop ids they
+have seen.
+"""
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger('notifications')
+
+
+class LogSink:
+    """Writes each batch to the ``notifications`` logger."""
+
+    def deliver(self, recipient_id, messages):
+        for message in messages:
+            logger.info("notification %s to user %s: %s", message['id'], recipient_id, message['message'])
+
+
+class FileSink:
+    """Appends each batch as a JSON line to ``NOTIFICATION_FILE``; handy for testing."""
+
+    _lock = threading.Lock()
+
+    def __init__(self, path=None):
+        self.path = path or settings.NOTIFICATION_FILE
+
+    def deliver(self, recipient_id, messages):
+        line = json.dumps(
+            {"recipient_id": recipient_id, "delivered_at": timezone.now(), "messages": messages},
+            cls=DjangoJSONEncoder,
+        )
+        with self._lock, open(self.path, 'a', encoding='utf-8') as out:
+            out.write(line + '\n')
+
+
+def get_sink():
+    return import_string(settings.NOTIFICATION_SINK)()
@@ -0,0 +1,122 @@
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from queues.models import Doctor, Token
+from .dispatcher import LEASE, _claim, dispatch
+from .models import Notification
+from .outbox import enqueue_turn_notices
+
+
+class ListSink:
+
+    def __init__(self):
+        self.batches = []
+
+    def deliver(self, recipient_id, messages):
+        self.batches.append((recipient_id, messages))
+
+
+class BrokenSink:
+
+    def deliver(self, recipient_id, messages):
+        raise ConnectionError("down")
+
+
+@override_settings(NOTIFY_PEOPLE_AHEAD=(2, 0), NOTIFICATION_MAX_ATTEMPTS=2, NOTIFICATION_RETRY_SECONDS=30)
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        self.doctor = Doctor.objects.create(name="Notify", department="ENT")
+        self.today = timezone.now().date()
+        self.tokens = [
+            Token.objects.create(
+                doctor=self.doctor, patient=User.objects.create(username=f"notify-{number}"),
+                token_number=number, date=self.today,
+            )
+            for number in range(1, 6)
+        ]
+
+    def enqueue(self):
+        with transaction.atomic():
+            enqueue_turn_notices(self.doctor, self.today)
+
+    def test_enqueued_with_the_change(self):
+        self.enqueue()
+        # People ahead 0, 1, 2: the first is next, the others reached threshold 2
+        self.assertEqual(
+            sorted(Notification.objects.values_list('dedupe_key', flat=True)),
+            sorted([f"turn:{self.tokens[0].id}:0", f"turn:{self.tokens[1].id}:2", f"turn:{self.tokens[2].id}:2"]),
+        )
+
+    def test_rolled_back_change_enqueues_nothing(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            enqueue_turn_notices(self.doctor, self.today)
+            raise RuntimeError
+        self.assertFalse(Notification.objects.exists())
+
+    def test_dedupe(self):
+        self.enqueue()
+        self.enqueue()
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_sent_once(self):
+        self.enqueue()
+        sink = ListSink()
+        self.assertEqual(dispatch(sink), (3, 0, 0))
+        self.assertEqual(dispatch(sink), (0, 0, 0))
+        self.assertEqual(len(sink.batches), 3)
+        self.assertEqual(set(Notification.objects.values_list('status', flat=True)), {'SENT'})
+
+    def test_outdated_notice_dropped(self):
+        self.enqueue()
+        Token.objects.filter(id=self.tokens[0].id).update(status='CANCELLED')
+        self.assertEqual(dispatch(ListSink()), (2, 0, 1))
+
+    def test_retry_with_backoff_then_failed(self):
+        self.enqueue()
+        start = timezone.now()
+        self.assertEqual(dispatch(BrokenSink()), (0, 3, 0))
+
+        row = Notification.objects.first()
+        self.assertEqual((row.status, row.attempts), ('PENDING', 1))
+        self.assertGreaterEqual(row.next_attempt_at, start + timedelta(seconds=30))
+        self.assertEqual(dispatch(BrokenSink()), (0, 0, 0))  # not due yet
+
+        later = timezone.now() + timedelta(minutes=1)
+        with mock.patch('notifications.dispatcher.timezone.now', return_value=later):
+            self.assertEqual(dispatch(BrokenSink()), (0, 3, 0))
+        self.assertEqual(set(Notification.objects.values_list('status', flat=True)), {'FAILED'})
+
+    def test_lease_expires_after_a_crash(self):
+        self.enqueue()
+        self.assertEqual(len(_claim(500, timezone.now())), 3)  # the dispatcher dies here
+
+        self.assertEqual(dispatch(ListSink()), (0, 0, 0))
+        after_lease = timezone.now() + LEASE + timedelta(seconds=1)
+        with mock.patch('notifications.dispatcher.timezone.now', return_value=after_lease):
+            self.assertEqual(dispatch(ListSink()), (3, 0, 0))
+        self.assertEqual(set(Notification.objects.values_list('attempts', flat=True)), {2})
+
+    def test_concurrent_dispatchers_claim_disjoint_rows(self):
+        self.enqueue()
+        claimed = {}
+        new_lease = uuid.uuid4
+
+        def other_dispatcher_first():
+            # A second dispatcher claims between this one's read and its update
+            if 'other' not in claimed:
+                claimed['other'] = None
+                claimed['other'] = _claim(500, timezone.now())
+            return new_lease()
+
+        with mock.patch('notifications.dispatcher.uuid.uuid4', side_effect=other_dispatcher_first):
+            mine = _claim(500, timezone.now())
+
+        self.assertEqual(len(claimed['other']), 3)
+        self.assertEqual(mine, [])
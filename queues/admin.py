@@ -1,8 +1,39 @@
 from django.contrib import admin
+from django.db import transaction
 
-# Register your models here.
-from django.contrib import admin
+from . import journal
+from .engine import queue_engine
 from .models import Doctor, Token
+from .sequences import next_queue_version
 
 admin.site.register(Doctor)
-admin.site.register(Token)
+
+
+@admin.register(Token)
+class TokenAdmin(admin.ModelAdmin):
+    """Browse tokens; queue changes go through the queue endpoints.
+
+    Editing a token here would skip its queue version and the journal, so
+    no worker's in-memory queue would notice. Deletions are allowed and
+    recorded like ``delete_token``.
+    """
+
+    list_display = ('doctor', 'date', 'token_number', 'patient', 'status', 'priority')
+    list_filter = ('date', 'status', 'priority')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Token.objects.filter(id=obj.id))
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            for token in queryset.select_for_update():
+                token.version = next_queue_version(token.doctor_id, token.date)
+                journal.record('DELETED', token)
+                queue_engine.remove(token, event='deleted')
+                token.delete()
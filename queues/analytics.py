@@ -0,0 +1,147 @@
+"""
+Daily per-doctor rollups (``DoctorDailyRollup``) and range queries over them.
+
+Only closed days (before today) are rolled up. Each run picks up, per
+doctor, the days after the last one already rolled up, reading that
+doctor's tokens through the (doctor, date, ...) indexes of the live and
+archive tables, so the cost follows the new days rather than the table size.
+"""
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Max, Sum
+
+from .archive import token_history
+from .models import Doctor, DoctorDailyRollup
+
+
+def _percentile(ordered, pct):
+    """Linear-interpolated percentile of an already sorted list."""
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * pct / 100
+    low, high = math.floor(position), math.ceil(position)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def _summarize_day(doctor_id, day, tokens):
+    rollup = DoctorDailyRollup(doctor_id=doctor_id, date=day, tokens_issued=len(tokens))
+    durations, waits = [], []
+
+    for status, actual_duration, created_at, start_time in tokens:
+        if status == 'COMPLETED':
+            rollup.completed += 1
+        elif status == 'SKIPPED':
+            rollup.skipped += 1
+        elif status == 'CANCELLED':
+            rollup.cancelled += 1
+
+        if actual_duration is not None:
+            durations.append(actual_duration)
+        if start_time is not None:
+            waits.append(max((start_time - created_at).total_seconds() / 60, 0.0))
+
+    durations.sort()
+    waits.sort()
+
+    rollup.consultations = len(durations)
+    rollup.duration_total = sum(durations)
+    if durations:
+        rollup.duration_mean = rollup.duration_total / len(durations)
+    rollup.duration_p50 = _percentile(durations, 50)
+    rollup.duration_p90 = _percentile(durations, 90)
+
+    rollup.waits = len(waits)
+    rollup.wait_total = sum(waits)
+    if waits:
+        rollup.wait_mean = rollup.wait_total / len(waits)
+    rollup.wait_p50 = _percentile(waits, 50)
+    rollup.wait_p90 = _percentile(waits, 90)
+    return rollup
+
+
+def rollup_doctor(doctor_id, until, since=None):
+    """Roll up ``doctor_id``'s days before ``until``.
+
+    By default only days after the doctor's last rollup are processed.
+    ``since`` recomputes every day from that date on, replacing existing rows.
+    Returns the number of days written.
+    """
+    filters = {'doctor_id': doctor_id, 'date__lt': until}
+    if since is not None:
+        filters['date__gte'] = since
+    else:
+        last = DoctorDailyRollup.objects.filter(doctor_id=doctor_id).aggregate(last=Max('date'))['last']
+        if last is not None:
+            filters['date__gt'] = last
+
+    rows = token_history(lambda tokens: tokens.filter(**filters).values_list(
+        'date', 'status', 'actual_duration', 'created_at', 'start_time',
+    ))
+    days = defaultdict(list)
+    for day, *row in rows:
+        days[day].append(row)
+
+    rollups = [_summarize_day(doctor_id, day, rows) for day, rows in sorted(days.items())]
+
+    with transaction.atomic():
+        if since is not None:
+            DoctorDailyRollup.objects.filter(doctor_id=doctor_id, date__gte=since, date__lt=until).delete()
+        DoctorDailyRollup.objects.bulk_create(rollups)
+    return len(rollups)
+
+
+def rollup_all(until, since=None, doctor_ids=None):
+    if doctor_ids is None:
+        doctor_ids = Doctor.objects.values_list('id', flat=True)
+    return {doctor_id: rollup_doctor(doctor_id, until, since) for doctor_id in doctor_ids}
+
+
+ROLLUP_FIELDS = (
+    'date', 'tokens_issued', 'completed', 'skipped', 'cancelled',
+    'consultations', 'duration_mean', 'duration_p50', 'duration_p90',
+    'waits', 'wait_mean', 'wait_p50', 'wait_p90',
+)
+
+SUM_FIELDS = (
+    'tokens_issued', 'completed', 'skipped', 'cancelled',
+    'consultations', 'duration_total', 'waits', 'wait_total',
+)
+
+
+def _with_means(totals):
+    totals['avg_consultation_minutes'] = (
+        totals.pop('duration_total') / totals['consultations'] if totals['consultations'] else None
+    )
+    totals['avg_wait_minutes'] = (
+        totals.pop('wait_total') / totals['waits'] if totals['waits'] else None
+    )
+    return totals
+
+
+def doctor_range(doctor_id, start, end):
+    """Per-day rows and exact range totals for one doctor, ``start``..``end`` inclusive."""
+    rollups = DoctorDailyRollup.objects.filter(doctor_id=doctor_id, date__range=(start, end))
+    days = list(rollups.order_by('date').values(*ROLLUP_FIELDS))
+
+    totals = rollups.aggregate(**{field: Sum(field, default=0) for field in SUM_FIELDS})
+    return days, _with_means(totals)
+
+
+def doctors_range(start, end):
+    """Range totals per doctor, one grouped query."""
+    rows = (
+        DoctorDailyRollup.objects.filter(date__range=(start, end))
+        .values('doctor_id')
+        .annotate(doctor_name=F('doctor__name'), **{field + '_sum': Sum(field) for field in SUM_FIELDS})
+        .order_by('doctor_id')
+    )
+    return [
+        _with_means({
+            'doctor_id': row['doctor_id'],
+            'doctor_name': row['doctor_name'],
+            **{field: row[field + '_sum'] for field in SUM_FIELDS},
+        })
+        for row in rows
+    ]
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class QueuesConfig(AppConfig):
     name = 'queues'
+
+    def ready(self):
+        # Connects the doctor directory's invalidation signals
+        from . import directory  # noqa: F401
@@ -0,0 +1,121 @@
+"""
+Moving closed days out of the live ``Token`` table.
+
+Finished tokens (``CLOSED_STATUSES``) of days before the cutoff, and the
+swap requests involving them, are moved in chunks of ids (lowest first) into ``ArchivedToken`` and
+``ArchivedSwapRequest``, or written to gzipped JSON Lines files and deleted.
+A chunk is copied and deleted in one transaction; an exported chunk is
+written under a name derived from its first id before the rows are deleted,
+so an interrupted run simply picks up again from the lowest remaining id
+(rewriting the same file if it stopped in between).
+
+Tokens still WAITING or SERVING on a closed day were never finished or
+cancelled, and only staff can say which happened, so they stay in the live
+table (``open_before`` counts them; ``archive_tokens`` reports it). The
+queue only loads today's tokens, so they no longer affect anyone's place.
+
+Readers of history (``analytics``, ``prediction``) go through
+``token_history`` so archived days keep counting.
+"""
+import gzip
+import json
+import os
+from itertools import chain
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+
+from swaps.models import ArchivedSwapRequest, SwapRequest
+
+from .models import ArchivedToken, Token
+
+
+CLOSED_STATUSES = ('COMPLETED', 'SKIPPED', 'CANCELLED')
+
+TOKEN_FIELDS = tuple(field.attname for field in Token._meta.concrete_fields)
+SWAP_FIELDS = tuple(field.attname for field in SwapRequest._meta.concrete_fields)
+
+
+def token_history(query):
+    """``query`` applied to live and to archived tokens, results chained.
+
+    ``query`` takes a queryset and returns an iterable, e.g.
+    ``lambda tokens: tokens.filter(doctor_id=1).values_list('date', 'status')``;
+    it may only use columns the two models share.
+    """
+    return chain(query(ArchivedToken.objects.all()), query(Token.objects.all()))
+
+
+def _swaps(token_ids):
+    return SwapRequest.objects.filter(Q(from_token_id__in=token_ids) | Q(to_token_id__in=token_ids))
+
+
+def _closed_swap(row):
+    if row['status'] == 'PENDING':
+        # Nobody can accept a request once its day is over
+        row['status'] = 'EXPIRED'
+    return row
+
+
+def open_before(cutoff):
+    """Tokens dated before ``cutoff`` that were left WAITING or SERVING."""
+    return Token.objects.filter(date__lt=cutoff).exclude(status__in=CLOSED_STATUSES).count()
+
+
+def archive_chunk(cutoff, batch_size, export_dir=None):
+    """Archive up to ``batch_size`` finished tokens dated before ``cutoff``.
+
+    Returns ``(tokens, swaps)`` moved; ``(0, 0)`` once nothing is left.
+    """
+    token_ids = list(
+        Token.objects.filter(date__lt=cutoff, status__in=CLOSED_STATUSES).order_by('id').values_list('id', flat=True)[:batch_size]
+    )
+    if not token_ids:
+        return 0, 0
+
+    if export_dir is not None:
+        _export(export_dir, token_ids)
+
+    with transaction.atomic():
+        tokens = Token.objects.filter(id__in=token_ids)
+        swaps = _swaps(token_ids)
+        if export_dir is None:
+            ArchivedToken.objects.bulk_create(
+                [ArchivedToken(**row) for row in tokens.values(*TOKEN_FIELDS)],
+                ignore_conflicts=True,
+            )
+            ArchivedSwapRequest.objects.bulk_create(
+                [ArchivedSwapRequest(**_closed_swap(row)) for row in swaps.values(*SWAP_FIELDS)],
+                ignore_conflicts=True,
+            )
+        swap_count, _ = swaps.delete()
+        token_count, _ = tokens.delete()
+    # Swaps went first, so nothing cascaded from the tokens
+    return token_count, swap_count
+
+
+def _export(export_dir, token_ids):
+    path = os.path.join(export_dir, f"tokens-{token_ids[0]:012d}.jsonl.gz")
+    partial = path + '.partial'
+
+    with gzip.open(partial, 'wt', encoding='utf-8') as out:
+        for row in Token.objects.filter(id__in=token_ids).order_by('id').values(*TOKEN_FIELDS):
+            out.write(json.dumps({'kind': 'token', **row}, cls=DjangoJSONEncoder) + '\n')
+        for row in _swaps(token_ids).order_by('id').values(*SWAP_FIELDS):
+            out.write(json.dumps({'kind': 'swap', **_closed_swap(row)}, cls=DjangoJSONEncoder) + '\n')
+    os.replace(partial, path)
+    return path
+
+
+def archive_before(cutoff, batch_size=1000, export_dir=None, progress=None):
+    """Archive every finished token dated before ``cutoff``, chunk by chunk."""
+    total_tokens = total_swaps = 0
+    while True:
+        tokens, swaps = archive_chunk(cutoff, batch_size, export_dir)
+        if not tokens:
+            return total_tokens, total_swaps
+        total_tokens += tokens
+        total_swaps += swaps
+        if progress is not None:
+            progress(total_tokens, total_swaps)
@@ -0,0 +1,113 @@
+"""
+Cached doctor directory for ``/api/queues/doctors/``.
+
+The whole directory is cached as one snapshot: every doctor, plus an index
+by department, each listing with a strong ETag over its content. The
+snapshot key includes a version token kept in the database
+(``DoctorDirectoryVersion``), which ``Doctor`` save/delete signals replace
+in the transaction of the change. Each process re-reads the token at most
+every DOCTOR_DIRECTORY_SYNC_SECONDS, so it picks up changes made by other
+workers whether or not they share its cache; its own changes apply at once.
+
+Bulk writes (``bulk_create``, ``QuerySet.update``) send no signals; call
+``invalidate()`` after them.
+"""
+import hashlib
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Doctor, DoctorDirectoryVersion
+
+
+# The token this process last read, and when (time.monotonic())
+_known = (None, float('-inf'))
+
+
+def _etag(rows):
+    payload = json.dumps(rows, sort_keys=True, separators=(',', ':')).encode()
+    return '"%s"' % hashlib.sha1(payload).hexdigest()
+
+
+def department_key(department):
+    return department.strip().casefold()
+
+
+def _build():
+    rows = list(Doctor.objects.order_by('id').values('id', 'name', 'department'))
+
+    departments = {}
+    for row in rows:
+        departments.setdefault(department_key(row['department']), []).append(row)
+
+    return {
+        'all': (rows, _etag(rows)),
+        'departments': {key: (listing, _etag(listing)) for key, listing in departments.items()},
+    }
+
+
+def version():
+    """Token that changes whenever any doctor is saved or deleted."""
+    global _known
+    token, read_at = _known
+    if token is None or time.monotonic() - read_at >= settings.DOCTOR_DIRECTORY_SYNC_SECONDS:
+        read_at = time.monotonic()
+        token = DoctorDirectoryVersion.objects.filter(pk=1).values_list('token', flat=True).first()
+        if token is None:
+            token = _replace_token()
+        _known = (token, read_at)
+    return token
+
+
+def _replace_token():
+    token = uuid.uuid4().hex
+    if not DoctorDirectoryVersion.objects.filter(pk=1).update(token=token):
+        try:
+            with transaction.atomic():
+                DoctorDirectoryVersion.objects.create(pk=1, token=token)
+        except IntegrityError:
+            # Created concurrently
+            DoctorDirectoryVersion.objects.filter(pk=1).update(token=token)
+    return token
+
+
+def _forget():
+    global _known
+    _known = (None, float('-inf'))
+
+
+def _snapshot():
+    key = f'doctor_directory:{version()}'
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = _build()
+        cache.set(key, snapshot, None)
+    return snapshot
+
+
+def listing(department=None):
+    """``(rows, etag)`` for all doctors, or those in ``department`` (case-insensitive)."""
+    snapshot = _snapshot()
+    if not department:
+        return snapshot['all']
+    return snapshot['departments'].get(department_key(department), ([], _etag([])))
+
+
+def invalidate():
+    """Give the directory a new version; call in the transaction of the change."""
+    # Old snapshots are left to the cache's own eviction. The new token
+    # commits with the change, so whoever reads it also reads the change.
+    _replace_token()
+    transaction.on_commit(_forget)
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def doctor_changed(sender, **kwargs):
+    invalidate()
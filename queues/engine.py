@@ -0,0 +1,674 @@
+"""
+In-memory state of every doctor's queue for the current day.
+
+Views keep writing to the ``Token`` table and then hand the tokens they
+changed to ``queue_engine``. Polling endpoints such as ``queue_status`` read
+rank, serving token and average duration from here without touching the DB.
+The expected consultation time blends the doctor's historical profile for
+the current weekday and hour (``ConsultationProfile``) with today's
+consultations.
+
+Waiting tokens are kept in call order, ``(ranked_at, token_number)``, where
+``ranked_at`` gives higher priority classes a head start. ETAs also count
+the higher-priority patients expected to join, at today's rate of each
+class, and be called first.
+
+A doctor's queue is loaded from the ``Token`` table the first time it is
+asked for after the process starts (or after the date changes), so the
+engine rebuilds itself lazily on startup. Each process has its own engine:
+changes made in this process are applied when they commit, and at most
+every ``QUEUE_ENGINE_SYNC_SECONDS`` the loaded queues are checked against
+their ``TokenSequence`` version, which every write bumps, so queues changed
+by other workers are reloaded. Writes to today's tokens must therefore go
+through ``next_queue_version`` (the views, swaps and the Token admin do).
+Loads run outside the engine's lock, which only guards in-memory updates.
+
+For department joins, ``least_loaded`` keeps each department's doctors in a
+heap ordered by when a new patient would be called, updated on every
+change, so assignment costs O(log n) rather than a count per doctor.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from datetime import date, datetime
+from heapq import heapify, heappop, heappush, heapreplace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from . import directory
+from .models import ConsultationProfile, Doctor, DoctorDayStats, Token, TokenSequence
+from .streaming import broadcaster
+
+
+ACTIVE_STATUSES = ('WAITING', 'SERVING')
+# Statuses whose actual_duration counts as consultation time (see DoctorDayStats)
+TIMED_STATUSES = ('COMPLETED', 'SKIPPED')
+
+
+def default_consultation_minutes():
+    return getattr(settings, 'QUEUE_DEFAULT_CONSULTATION_MINUTES', 10)
+
+
+def profile_slot(moment):
+    """Index of ``moment``'s local weekday and hour in a doctor's profile."""
+    local = timezone.localtime(moment)
+    return local.weekday() * 24 + local.hour
+
+
+def blend_duration(prior, live_count, live_mean):
+    """Historical ``prior`` weighted as ConsultationProfile.PRIOR_WEIGHT consultations against today's."""
+    if not live_count:
+        return prior
+    weight = ConsultationProfile.PRIOR_WEIGHT
+    return (weight * prior + live_count * live_mean) / (weight + live_count)
+
+
+def estimate_wait(avg_time, people_ahead, serving_minutes=None):
+    """Minutes until a patient with ``people_ahead`` waiting before them is called.
+
+    ``serving_minutes`` is how long the current consultation has been running.
+    """
+    remaining_time = 0
+    if serving_minutes is not None:
+        remaining_time = max(avg_time - serving_minutes, 0)
+
+    if people_ahead > 0:
+        return remaining_time + (people_ahead - 1) * avg_time
+    return remaining_time
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+@dataclass
+class TokenState:
+    id: int
+    doctor_id: int
+    patient_id: int
+    token_number: int
+    status: str
+    date: date
+    start_time: datetime = None
+    actual_duration: float = None
+    version: int = 0
+    priority: int = 0
+    ranked_at: datetime = None
+    created_at: datetime = None
+
+    @classmethod
+    def from_token(cls, token):
+        return cls(
+            id=token.id,
+            doctor_id=token.doctor_id,
+            patient_id=token.patient_id,
+            token_number=token.token_number,
+            status=token.status,
+            date=_as_date(token.date),
+            start_time=token.start_time,
+            actual_duration=token.actual_duration,
+            version=token.version,
+            priority=token.priority,
+            ranked_at=token.ranked_at,
+            created_at=token.created_at,
+        )
+
+    @property
+    def position(self):
+        """Sort key of the call order."""
+        return (self.ranked_at, self.token_number)
+
+    @property
+    def counts_towards_average(self):
+        return self.status in TIMED_STATUSES and self.actual_duration is not None
+
+
+class RunningStats:
+    """In-memory mirror of a ``DoctorDayStats`` row."""
+
+    def __init__(self, count=0, total=0.0, total_squares=0.0, ewma=None):
+        self.count = count
+        self.total = total
+        self.total_squares = total_squares
+        self.ewma = ewma
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.count, row.total, row.total_squares, row.ewma)
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.total_squares += duration * duration
+        if self.ewma is None:
+            self.ewma = duration
+        else:
+            self.ewma += DoctorDayStats.EWMA_ALPHA * (duration - self.ewma)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class DoctorQueue:
+    """Today's queue of a single doctor."""
+
+    def __init__(self, doctor_id, day):
+        self.doctor_id = doctor_id
+        self.date = day
+        self.tokens = {}             # token id -> TokenState
+        self.waiting = []            # call-order positions of WAITING tokens, sorted
+        self.active_by_patient = {}  # patient id -> token id
+        self.serving_id = None
+        self.stats = RunningStats()
+        self.fallback_minutes = default_consultation_minutes()
+        self.profile = None          # 168 expected minutes by weekday/hour, if built
+        self.version = 0
+        self.loaded_version = 0
+        self.arrivals = {}           # priority class above normal -> tokens issued today
+        self.opened_at = None        # first join of the day
+
+    # 🔹 Mutations
+
+    def apply(self, state, count=True):
+        old = self.tokens.get(state.id)
+        if old is not None:
+            self._detach(old)
+            if old.priority != state.priority:
+                # Triaged after joining: count it as an arrival of its new class
+                self._count_arrival(old.priority, -1)
+                self._count_arrival(state.priority, 1)
+        else:
+            self._arrived(state)
+        self.tokens[state.id] = state
+        self._attach(state)
+
+        if count and state.counts_towards_average and not (old and old.counts_towards_average):
+            self.stats.add(state.actual_duration)
+        self.version = max(self.version, state.version)
+
+    def remove(self, state):
+        old = self.tokens.pop(state.id, None)
+        if old is not None:
+            self._detach(old)
+        self.version = max(self.version, state.version)
+
+    def _count_arrival(self, priority, step):
+        if priority:
+            self.arrivals[priority] = self.arrivals.get(priority, 0) + step
+
+    def _arrived(self, state):
+        self._count_arrival(state.priority, 1)
+        if state.created_at is not None and (self.opened_at is None or state.created_at < self.opened_at):
+            self.opened_at = state.created_at
+
+    def _attach(self, state):
+        if state.status == 'WAITING':
+            insort(self.waiting, state.position)
+        elif state.status == 'SERVING':
+            self.serving_id = state.id
+
+        if state.status in ACTIVE_STATUSES:
+            self.active_by_patient[state.patient_id] = state.id
+
+    def _detach(self, state):
+        if state.status == 'WAITING':
+            index = bisect_left(self.waiting, state.position)
+            if index < len(self.waiting) and self.waiting[index] == state.position:
+                del self.waiting[index]
+        elif state.status == 'SERVING' and self.serving_id == state.id:
+            self.serving_id = None
+
+        if self.active_by_patient.get(state.patient_id) == state.id:
+            del self.active_by_patient[state.patient_id]
+
+    # 🔹 Reads
+
+    @property
+    def serving(self):
+        return self.tokens.get(self.serving_id)
+
+    def people_ahead(self, state):
+        return bisect_left(self.waiting, state.position)
+
+    def expected_arrivals_ahead(self, ranked_at, wait_minutes, now):
+        """Higher-priority patients expected to join in the next ``wait_minutes`` and
+        be called before a token ranked at ``ranked_at``, at today's arrival rates."""
+        if not self.arrivals or self.opened_at is None:
+            return 0.0
+
+        # At least an hour, so the first urgent case of the day isn't taken for a trend
+        elapsed = max((now - self.opened_at).total_seconds() / 60, 60)
+        expected = 0.0
+        for priority, count in self.arrivals.items():
+            # A later arrival goes first while its head start reaches back past ranked_at
+            window = min((ranked_at + Token.head_start(priority) - now).total_seconds() / 60, wait_minutes)
+            if window > 0:
+                expected += count / elapsed * window
+        return expected
+
+    def _wait(self, avg_time, people_ahead, ranked_at, now):
+        current_token = self.serving
+        serving_minutes = None
+        if current_token and current_token.start_time:
+            serving_minutes = (now - current_token.start_time).total_seconds() / 60
+
+        wait = estimate_wait(avg_time, people_ahead, serving_minutes)
+        return wait + self.expected_arrivals_ahead(ranked_at, wait, now) * avg_time
+
+    def average_duration(self, now=None):
+        if self.profile is None:
+            if self.stats.count:
+                return self.stats.mean
+            return self.fallback_minutes
+
+        prior = self.profile[profile_slot(now or timezone.now())]
+        return blend_duration(prior, self.stats.count, self.stats.mean)
+
+    def status_for(self, patient_id, now=None):
+        token_id = self.active_by_patient.get(patient_id)
+        if token_id is None:
+            return None
+
+        now = now or timezone.now()
+        patient_token = self.tokens[token_id]
+        current_token = self.serving
+        avg_time = self.average_duration(now)
+
+        people_ahead = self.people_ahead(patient_token)
+        estimated_wait = self._wait(avg_time, people_ahead, patient_token.ranked_at, now)
+
+        return {
+            "currently_serving": current_token.token_number if current_token else 0,
+            "your_token": patient_token.token_number,
+            "people_ahead": people_ahead,
+            "estimated_wait_minutes": round(estimated_wait, 1),
+            "average_consultation_time": round(avg_time, 1),
+            "total_in_queue": len(self.waiting),
+        }
+
+    def free_at(self, now):
+        """When a patient joining now would be called (epoch seconds), by the ``status_for`` estimate."""
+        wait = self._wait(self.average_duration(now), len(self.waiting), now, now)
+        return now.timestamp() + wait * 60
+
+    def occupancy(self, now=None):
+        current_token = self.serving
+        return {
+            "currently_serving": current_token.token_number if current_token else 0,
+            "waiting": len(self.waiting),
+            "consulted_today": self.stats.count,
+            "average_consultation_time": round(self.average_duration(now), 1),
+        }
+
+    def delta(self, event, states):
+        """Small change notice pushed to streaming subscribers."""
+        current_token = self.serving
+        return {
+            "event": event,
+            "doctor_id": self.doctor_id,
+            "currently_serving": current_token.token_number if current_token else 0,
+            "total_in_queue": len(self.waiting),
+            "tokens": [
+                {"token_number": state.token_number, "status": state.status}
+                for state in states
+            ],
+        }
+
+
+class DepartmentIndex:
+    """A department's doctors in a min-heap by ``DoctorQueue.free_at``.
+
+    Every change to one of the queues pushes a new entry for that doctor;
+    superseded entries are dropped when they reach the top.
+    """
+
+    def __init__(self, version, day, queues):
+        self.version = version  # of the doctor directory it was built from
+        self.date = day
+        self.queues = queues  # doctor id -> DoctorQueue
+        self.heap = []
+        self.entries = {}     # doctor id -> its current heap entry
+
+        now = timezone.now()
+        for queue in queues.values():
+            self.push(queue, now)
+
+    def _entry(self, queue, now):
+        # Ties (idle doctors) go to the shorter queue, then the lower id
+        return (queue.free_at(now), len(queue.waiting), queue.doctor_id)
+
+    def push(self, queue, now):
+        entry = self.entries[queue.doctor_id] = self._entry(queue, now)
+        heappush(self.heap, entry)
+        if len(self.heap) > 4 * len(self.entries) + 64:
+            self.heap = list(self.entries.values())
+            heapify(self.heap)
+
+    def least_loaded(self, now):
+        while self.heap:
+            entry = self.heap[0]
+            doctor_id = entry[2]
+            if self.entries[doctor_id] != entry:
+                heappop(self.heap)
+                continue
+
+            # Keys are stable while consultations take their expected time; a
+            # key in the past just means free now. Only an overrun moves it on.
+            fresh = self._entry(self.queues[doctor_id], now)
+            if fresh[0] > max(entry[0], now.timestamp()) + 1:
+                self.entries[doctor_id] = fresh
+                heapreplace(self.heap, fresh)
+                continue
+            return doctor_id
+        return None
+
+
+class QueueEngine:
+
+    def __init__(self):
+        # Guards the in-memory state only; never held across a DB query
+        self._lock = threading.RLock()
+        self._queues = {}
+        self._indexes = {}   # department key (see directory) -> DepartmentIndex
+        self._index_of = {}  # doctor id -> DepartmentIndex
+        self._loading = {}   # doctor id -> number of loads in flight
+        self._pending = {}   # doctor id -> changes committed while it was loading
+        self._next_sync = 0.0
+
+    def get(self, doctor_id):
+        """Today's queue for ``doctor_id``; raises Doctor.DoesNotExist."""
+        queue = self.get_many([doctor_id]).get(doctor_id)
+        if queue is None:
+            raise Doctor.DoesNotExist
+        return queue
+
+    async def aget(self, doctor_id):
+        """``get`` for async views: a loaded, checked queue is returned without leaving the event loop."""
+        queue = self._queues.get(doctor_id)
+        if queue is not None and queue.date == timezone.now().date() and not self._sync_due():
+            return queue
+        return await sync_to_async(self.get)(doctor_id)
+
+    async def astatus_for(self, doctor_id, patient_id):
+        queue = await self.aget(doctor_id)
+        # Don't block the event loop on a thread that is applying a change
+        if self._lock.acquire(blocking=False):
+            try:
+                return queue.status_for(patient_id)
+            finally:
+                self._lock.release()
+        return await sync_to_async(self._status_for, thread_sensitive=False)(queue, patient_id)
+
+    def get_many(self, doctor_ids):
+        """Today's queues by doctor id, loading the missing ones together; unknown ids are left out."""
+        today = timezone.now().date()
+        stale = self._stale(today)
+
+        found, missing = {}, []
+        for doctor_id in set(doctor_ids):
+            queue = self._queues.get(doctor_id)
+            if queue is None or queue.date != today or doctor_id in stale:
+                missing.append(doctor_id)
+            else:
+                found[doctor_id] = queue
+
+        # Queues another process changed are reloaded even if nobody asked for them now
+        reload = missing + [doctor_id for doctor_id in stale if doctor_id not in found and doctor_id not in missing]
+        if reload:
+            loaded = self._refresh(reload, today)
+            found.update({doctor_id: loaded[doctor_id] for doctor_id in missing if doctor_id in loaded})
+
+            # Streaming subscribers here missed those changes (see streaming)
+            with self._lock:
+                deltas = [
+                    (doctor_id, self._queues[doctor_id].delta('reloaded', []))
+                    for doctor_id in stale if doctor_id in loaded
+                ]
+            for doctor_id, delta in deltas:
+                broadcaster.publish(doctor_id, delta)
+        return found
+
+    def status_for(self, doctor_id, patient_id):
+        return self._status_for(self.get(doctor_id), patient_id)
+
+    def _status_for(self, queue, patient_id):
+        with self._lock:
+            return queue.status_for(patient_id)
+
+    def statuses_for(self, doctor_ids, patient_id):
+        """``status_for`` of ``patient_id`` in each of ``doctor_ids`` where they are queued."""
+        queues = self.get_many(doctor_ids)
+        with self._lock:
+            now = timezone.now()
+            statuses = {}
+            for doctor_id, queue in queues.items():
+                status = queue.status_for(patient_id, now)
+                if status is not None:
+                    statuses[doctor_id] = status
+            return statuses
+
+    def occupancy(self, doctor_ids):
+        """``DoctorQueue.occupancy`` by doctor id; unknown ids are left out."""
+        queues = self.get_many(doctor_ids)
+        with self._lock:
+            now = timezone.now()
+            return {doctor_id: queue.occupancy(now) for doctor_id, queue in queues.items()}
+
+    def least_loaded(self, department):
+        """Id of the doctor in ``department`` who would call a patient joining now the soonest.
+
+        None if the department has no doctors.
+        """
+        key = directory.department_key(department)
+        version = directory.version()
+        today = timezone.now().date()
+
+        index = self._indexes.get(key)
+        if index is None or index.version != version or index.date != today:
+            # Built again whenever the directory changes; doctors rarely do
+            doctors, _ = directory.listing(department)
+            queues = self.get_many([doctor['id'] for doctor in doctors])
+            with self._lock:
+                # Queues reloaded in the meantime replace the ones fetched above
+                queues = {doctor_id: self._queues.get(doctor_id, queue) for doctor_id, queue in queues.items()}
+                index = DepartmentIndex(version, today, queues)
+                self._indexes[key] = index
+                for doctor_id in index.queues:
+                    self._index_of[doctor_id] = index
+        else:
+            # Brings queues changed by other processes into the index
+            self.get_many(list(index.queues))
+
+        with self._lock:
+            return index.least_loaded(timezone.now())
+
+    def apply(self, *tokens, event='updated'):
+        """Record the current state of ``tokens`` once the transaction commits."""
+        states = [TokenState.from_token(token) for token in tokens]
+        transaction.on_commit(lambda: self._apply(states, event))
+
+    def remove(self, *tokens, event='removed'):
+        """Forget ``tokens`` once the transaction commits; call before deleting."""
+        states = [TokenState.from_token(token) for token in tokens]
+        for state in states:
+            state.status = 'REMOVED'
+        transaction.on_commit(lambda: self._remove(states, event))
+
+    def reset(self):
+        with self._lock:
+            self._queues.clear()
+            self._indexes.clear()
+            self._index_of.clear()
+            self._next_sync = 0.0
+
+    def _sync_due(self):
+        return time.monotonic() >= self._next_sync
+
+    def _stale(self, today):
+        """Ids of loaded queues whose ``TokenSequence`` version moved past theirs.
+
+        Every write to a queue bumps that version, in whichever process it
+        runs, so this catches the changes this process never saw. Checked
+        at most every QUEUE_ENGINE_SYNC_SECONDS, in one query.
+        """
+        if not self._sync_due():
+            return set()
+        self._next_sync = time.monotonic() + settings.QUEUE_ENGINE_SYNC_SECONDS
+
+        loaded = {
+            doctor_id: queue.version
+            for doctor_id, queue in list(self._queues.items())
+            if queue.date == today
+        }
+        if not loaded:
+            return set()
+        versions = TokenSequence.objects.filter(
+            doctor_id__in=list(loaded), date=today
+        ).values_list('doctor_id', 'version')
+        return {doctor_id for doctor_id, version in versions if version > loaded[doctor_id]}
+
+    def _refresh(self, doctor_ids, today):
+        """Load ``doctor_ids`` outside the lock and install the result; returns the loaded queues."""
+        with self._lock:
+            for doctor_id in doctor_ids:
+                self._loading[doctor_id] = self._loading.get(doctor_id, 0) + 1
+                self._pending.setdefault(doctor_id, [])
+
+        loaded = {}
+        try:
+            loaded = self._load_many(doctor_ids, today)
+        finally:
+            with self._lock:
+                now = timezone.now()
+                for doctor_id, queue in loaded.items():
+                    self._install(queue, self._pending[doctor_id], now)
+                for doctor_id in doctor_ids:
+                    self._loading[doctor_id] -= 1
+                    if not self._loading[doctor_id]:
+                        del self._loading[doctor_id]
+                        del self._pending[doctor_id]
+        return loaded
+
+    def _install(self, queue, pending, now):
+        # Changes that committed while the queue loaded. Those at or below the
+        # version read before the tokens are already in it.
+        for change, state in pending:
+            current = queue.tokens.get(state.id)
+            if (state.date == queue.date and state.version > queue.loaded_version
+                    and (current is None or current.version <= state.version)):
+                change(queue, state)
+
+        self._queues[queue.doctor_id] = queue
+        index = self._index_of.get(queue.doctor_id)
+        if index is not None and index.date == queue.date:
+            index.queues[queue.doctor_id] = queue
+            index.push(queue, now)
+
+    def _apply(self, states, event):
+        self._update(states, event, DoctorQueue.apply)
+
+    def _remove(self, states, event):
+        self._update(states, event, DoctorQueue.remove)
+
+    def _update(self, states, event, change):
+        deltas = []
+        with self._lock:
+            touched = {}
+            for state in states:
+                if state.doctor_id in self._pending:
+                    self._pending[state.doctor_id].append((change, state))
+                queue = self._queues.get(state.doctor_id)
+                if queue is not None and queue.date == state.date:
+                    change(queue, state)
+                    touched.setdefault(queue, []).append(state)
+
+            now = timezone.now()
+            for queue, queue_states in touched.items():
+                deltas.append((queue.doctor_id, queue.delta(event, queue_states)))
+
+                index = self._index_of.get(queue.doctor_id)
+                if index is not None and index.queues.get(queue.doctor_id) is queue:
+                    index.push(queue, now)
+
+        # One broadcast per change, shared by every subscriber of the queue
+        for doctor_id, delta in deltas:
+            broadcaster.publish(doctor_id, delta)
+
+    def _load_many(self, doctor_ids, today):
+        """Today's queues of ``doctor_ids`` in a fixed number of queries; unknown doctors are left out."""
+        queues = {doctor_id: DoctorQueue(doctor_id, today) for doctor_id in doctor_ids}
+
+        # Read the versions first: anything changed after them is applied on top
+        versions = TokenSequence.objects.filter(
+            doctor_id__in=doctor_ids, date=today
+        ).values_list('doctor_id', 'version')
+        for doctor_id, version in versions:
+            queues[doctor_id].version = queues[doctor_id].loaded_version = version
+
+        rows = Token.objects.filter(doctor_id__in=doctor_ids, date=today).values_list(
+            'id', 'doctor_id', 'patient_id', 'token_number', 'status',
+            'start_time', 'actual_duration', 'version', 'priority', 'ranked_at', 'created_at',
+        )
+
+        for (token_id, doctor_id, patient_id, token_number, status, start_time, duration, version,
+             priority, ranked_at, created_at) in rows:
+            state = TokenState(
+                id=token_id,
+                doctor_id=doctor_id,
+                patient_id=patient_id,
+                token_number=token_number,
+                status=status,
+                date=today,
+                start_time=start_time,
+                actual_duration=duration,
+                version=version,
+                priority=priority,
+                ranked_at=ranked_at,
+                created_at=created_at,
+            )
+            # Durations are already summed in DoctorDayStats
+            queues[doctor_id].apply(state, count=False)
+
+        empty = [doctor_id for doctor_id, queue in queues.items() if not queue.tokens]
+        if empty:
+            known = set(Doctor.objects.filter(id__in=empty).values_list('id', flat=True))
+            for doctor_id in empty:
+                if doctor_id not in known:
+                    del queues[doctor_id]
+
+        # Today's stats, or the latest earlier day as the estimate until today has data
+        latest_date = DoctorDayStats.objects.filter(
+            doctor_id=OuterRef('doctor_id'), date__lte=today
+        ).order_by('-date').values('date')[:1]
+        latest_rows = DoctorDayStats.objects.filter(
+            doctor_id__in=list(queues), date=Subquery(latest_date)
+        )
+        for latest in latest_rows:
+            queue = queues[latest.doctor_id]
+            if latest.date == today:
+                queue.stats = RunningStats.from_row(latest)
+            elif latest.count:
+                queue.fallback_minutes = latest.ewma if latest.ewma is not None else latest.mean
+
+        # Historical profile by weekday/hour (rebuilt offline), blended with today
+        slots = ConsultationProfile.objects.filter(doctor_id__in=list(queues)).values_list(
+            'doctor_id', 'weekday', 'hour', 'mean',
+        )
+        profiles = {}
+        for doctor_id, weekday, hour, mean in slots:
+            profiles.setdefault(doctor_id, [None] * 168)[weekday * 24 + hour] = mean
+        for doctor_id, profile in profiles.items():
+            if None not in profile:
+                queues[doctor_id].profile = profile
+        return queues
+
+
+queue_engine = QueueEngine()
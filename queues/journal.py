@@ -0,0 +1,118 @@
+"""
+Append-only journal of queue changes.
+
+Every write that changes a queue appends a ``QueueEvent`` per token it
+touched, inside its own transaction, so the journal and the tokens can't
+disagree. Downstream readers follow the journal instead of re-scanning
+``Token`` rows:
+
+- ``tail(after)`` (and the ``events/`` endpoint) returns the events after a
+  sequence number, for consumers that keep their own position;
+- ``consume(name, handler)`` keeps a named consumer's position in
+  ``QueueEventCursor`` and moves it in the handler's transaction, so a
+  batch is never skipped and its database effects are never applied twice;
+- ``replay(doctor_id, day, at)`` folds a doctor's events back into the
+  queue as it stood at any moment.
+
+Sequence numbers are handed out on insert and become visible on commit.
+SQLite commits one writer at a time, so they appear in order. On a
+database with concurrent writers an id can show up after a higher one;
+events of one doctor still commit in ``version`` order, because the
+writes of a doctor's queue serialize on its ``TokenSequence`` row.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .engine import DoctorQueue, TokenState
+from .models import QueueEvent, QueueEventCursor
+
+
+def record(kind, *tokens, at=None):
+    """Append a ``kind`` event per token, after the change; call inside the write's transaction."""
+    at = at or timezone.now()
+    QueueEvent.objects.bulk_create(
+        QueueEvent(
+            doctor_id=token.doctor_id,
+            date=token.date,
+            kind=kind,
+            token_id=token.id,
+            patient_id=token.patient_id,
+            token_number=token.token_number,
+            version=token.version,
+            priority=token.priority,
+            ranked_at=token.ranked_at,
+            created_at=at,
+        )
+        for token in tokens
+    )
+
+
+def tail(after=0, doctor_id=None, limit=500):
+    """Up to ``limit`` events with a sequence number above ``after``, oldest first."""
+    events = QueueEvent.objects.filter(id__gt=after)
+    if doctor_id is not None:
+        events = events.filter(doctor_id=doctor_id)
+    return list(events.order_by('id')[:limit])
+
+
+def consume(name, handler, limit=500):
+    """Pass the next events of consumer ``name`` to ``handler`` and move its cursor past them.
+
+    Handler and cursor share a transaction: if the handler raises, the
+    cursor stays where it was and the batch comes again. Returns how many
+    events were handled.
+    """
+    with transaction.atomic():
+        cursor, _ = QueueEventCursor.objects.select_for_update().get_or_create(name=name)
+        events = tail(cursor.position, limit=limit)
+        if events:
+            handler(events)
+            cursor.position = events[-1].id
+            cursor.save(update_fields=['position', 'updated_at'])
+        return len(events)
+
+
+def replay(doctor_id, day, at=None, upto=None):
+    """Rebuild a doctor's queue of ``day`` from the journal.
+
+    Stops at the last event at or before ``at`` (a datetime) and ``upto``
+    (a sequence number) when given. Consultation times come from the
+    CALLED and COMPLETED/SKIPPED events, so the result answers
+    ``status_for`` and ``occupancy`` as the live queue did then, apart from
+    the weekday/hour profile, which is not journaled.
+    """
+    events = QueueEvent.objects.filter(doctor_id=doctor_id, date=day)
+    if at is not None:
+        events = events.filter(created_at__lte=at)
+    if upto is not None:
+        events = events.filter(id__lte=upto)
+
+    queue = DoctorQueue(doctor_id, day)
+    for event in events.order_by('id').iterator():
+        old = queue.tokens.get(event.token_id)
+        state = TokenState(
+            id=event.token_id,
+            doctor_id=doctor_id,
+            patient_id=event.patient_id,
+            token_number=event.token_number,
+            status=QueueEvent.STATUS_AFTER.get(event.kind, old.status if old else 'WAITING'),
+            date=day,
+            start_time=old.start_time if old else None,
+            actual_duration=old.actual_duration if old else None,
+            version=event.version,
+            priority=event.priority,
+            # Events written before priorities existed rank by join time
+            ranked_at=event.ranked_at or (old.ranked_at if old else event.created_at),
+            created_at=old.created_at if old else event.created_at,
+        )
+
+        if event.kind == 'DELETED':
+            queue.remove(state)
+            continue
+        if event.kind == 'CALLED':
+            state.start_time = event.created_at
+        elif event.kind in ('COMPLETED', 'SKIPPED') and state.start_time:
+            state.actual_duration = (event.created_at - state.start_time).total_seconds() / 60
+        queue.apply(state)
+
+    return queue
@@ -0,0 +1,67 @@
+import datetime
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from queues.analytics import rollup_all
+from queues.archive import archive_before, open_before
+
+
+class Command(BaseCommand):
+    help = (
+        "Move finished tokens of closed days, and their swap requests, out of the live tables into "
+        "the archive tables (or into .jsonl.gz files with --export-dir). Runs in batches; "
+        "an interrupted run can simply be started again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=1,
+                            help="Closed days to leave in the live table (default 1: yesterday)")
+        parser.add_argument('--before', type=datetime.date.fromisoformat,
+                            help="Archive days before this date (YYYY-MM-DD) instead of using --keep-days")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--export-dir',
+                            help="Write batches here as JSON Lines (gzip) instead of the archive tables")
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        if options['before'] is not None:
+            cutoff = options['before']
+        else:
+            if options['keep_days'] < 0:
+                raise CommandError("--keep-days can't be negative")
+            cutoff = today - datetime.timedelta(days=options['keep_days'])
+        if cutoff > today:
+            raise CommandError("Only closed days can be archived; --before must not be after today")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+
+        export_dir = options['export_dir']
+        if export_dir is not None:
+            os.makedirs(export_dir, exist_ok=True)
+
+        # Exported days leave the database, so their rollups must exist first
+        rollup_all(today)
+
+        last_report = time.monotonic()
+
+        def progress(tokens, swaps):
+            nonlocal last_report
+            if time.monotonic() - last_report >= 5:
+                last_report = time.monotonic()
+                self.stdout.write(f"  {tokens} token(s), {swaps} swap request(s) so far")
+
+        tokens, swaps = archive_before(cutoff, options['batch_size'], export_dir, progress)
+
+        target = export_dir if export_dir is not None else "the archive tables"
+        self.stdout.write(
+            f"Archived {tokens} token(s) and {swaps} swap request(s) dated before {cutoff} to {target}"
+        )
+        left_open = open_before(cutoff)
+        if left_open:
+            self.stdout.write(self.style.WARNING(
+                f"{left_open} token(s) dated before {cutoff} are still WAITING or SERVING and were left "
+                f"in place; they are archived once given a final status"
+            ))
@@ -0,0 +1,284 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from queues.engine import queue_engine
+from queues.models import Doctor
+from smartqueue.benchmarking import (
+    EndpointRecorder, git_revision, isolated_database, percentile, write_results,
+)
+
+
+# Relative patient arrivals per hour of an 8 hour OPD day (morning peak)
+DEFAULT_ARRIVAL_CURVE = "3,5,4,3,2,2,1,1"
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate a hospital day against the API in-process (doctors calling patients, "
+        "patients joining on an arrival curve and polling, swap traffic) and report "
+        "throughput, latency percentiles and SQL query counts per endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=5)
+        parser.add_argument('--patients', type=int, default=200)
+        parser.add_argument('--arrival-curve', default=DEFAULT_ARRIVAL_CURVE,
+                            help="Comma separated relative arrivals per hour")
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help="Simulated minutes between queue_status polls")
+        parser.add_argument('--consultation', type=float, default=8.0,
+                            help="Mean simulated consultation minutes")
+        parser.add_argument('--skip-rate', type=float, default=0.05)
+        parser.add_argument('--swap-rate', type=float, default=0.1,
+                            help="Share of patients that request a swap")
+        parser.add_argument('--department-join', action='store_true',
+                            help="Patients join a department and are assigned a doctor")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="JSON results path (default: bench_results/)")
+        parser.add_argument('--compare', help="Earlier results JSON to compare against")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options['seed'])
+        self.recorder = EndpointRecorder()
+        self.events = []
+        self.counter = itertools.count()
+
+        # Expected 4xx responses (nobody serving, swap target gone) are not news
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+
+        with isolated_database():
+            queue_engine.reset()
+            self.setup_actors()
+            self.schedule_day()
+
+            start = time.perf_counter()
+            self.run()
+            wall_seconds = time.perf_counter() - start
+
+        results = {
+            "benchmark": "hospital_day",
+            "revision": git_revision(),
+            "timestamp": timezone.now().isoformat(),
+            "config": {
+                key: options[key] for key in (
+                    'doctors', 'patients', 'arrival_curve', 'poll_interval',
+                    'consultation', 'skip_rate', 'swap_rate', 'department_join', 'seed',
+                )
+            },
+            "wall_seconds": round(wall_seconds, 3),
+            "endpoints": self.recorder.report(),
+            "patient_waits": self.wait_report(),
+        }
+
+        self.print_report(results)
+        if options['compare']:
+            self.print_comparison(results, options['compare'])
+
+        path = options['output'] or self.default_output(results)
+        write_results(path, results)
+        self.stdout.write(f"Results written to {path}")
+
+    # 🔹 Actors
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        return client
+
+    def setup_actors(self):
+        doctor_users = User.objects.bulk_create(
+            User(username=f"bench-doctor-{i}", password='!', is_staff=True)
+            for i in range(self.options['doctors'])
+        )
+        self.doctors = Doctor.objects.bulk_create(
+            Doctor(user=user, name=f"Bench {i}", department=f"Dept {i % 6}")
+            for i, user in enumerate(doctor_users)
+        )
+        self.doctor_clients = {
+            doctor.id: self.client_for(user) for doctor, user in zip(self.doctors, doctor_users)
+        }
+
+        patients = User.objects.bulk_create(
+            User(username=f"bench-patient-{i}", password='!')
+            for i in range(self.options['patients'])
+        )
+        self.patient_clients = [self.client_for(user) for user in patients]
+
+        # (doctor id, token number) -> patient index, kept up to date through swaps
+        self.holders = {}
+        self.tokens = {}
+        # Simulated minutes from joining to being called
+        self.joined_at = {}
+        self.waits = []
+
+    # 🔹 Event loop (simulated minutes; requests run back to back)
+
+    def at(self, minute, action, *args):
+        heapq.heappush(self.events, (minute, next(self.counter), action, args))
+
+    def run(self):
+        while self.events:
+            minute, _, action, args = heapq.heappop(self.events)
+            action(minute, *args)
+
+    def schedule_day(self):
+        weights = [float(w) for w in self.options['arrival_curve'].split(',')]
+        self.day_minutes = 60 * len(weights)
+
+        hours = self.random.choices(range(len(weights)), weights=weights, k=self.options['patients'])
+        for patient, hour in enumerate(hours):
+            doctor = self.random.choice(self.doctors)
+            self.at(60 * hour + self.random.uniform(0, 60), self.join, patient, doctor)
+
+        for doctor in self.doctors:
+            self.at(self.random.uniform(0, 5), self.doctor_turn, doctor.id)
+
+    # 🔹 Patients
+
+    def join(self, minute, patient, doctor):
+        if self.options['department_join']:
+            payload = {'department': doctor.department}
+        else:
+            payload = {'doctor_id': doctor.id}
+        response = self.recorder.call(
+            'join_queue', self.patient_clients[patient].post, '/api/queues/join/', payload,
+        )
+        if response.status_code != 200:
+            return
+
+        doctor_id = response.data['doctor_id']
+        number = response.data['token_number']
+        self.joined_at[patient] = minute
+        self.holders[(doctor_id, number)] = patient
+        self.tokens[patient] = (doctor_id, number)
+        self.at(minute + self.options['poll_interval'], self.poll, patient, doctor_id)
+
+        if self.random.random() < self.options['swap_rate'] and number > 1:
+            self.at(minute + self.random.uniform(1, 10), self.request_swap, patient, doctor_id)
+
+    def poll(self, minute, patient, doctor_id):
+        response = self.recorder.call(
+            'queue_status', self.patient_clients[patient].get,
+            '/api/queues/status/', {'doctor_id': doctor_id},
+        )
+        if response.status_code == 200 and 'your_token' in response.json():
+            self.at(minute + self.options['poll_interval'], self.poll, patient, doctor_id)
+
+    def request_swap(self, minute, patient, doctor_id):
+        _, number = self.tokens[patient]
+        response = self.recorder.call(
+            'request_swap', self.patient_clients[patient].post,
+            '/api/swaps/request/', {'doctor_id': doctor_id, 'target_token': number - 1},
+        )
+        target = self.holders.get((doctor_id, number - 1))
+        if response.status_code == 200 and 'swap_id' in response.data and target is not None:
+            respond = self.accept_swap if self.random.random() < 0.5 else self.reject_swap
+            self.at(minute + self.random.uniform(0.1, 1.5), respond, target, patient,
+                    doctor_id, response.data['swap_id'])
+
+    def accept_swap(self, minute, target, requester, doctor_id, swap_id):
+        response = self.recorder.call(
+            'accept_swap', self.patient_clients[target].post,
+            '/api/swaps/accept/', {'swap_id': swap_id},
+        )
+        if response.status_code == 200:
+            (_, target_number), (_, requester_number) = self.tokens[target], self.tokens[requester]
+            self.tokens[target] = (doctor_id, requester_number)
+            self.tokens[requester] = (doctor_id, target_number)
+            self.holders[(doctor_id, requester_number)] = target
+            self.holders[(doctor_id, target_number)] = requester
+
+    def reject_swap(self, minute, target, requester, doctor_id, swap_id):
+        self.recorder.call(
+            'reject_swap', self.patient_clients[target].post,
+            '/api/swaps/reject/', {'swap_id': swap_id},
+        )
+
+    # 🔹 Doctors
+
+    def doctor_turn(self, minute, doctor_id):
+        if minute > self.day_minutes + 240:
+            return
+
+        client = self.doctor_clients[doctor_id]
+        if self.random.random() < self.options['skip_rate']:
+            self.recorder.call('skip_token', client.post, '/api/queues/skip/')
+
+        response = self.recorder.call('call_next', client.post, '/api/queues/call-next/')
+
+        if response.status_code == 200 and 'token_number' in response.data:
+            patient = self.holders.get((doctor_id, response.data['token_number']))
+            if patient is not None:
+                self.waits.append(minute - self.joined_at[patient])
+            delay = self.random.expovariate(1 / self.options['consultation'])
+        else:
+            # Nobody waiting (yet); stop once the day's arrivals are over
+            if minute > self.day_minutes:
+                return
+            delay = 1.0
+        self.at(minute + delay, self.doctor_turn, doctor_id)
+
+    # 🔹 Output
+
+    def wait_report(self):
+        return {
+            "called": len(self.waits),
+            "mean_minutes": round(sum(self.waits) / len(self.waits), 1) if self.waits else 0.0,
+            "p50_minutes": round(percentile(self.waits, 50), 1),
+            "p90_minutes": round(percentile(self.waits, 90), 1),
+            "p99_minutes": round(percentile(self.waits, 99), 1),
+            "max_minutes": round(max(self.waits, default=0.0), 1),
+        }
+
+    def default_output(self, results):
+        directory = os.path.join(settings.BASE_DIR, 'bench_results')
+        os.makedirs(directory, exist_ok=True)
+        stamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+        return os.path.join(directory, f"hospital_day-{results['revision'] or 'local'}-{stamp}.json")
+
+    def print_report(self, results):
+        self.stdout.write(
+            f"{'endpoint':<14}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+            f"{'p99 ms':>9}{'queries':>9}"
+        )
+        for endpoint, stats in results['endpoints'].items():
+            self.stdout.write(
+                f"{endpoint:<14}{stats['count']:>9}{stats['throughput_rps']:>9}"
+                f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+                f"{stats['queries_mean']:>9}"
+            )
+        waits = results['patient_waits']
+        self.stdout.write(
+            f"Patient waits (simulated): {waits['called']} called, mean {waits['mean_minutes']}, "
+            f"p50 {waits['p50_minutes']}, p90 {waits['p90_minutes']}, p99 {waits['p99_minutes']}, "
+            f"max {waits['max_minutes']} min"
+        )
+        self.stdout.write(f"Wall time {results['wall_seconds']} s")
+
+    def print_comparison(self, results, path):
+        with open(path) as fh:
+            baseline = json.load(fh)
+
+        self.stdout.write(f"Compared with {baseline.get('revision')} ({path}):")
+        for endpoint, stats in results['endpoints'].items():
+            before = baseline['endpoints'].get(endpoint)
+            if not before:
+                continue
+            self.stdout.write(
+                f"{endpoint:<14} p50 {before['p50_ms']} -> {stats['p50_ms']} ms, "
+                f"p99 {before['p99_ms']} -> {stats['p99_ms']} ms, "
+                f"queries {before['queries_mean']} -> {stats['queries_mean']}"
+            )
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIClient
+
+from queues.engine import queue_engine
+from queues.models import Doctor, Token
+from smartqueue.benchmarking import isolated_database, summarize, write_results
+
+
+class Command(BaseCommand):
+    help = "Measure join_queue throughput with many concurrent joins per doctor."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=4)
+        parser.add_argument('--concurrency', type=int, default=50, help="Concurrent joins per doctor")
+        parser.add_argument('--output', help="Write results as JSON to this path")
+
+    def handle(self, *args, **options):
+        doctors_count = options['doctors']
+        concurrency = options['concurrency']
+
+        # Threads need their own connections to one database, so use a file
+        with tempfile.TemporaryDirectory() as tmp, isolated_database(os.path.join(tmp, 'bench.sqlite3')):
+            queue_engine.reset()
+            doctors = Doctor.objects.bulk_create(
+                Doctor(name=f"Bench {i}", department="Bench") for i in range(doctors_count)
+            )
+            patients = User.objects.bulk_create(
+                User(username=f"bench-patient-{i}", password='!')
+                for i in range(doctors_count * concurrency)
+            )
+
+            jobs = [
+                (doctor, patients[d * concurrency + i])
+                for d, doctor in enumerate(doctors)
+                for i in range(concurrency)
+            ]
+            barrier = threading.Barrier(len(jobs) + 1)
+            latencies, failures = [], []
+
+            def join(doctor, patient):
+                client = APIClient()
+                client.force_authenticate(patient)
+                barrier.wait()
+                start = time.perf_counter()
+                try:
+                    response = client.post('/api/queues/join/', {'doctor_id': doctor.id})
+                finally:
+                    connection.close()
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    failures.append(response.status_code)
+
+            threads = [threading.Thread(target=join, args=job) for job in jobs]
+            for thread in threads:
+                thread.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            issued = Token.objects.count()
+            distinct = Token.objects.values('doctor', 'token_number').distinct().count()
+
+        if failures or distinct != issued:
+            raise CommandError(f"{len(failures)} failed joins, {issued - distinct} duplicate numbers")
+
+        results = {
+            "doctors": doctors_count,
+            "concurrency_per_doctor": concurrency,
+            "joins": len(jobs),
+            "seconds": round(elapsed, 3),
+            "joins_per_second": round(len(jobs) / elapsed, 1),
+            **summarize(latencies),
+        }
+        self.stdout.write(
+            f"{results['joins']} joins in {results['seconds']} s "
+            f"({results['joins_per_second']} joins/s), "
+            f"p50 {results['p50_ms']} ms, p95 {results['p95_ms']} ms, p99 {results['p99_ms']} ms; "
+            f"no duplicate token numbers"
+        )
+
+        if options['output']:
+            write_results(options['output'], results)
@@ -0,0 +1,292 @@
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.core.wsgi import get_wsgi_application
+from django.utils import timezone
+
+from queues.engine import queue_engine
+from queues.models import Doctor, Token
+from smartqueue.benchmarking import isolated_database, summarize, write_results
+from swaps.models import SwapRequest
+from users.serializers import ClaimsTokenObtainPairSerializer
+
+
+# Share of requests per read endpoint (patients poll status far more than anything else)
+REQUEST_MIX = (
+    ('queue_status', 70),
+    ('nearby_tokens', 15),
+    ('my_swaps', 10),
+    ('full_queue', 5),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare how many concurrent clients one process serves on the read endpoints "
+        "(queue_status, nearby_tokens, my_swaps, full_queue) through Django's ASGI handler "
+        "(one event loop) and its WSGI handler (a pool of worker threads)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', default='50,100,200,400',
+                            help="Comma separated numbers of concurrent clients to try")
+        parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads")
+        parser.add_argument('--think', type=float, default=0.5,
+                            help="Seconds each client waits between requests")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per run")
+        parser.add_argument('--doctors', type=int, default=10)
+        parser.add_argument('--db-latency-ms', type=float, default=2.0,
+                            help="Round trip added to every SQL query, as to a database server "
+                                 "(the scratch SQLite database has none)")
+        parser.add_argument('--slo-ms', type=float, default=250.0,
+                            help="p99 latency a run must stay under to count towards capacity")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write results as JSON to this path")
+
+    def handle(self, *args, **options):
+        self.options = options
+        levels = [int(level) for level in options['clients'].split(',')]
+
+        # Requests run on other threads than the setup, so use a file
+        with tempfile.TemporaryDirectory() as tmp, isolated_database(os.path.join(tmp, 'bench.sqlite3')):
+            queue_engine.reset()
+            self.setup(max(levels))
+
+            runs = []
+            with self.database_latency():
+                for clients in levels:
+                    for mode in ('wsgi', 'asgi'):
+                        result = asyncio.run(self.measure(mode, clients))
+                        runs.append(result)
+                        self.report(result)
+
+        capacity = {
+            mode: max(
+                (run['clients'] for run in runs if run['mode'] == mode and run['p99_ms'] <= options['slo_ms']),
+                default=0,
+            )
+            for mode in ('wsgi', 'asgi')
+        }
+        self.stdout.write(
+            f"Capacity at p99 <= {options['slo_ms']} ms: WSGI ({options['threads']} threads) "
+            f"{capacity['wsgi']} clients, ASGI {capacity['asgi']} clients"
+        )
+
+        if options['output']:
+            results = {
+                "config": {
+                    key: options[key]
+                    for key in (
+                        'clients', 'threads', 'think', 'duration', 'doctors', 'db_latency_ms', 'slo_ms', 'seed',
+                    )
+                },
+                "runs": runs,
+                "capacity": capacity,
+            }
+            write_results(options['output'], results)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def setup(self, patients):
+        today = timezone.now().date()
+        doctor_users = User.objects.bulk_create(
+            User(username=f"bench-doctor-{i}", password='!', is_staff=True)
+            for i in range(self.options['doctors'])
+        )
+        doctors = Doctor.objects.bulk_create(
+            Doctor(user=user, name=f"Bench {i}", department="Bench")
+            for i, user in enumerate(doctor_users)
+        )
+        users = User.objects.bulk_create(
+            User(username=f"bench-patient-{i}", password='!') for i in range(patients)
+        )
+
+        tokens = Token.objects.bulk_create(
+            Token(
+                doctor=doctors[i % len(doctors)], patient=user,
+                token_number=i // len(doctors) + 1, status='WAITING', date=today,
+            )
+            for i, user in enumerate(users)
+        )
+        SwapRequest.objects.bulk_create(
+            SwapRequest(from_token=token, to_token=previous)
+            for previous, token in zip(tokens, tokens[len(doctors):])
+            if token.id % 5 == 0
+        )
+
+        def bearer(user):
+            return f"Bearer {ClaimsTokenObtainPairSerializer.get_token(user).access_token}"
+
+        self.patients = [(bearer(user), token.doctor_id) for user, token in zip(users, tokens)]
+        self.doctors = [bearer(user) for user in doctor_users]
+
+    @contextlib.contextmanager
+    def database_latency(self):
+        delay = self.options['db_latency_ms'] / 1000
+
+        def wait(execute, sql, params, many, context):
+            time.sleep(delay)
+            return execute(sql, params, many, context)
+
+        def install(sender, connection, **kwargs):
+            connection.execute_wrappers.append(wait)
+
+        # Requests open their own connections on their threads
+        connection_created.connect(install)
+        try:
+            yield
+        finally:
+            connection_created.disconnect(install)
+
+    def request_for(self, endpoint, client_index):
+        if endpoint == 'full_queue':
+            return '/api/queues/full-queue/', {}, self.doctors[client_index % len(self.doctors)]
+
+        token, doctor_id = self.patients[client_index]
+        path, params = {
+            'queue_status': ('/api/queues/status/', {'doctor_id': doctor_id}),
+            'nearby_tokens': ('/api/swaps/nearby/', {'doctor_id': doctor_id}),
+            'my_swaps': ('/api/swaps/mine/', {}),
+        }[endpoint]
+        return path, params, token
+
+    async def measure(self, mode, clients):
+        latencies, statuses = [], {}
+
+        # Call the handlers directly, as a server would: the test clients skip the
+        # per-request thread context of the ASGI handler, so their async ORM calls
+        # all queue up on one thread
+        if mode == 'asgi':
+            send = self.asgi_sender(get_asgi_application())
+        else:
+            pool = ThreadPoolExecutor(self.options['threads'], thread_name_prefix='wsgi')
+            send = self.wsgi_sender(get_wsgi_application(), pool)
+
+        # Load every doctor's queue and open the handler's first connections untimed
+        for index in range(len(self.doctors)):
+            for endpoint, _ in REQUEST_MIX:
+                await send(*self.request_for(endpoint, index))
+
+        endpoints = [name for name, _ in REQUEST_MIX]
+        weights = [weight for _, weight in REQUEST_MIX]
+
+        async def client(index):
+            rng = random.Random(self.options['seed'] * 100003 + index)
+            # Spread the first requests over one think time
+            await asyncio.sleep(rng.uniform(0, self.options['think']))
+            while time.perf_counter() < deadline:
+                endpoint = rng.choices(endpoints, weights=weights)[0]
+                path, params, token = self.request_for(endpoint, index)
+                start = time.perf_counter()
+                status = await send(path, params, token)
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+                await asyncio.sleep(self.options['think'])
+
+        deadline = time.perf_counter() + self.options['duration']
+        started = time.perf_counter()
+        await asyncio.gather(*(client(i) for i in range(clients)))
+        elapsed = time.perf_counter() - started
+
+        if mode == 'wsgi':
+            pool.submit(connections.close_all).result()
+            pool.shutdown()
+
+        return {
+            "mode": mode,
+            "clients": clients,
+            **summarize(latencies),
+            "throughput_rps": round(len(latencies) / elapsed, 1),
+            "statuses": statuses,
+        }
+
+    def asgi_sender(self, application):
+        async def send(path, params, token):
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': 'GET',
+                'scheme': 'http',
+                'path': path,
+                'raw_path': path.encode(),
+                'query_string': urlencode(params).encode(),
+                'root_path': '',
+                'headers': [(b'host', b'testserver'), (b'authorization', token.encode())],
+                'client': ('127.0.0.1', 0),
+                'server': ('testserver', 80),
+            }
+            requested = False
+            status = None
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # The client never disconnects; the handler cancels this wait when done
+                await asyncio.Future()
+
+            async def respond(message):
+                nonlocal status
+                if message['type'] == 'http.response.start':
+                    status = message['status']
+
+            await application(scope, receive, respond)
+            return status
+
+        return send
+
+    def wsgi_sender(self, application, pool):
+        loop = asyncio.get_running_loop()
+
+        def get(path, params, token):
+            environ = {
+                'REQUEST_METHOD': 'GET',
+                'SCRIPT_NAME': '',
+                'PATH_INFO': path,
+                'QUERY_STRING': urlencode(params),
+                'SERVER_NAME': 'testserver',
+                'SERVER_PORT': '80',
+                'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'testserver',
+                'HTTP_AUTHORIZATION': token,
+                'REMOTE_ADDR': '127.0.0.1',
+                'wsgi.version': (1, 0),
+                'wsgi.url_scheme': 'http',
+                'wsgi.input': io.BytesIO(),
+                'wsgi.errors': io.StringIO(),
+                'wsgi.multithread': True,
+                'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            status = []
+            body = application(environ, lambda line, headers, exc_info=None: status.append(line))
+            try:
+                for _ in body:
+                    pass
+            finally:
+                body.close()
+            return int(status[0].split()[0])
+
+        async def send(path, params, token):
+            return await loop.run_in_executor(pool, get, path, params, token)
+
+        return send
+
+    def report(self, result):
+        self.stdout.write(
+            f"{result['mode']:<5}{result['clients']:>6} clients: {result['throughput_rps']:>8} req/s, "
+            f"p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, statuses {result['statuses']}"
+        )
@@ -0,0 +1,192 @@
+import random
+import re
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from queues.models import Doctor, Token
+from smartqueue.benchmarking import isolated_database, summarize, time_call, write_results
+
+
+# What --compare takes away: the composite indexes and the unique constraint's index
+COMPARED_INDEXES = ('token_doctor_queue_idx', 'token_patient_status_idx')
+COMPARED_CONSTRAINT = 'unique_token_number_per_doctor_day'
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a scratch database with historical tokens and report query plans "
+        "and latency of the hot Token queries, with and without the composite indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokens', type=int, default=2_000_000)
+        parser.add_argument('--doctors', type=int, default=50)
+        parser.add_argument('--patients', type=int, default=5000)
+        parser.add_argument('--per-day', type=int, default=60, help="Tokens per doctor per day")
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--compare', action='store_true', help="Also run without the new indexes")
+        parser.add_argument('--output', help="Write results as JSON to this path")
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        results = {}
+
+        with isolated_database():
+            self.seed(options)
+            self.analyze()
+            self.stdout.write(self.style.SUCCESS("With composite indexes"))
+            results['indexed'] = self.run_queries(options['repeat'])
+
+            if options['compare']:
+                self.drop_indexes()
+                self.analyze()
+                self.stdout.write(self.style.SUCCESS("Without composite indexes"))
+                results['unindexed'] = self.run_queries(options['repeat'])
+                self.restore_indexes()
+
+        if options['output']:
+            write_results(options['output'], results)
+
+    # 🔹 Data
+
+    def seed(self, options):
+        doctors = Doctor.objects.bulk_create(
+            Doctor(name=f"Bench {i}", department=f"Dept {i % 6}")
+            for i in range(options['doctors'])
+        )
+        patients = User.objects.bulk_create(
+            User(username=f"bench-patient-{i}", password='!')
+            for i in range(options['patients'])
+        )
+
+        per_day = options['per_day']
+        days = max(options['tokens'] // (len(doctors) * per_day), 1)
+        today = timezone.now().date()
+
+        self.stdout.write(f"Seeding {days * len(doctors) * per_day} tokens over {days} days...")
+
+        batch = []
+        for offset in range(days - 1, -1, -1):
+            day = today - timedelta(days=offset)
+            for doctor in doctors:
+                for number in range(1, per_day + 1):
+                    batch.append(Token(
+                        doctor=doctor,
+                        patient=random.choice(patients),
+                        token_number=number,
+                        date=day,
+                        status=self.status_for(offset, number, per_day),
+                        actual_duration=random.uniform(3, 20),
+                    ))
+                if len(batch) >= 20_000:
+                    Token.objects.bulk_create(batch)
+                    batch = []
+        Token.objects.bulk_create(batch)
+
+        self.doctor = doctors[0]
+        self.today = today
+        self.patient = Token.objects.filter(doctor=self.doctor, date=today, status='WAITING').last().patient
+
+    @staticmethod
+    def status_for(offset, number, per_day):
+        if offset:
+            return 'SKIPPED' if number % 17 == 0 else 'COMPLETED'
+        served = per_day // 2
+        if number < served:
+            return 'COMPLETED'
+        return 'SERVING' if number == served else 'WAITING'
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def drop_indexes(self):
+        # Plain SQL: the schema editor would rebuild the table from the model's
+        # Meta, and unapplying migrations would drop columns the model reads
+        quote = connection.ops.quote_name
+        table = Token._meta.db_table
+        with connection.cursor() as cursor:
+            for name in COMPARED_INDEXES:
+                cursor.execute(f'DROP INDEX {quote(name)}')
+            if connection.vendor != 'sqlite':
+                cursor.execute(f'ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(COMPARED_CONSTRAINT)}')
+                return
+
+            # SQLite keeps the constraint in the table definition: copy the rows
+            # into a table defined without it, then recreate the other indexes
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [table])
+            create = re.sub(rf',\s*CONSTRAINT {re.escape(quote(COMPARED_CONSTRAINT))} UNIQUE \([^)]*\)', '',
+                            cursor.fetchone()[0])
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+                           [table])
+            indexes = [row[0] for row in cursor.fetchall()]
+
+            with connection.constraint_checks_disabled():
+                new_table = quote(table + '__unindexed')
+                cursor.execute(create.replace(quote(table), new_table, 1))
+                cursor.execute(f'INSERT INTO {new_table} SELECT * FROM {quote(table)}')
+                cursor.execute(f'DROP TABLE {quote(table)}')
+                cursor.execute(f'ALTER TABLE {new_table} RENAME TO {quote(table)}')
+                for sql in indexes:
+                    cursor.execute(sql)
+
+    def restore_indexes(self):
+        with connection.schema_editor() as editor:
+            for constraint in Token._meta.constraints:
+                editor.add_constraint(Token, constraint)
+            if connection.vendor != 'sqlite':
+                # SQLite added them back when it rebuilt the table for the constraint
+                for index in Token._meta.indexes:
+                    editor.add_index(Token, index)
+
+    # 🔹 Queries
+
+    def hot_queries(self):
+        doctor, today, patient = self.doctor, self.today, self.patient
+        waiting = Token.objects.filter(doctor=doctor, date=today, status='WAITING')
+
+        return {
+            "serving_token": (
+                Token.objects.filter(doctor=doctor, status='SERVING', date=today),
+                lambda qs: qs.first(),
+            ),
+            # Call order, as call_next and full_queue read it
+            "next_waiting": (
+                waiting.order_by('ranked_at', 'token_number'),
+                lambda qs: qs.first(),
+            ),
+            "people_ahead": (
+                waiting.filter(token_number__lt=40),
+                lambda qs: qs.count(),
+            ),
+            "last_token_number": (
+                Token.objects.filter(doctor=doctor, date=today).order_by('-token_number'),
+                lambda qs: qs.first(),
+            ),
+            "patient_active_token": (
+                Token.objects.filter(patient=patient, status__in=['WAITING', 'SERVING']),
+                lambda qs: qs.first(),
+            ),
+            "full_queue": (
+                Token.objects.filter(doctor=doctor, date=today).order_by('ranked_at', 'token_number'),
+                lambda qs: list(qs),
+            ),
+        }
+
+    def run_queries(self, repeat):
+        report = {}
+        for name, (queryset, run) in self.hot_queries().items():
+            plan = queryset.explain()
+            stats = summarize(time_call(lambda: run(queryset.all()), repeat))
+            report[name] = {"plan": plan, **stats}
+
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(plan)
+            self.stdout.write(
+                f"p50 {stats['p50_ms']} ms  p95 {stats['p95_ms']} ms  p99 {stats['p99_ms']} ms\n"
+            )
+        return report
@@ -0,0 +1,41 @@
+import datetime
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from queues.prediction import evaluate
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay held-out days and report the error of queue_status ETAs: the previous "
+        "estimator (today's mean) against the historical profile blended with today. The "
+        "profile is built from the days before the held-out ones only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--holdout-days', type=int, default=7,
+                            help="Evaluate the last N closed days")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        end = timezone.now().date() - datetime.timedelta(days=1)
+        start = end - datetime.timedelta(days=options['holdout_days'] - 1)
+
+        results = evaluate(start, end)
+        if results is None:
+            raise CommandError(f"No called tokens between {start} and {end}")
+
+        if options['json']:
+            self.stdout.write(json.dumps({"start": str(start), "end": str(end), **results}, indent=2))
+            return
+
+        self.stdout.write(f"Held-out {start} .. {end}: {results['predictions']} predictions (minutes)")
+        self.stdout.write(f"{'':<10}{'MAE':>10}{'median':>10}{'p90':>10}{'bias':>10}")
+        for name in ('baseline', 'model'):
+            errors = results[name]
+            self.stdout.write(
+                f"{name:<10}{errors['mae']:>10}{errors['median_ae']:>10}"
+                f"{errors['p90_ae']:>10}{errors['bias']:>10}"
+            )
@@ -0,0 +1,71 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from queues.journal import replay
+from queues.models import Doctor, Token
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild a doctor's queue from the event journal as it stood at a moment of a day "
+        "(--at) or after a sequence number (--seq), and print it. --verify compares the "
+        "replay of the whole day with the live tokens."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('doctor_id', type=int)
+        parser.add_argument('--date', type=datetime.date.fromisoformat,
+                            help="Day of the queue (YYYY-MM-DD, default today)")
+        parser.add_argument('--at', help="Stop at this time (ISO 8601, local time if no offset)")
+        parser.add_argument('--seq', type=int, help="Stop after this journal sequence number")
+        parser.add_argument('--verify', action='store_true',
+                            help="Fail unless the replayed day matches the Token table")
+
+    def handle(self, *args, **options):
+        doctor_id = options['doctor_id']
+        if not Doctor.objects.filter(id=doctor_id).exists():
+            raise CommandError(f"Doctor {doctor_id} not found")
+
+        day = options['date'] or timezone.now().date()
+        at = None
+        if options['at']:
+            at = parse_datetime(options['at'])
+            if at is None:
+                raise CommandError("--at must be an ISO 8601 date and time")
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+        if options['verify'] and (at or options['seq']):
+            raise CommandError("--verify replays the whole day; drop --at/--seq")
+
+        queue = replay(doctor_id, day, at=at, upto=options['seq'])
+        tokens = sorted(queue.tokens.values(), key=lambda state: state.token_number)
+
+        serving = queue.serving
+        self.stdout.write(f"Doctor {doctor_id}, {day}, version {queue.version}")
+        self.stdout.write(f"  serving: {serving.token_number if serving else '-'}")
+        self.stdout.write(f"  waiting: {', '.join(str(number) for _, number in queue.waiting) or '-'}")
+        for status in ('COMPLETED', 'SKIPPED', 'CANCELLED'):
+            numbers = [str(state.token_number) for state in tokens if state.status == status]
+            self.stdout.write(f"  {status.lower()}: {', '.join(numbers) or '-'}")
+        self.stdout.write(f"  average consultation: {queue.average_duration(at):.1f} min")
+
+        if options['verify']:
+            live = {
+                token_id: (token_number, status)
+                for token_id, token_number, status in Token.objects.filter(
+                    doctor_id=doctor_id, date=day,
+                ).values_list('id', 'token_number', 'status')
+            }
+            replayed = {state.id: (state.token_number, state.status) for state in tokens}
+            mismatched = sorted(
+                token_id for token_id in live.keys() | replayed.keys()
+                if live.get(token_id) != replayed.get(token_id)
+            )
+            if mismatched:
+                for token_id in mismatched[:20]:
+                    self.stdout.write(f"  token {token_id}: live {live.get(token_id)}, replay {replayed.get(token_id)}")
+                raise CommandError(f"{len(mismatched)} token(s) differ from the live queue")
+            self.stdout.write(f"Replay matches all {len(live)} live token(s)")
@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from queues.analytics import rollup_all
+
+
+class Command(BaseCommand):
+    help = (
+        "Roll up closed days of every doctor's queue into DoctorDailyRollup. Only days "
+        "after each doctor's last rollup are processed unless --since is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=datetime.date.fromisoformat,
+                            help="Recompute every closed day from this date (YYYY-MM-DD)")
+        parser.add_argument('--doctor', type=int, action='append', dest='doctors',
+                            help="Only this doctor id (repeatable)")
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        if options['since'] and options['since'] >= today:
+            raise CommandError("--since must be before today; only closed days are rolled up")
+
+        written = rollup_all(today, since=options['since'], doctor_ids=options['doctors'])
+
+        days = sum(written.values())
+        if days or options['verbosity'] > 1:
+            self.stdout.write(f"Rolled up {days} doctor-day(s) across {len(written)} doctor(s)")
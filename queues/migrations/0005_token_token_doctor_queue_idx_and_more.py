@@ -0,0 +1,49 @@
+# Generated by Django 6.0.2 on 2026-10-18 06:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def renumber_duplicates(apps, schema_editor):
+    # Concurrent joins could hand out the same number twice. The earliest
+    # token keeps it; the others get the next free numbers of that day.
+    Token = apps.get_model('queues', 'Token')
+    duplicated = (
+        Token.objects.values('doctor_id', 'date', 'token_number')
+        .annotate(count=models.Count('id')).filter(count__gt=1)
+    )
+    for day in {(row['doctor_id'], row['date']) for row in duplicated}:
+        tokens = Token.objects.filter(doctor_id=day[0], date=day[1])
+        last_number = tokens.aggregate(last=models.Max('token_number'))['last']
+        seen = set()
+        for token in tokens.order_by('token_number', 'id'):
+            if token.token_number in seen:
+                last_number += 1
+                token.token_number = last_number
+                token.save(update_fields=['token_number'])
+            else:
+                seen.add(token.token_number)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0004_token_actual_duration_token_end_time_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['doctor', 'date', 'status', 'token_number'], name='token_doctor_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['patient', 'status'], name='token_patient_status_idx'),
+        ),
+        migrations.RunPython(renumber_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='token',
+            constraint=models.UniqueConstraint(fields=('doctor', 'date', 'token_number'), name='unique_token_number_per_doctor_day'),
+        ),
+    ]
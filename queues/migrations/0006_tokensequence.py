@@ -0,0 +1,26 @@
+# Generated by Django 6.0.2 on 2026-10-18 06:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0005_token_token_doctor_queue_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('last_number', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='token_sequences', to='queues.doctor')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'date'), name='unique_token_sequence_per_doctor_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0007_doctordaystats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='token',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tokensequence',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0.2 on 2026-10-18 07:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def mark_cancelled(apps, schema_editor):
+    # cancel_token used to store COMPLETED; only cancellations lack an end_time
+    Token = apps.get_model('queues', 'Token')
+    Token.objects.filter(status='COMPLETED', end_time__isnull=True).update(status='CANCELLED')
+
+
+def unmark_cancelled(apps, schema_editor):
+    Token = apps.get_model('queues', 'Token')
+    Token.objects.filter(status='CANCELLED').update(status='COMPLETED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0008_token_version_tokensequence_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='token',
+            name='status',
+            field=models.CharField(choices=[('WAITING', 'Waiting'), ('SERVING', 'Serving'), ('COMPLETED', 'Completed'), ('SKIPPED', 'Skipped'), ('CANCELLED', 'Cancelled')], default='WAITING', max_length=20),
+        ),
+        migrations.RunPython(mark_cancelled, unmark_cancelled),
+        migrations.CreateModel(
+            name='DoctorDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('tokens_issued', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('skipped', models.IntegerField(default=0)),
+                ('cancelled', models.IntegerField(default=0)),
+                ('consultations', models.IntegerField(default=0)),
+                ('duration_total', models.FloatField(default=0)),
+                ('duration_mean', models.FloatField(blank=True, null=True)),
+                ('duration_p50', models.FloatField(blank=True, null=True)),
+                ('duration_p90', models.FloatField(blank=True, null=True)),
+                ('waits', models.IntegerField(default=0)),
+                ('wait_total', models.FloatField(default=0)),
+                ('wait_mean', models.FloatField(blank=True, null=True)),
+                ('wait_p50', models.FloatField(blank=True, null=True)),
+                ('wait_p90', models.FloatField(blank=True, null=True)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='queues.doctor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='rollup_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'date'), name='unique_rollup_per_doctor_day')],
+            },
+        ),
+    ]
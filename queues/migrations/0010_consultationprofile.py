@@ -0,0 +1,31 @@
+# Generated by Django 6.0.2 on 2026-10-18 07:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0009_alter_token_status_doctordailyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsultationProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField()),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('samples', models.IntegerField(default=0)),
+                ('mean', models.FloatField()),
+                ('p50', models.FloatField(blank=True, null=True)),
+                ('p90', models.FloatField(blank=True, null=True)),
+                ('built_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consultation_profiles', to='queues.doctor')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'weekday', 'hour'), name='unique_profile_per_doctor_slot')],
+            },
+        ),
+    ]
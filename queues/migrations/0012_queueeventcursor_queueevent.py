@@ -0,0 +1,41 @@
+# Generated by Django 6.0.2 on 2026-10-18 07:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0011_archivedtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueEventCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QueueEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('kind', models.CharField(choices=[('JOINED', 'Joined'), ('CALLED', 'Called'), ('COMPLETED', 'Completed'), ('SKIPPED', 'Skipped'), ('CANCELLED', 'Cancelled'), ('SWAPPED', 'Swapped'), ('FORCE_COMPLETED', 'Force completed'), ('DELETED', 'Deleted')], max_length=16)),
+                ('token_id', models.BigIntegerField()),
+                ('patient_id', models.IntegerField()),
+                ('token_number', models.IntegerField()),
+                ('version', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queue_events', to='queues.doctor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['doctor', 'date', 'id'], name='queue_event_doctor_day_idx')],
+            },
+        ),
+    ]
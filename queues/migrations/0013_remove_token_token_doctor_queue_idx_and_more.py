@@ -0,0 +1,66 @@
+# Generated by Django 6.0.2 on 2026-10-18 07:54
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def rank_by_join_time(apps, schema_editor):
+    # Every existing token is a normal one, called in the order it joined
+    for name in ('Token', 'ArchivedToken'):
+        apps.get_model('queues', name).objects.update(ranked_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0012_queueeventcursor_queueevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='token',
+            name='token_doctor_queue_idx',
+        ),
+        migrations.AddField(
+            model_name='archivedtoken',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Normal'), (1, 'Urgent'), (2, 'Emergency')], default=0),
+        ),
+        migrations.AddField(
+            model_name='archivedtoken',
+            name='ranked_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='queueevent',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='queueevent',
+            name='ranked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Normal'), (1, 'Urgent'), (2, 'Emergency')], default=0),
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='ranked_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(rank_by_join_time, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='queueevent',
+            name='kind',
+            field=models.CharField(choices=[('JOINED', 'Joined'), ('CALLED', 'Called'), ('COMPLETED', 'Completed'), ('SKIPPED', 'Skipped'), ('CANCELLED', 'Cancelled'), ('SWAPPED', 'Swapped'), ('FORCE_COMPLETED', 'Force completed'), ('DELETED', 'Deleted'), ('PRIORITIZED', 'Priority changed')], max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['doctor', 'date', 'status', 'ranked_at', 'token_number'], name='token_doctor_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.2 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queues', '0013_remove_token_token_doctor_queue_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorDirectoryVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32)),
+            ],
+        ),
+    ]
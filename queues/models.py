@@ -1,4 +1,7 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 
@@ -12,12 +15,28 @@ class Doctor(models.Model):
         return f"Dr. {self.name} - {self.department}"
 
 
+class DoctorDirectoryVersion(models.Model):
+    """A single row whose ``token`` is replaced on every change to the doctors (see ``queues.directory``)."""
+
+    token = models.CharField(max_length=32)
+
+    def __str__(self):
+        return self.token
+
+
 class Token(models.Model):
     STATUS_CHOICES = (
         ('WAITING', 'Waiting'),
         ('SERVING', 'Serving'),
         ('COMPLETED', 'Completed'),
         ('SKIPPED', 'Skipped'),
+        ('CANCELLED', 'Cancelled'),
+    )
+
+    PRIORITY_CHOICES = (
+        (0, 'Normal'),
+        (1, 'Urgent'),
+        (2, 'Emergency'),
     )
 
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="tokens")
@@ -29,10 +48,285 @@ class Token(models.Model):
     start_time = models.DateTimeField(null=True, blank=True)
     end_time = models.DateTimeField(null=True, blank=True)
     actual_duration = models.FloatField(null=True, blank=True)
+    # Doctor's queue version of the last change to this token (see TokenSequence)
+    version = models.BigIntegerField(default=0)
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=0)
+    # Place in the call order (then token_number): the join time, moved
+    # earlier by the priority's head start (see rank_time)
+    ranked_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Today's queue of a doctor in call order: serving / next waiting / people ahead
+            models.Index(
+                fields=['doctor', 'date', 'status', 'ranked_at', 'token_number'],
+                name='token_doctor_queue_idx',
+            ),
+            # A patient's active tokens
+            models.Index(fields=['patient', 'status'], name='token_patient_status_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['doctor', 'date', 'token_number'],
+                name='unique_token_number_per_doctor_day',
+            ),
+        ]
 
+    @staticmethod
+    def head_start(priority):
+        return timedelta(minutes=settings.QUEUE_PRIORITY_HEAD_START_MINUTES.get(priority, 0))
+
+    @classmethod
+    def rank_time(cls, joined_at, priority):
+        """``ranked_at`` of a ``priority`` token that joined at ``joined_at``.
+
+        A higher class goes before everyone who joined less than its head
+        start earlier; whoever has waited longer than that still goes first,
+        so the order ages and nobody is held back indefinitely.
+        """
+        return joined_at - cls.head_start(priority)
 
     def __str__(self):
         return f"{self.doctor.name} - Token {self.token_number}"
 
 
+class TokenSequence(models.Model):
+    """Last token number handed out and queue version per doctor per day."""
+
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="token_sequences")
+    date = models.DateField()
+    last_number = models.IntegerField(default=0)
+    # Bumped on every change to the doctor's queue; keeps growing across days
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'date'], name='unique_token_sequence_per_doctor_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor.name} - {self.date} ({self.last_number})"
+
+
+class DoctorDayStats(models.Model):
+    """Running consultation-time statistics of a doctor's day."""
+
+    EWMA_ALPHA = 0.3
+
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="day_stats")
+    date = models.DateField()
+    count = models.IntegerField(default=0)
+    total = models.FloatField(default=0)
+    total_squares = models.FloatField(default=0)
+    ewma = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'date'], name='unique_day_stats_per_doctor_day'),
+        ]
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    @classmethod
+    def record(cls, doctor_id, day, duration):
+        """Add one consultation of ``duration`` minutes; call inside the write's transaction."""
+        updated = cls.objects.filter(doctor_id=doctor_id, date=day).update(
+            count=models.F('count') + 1,
+            total=models.F('total') + duration,
+            total_squares=models.F('total_squares') + duration * duration,
+            ewma=models.Case(
+                models.When(ewma__isnull=True, then=models.Value(duration)),
+                default=models.F('ewma') + cls.EWMA_ALPHA * (duration - models.F('ewma')),
+                output_field=models.FloatField(),
+            ),
+        )
+        if updated:
+            return
+
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    doctor_id=doctor_id,
+                    date=day,
+                    count=1,
+                    total=duration,
+                    total_squares=duration * duration,
+                    ewma=duration,
+                )
+        except IntegrityError:
+            # Created concurrently; add to that row instead
+            cls.record(doctor_id, day, duration)
+
+    def __str__(self):
+        return f"{self.doctor.name} - {self.date} ({self.count} consultations)"
+
+
+class DoctorDailyRollup(models.Model):
+    """One closed day of a doctor's queue, summarized by ``rollup_daily``.
+
+    Durations and waits are in minutes. The ``*_total`` columns let range
+    queries compute exact means across days; percentiles are per day only.
+    """
+
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="daily_rollups")
+    date = models.DateField()
+
+    tokens_issued = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+
+    # Consultations with a recorded actual_duration
+    consultations = models.IntegerField(default=0)
+    duration_total = models.FloatField(default=0)
+    duration_mean = models.FloatField(null=True, blank=True)
+    duration_p50 = models.FloatField(null=True, blank=True)
+    duration_p90 = models.FloatField(null=True, blank=True)
+
+    # Tokens that were called: created_at -> start_time
+    waits = models.IntegerField(default=0)
+    wait_total = models.FloatField(default=0)
+    wait_mean = models.FloatField(null=True, blank=True)
+    wait_p50 = models.FloatField(null=True, blank=True)
+    wait_p90 = models.FloatField(null=True, blank=True)
+
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'date'], name='unique_rollup_per_doctor_day'),
+        ]
+        indexes = [
+            # Ranges across all doctors; per doctor the unique constraint's index serves
+            models.Index(fields=['date'], name='rollup_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor.name} - {self.date} ({self.tokens_issued} tokens)"
+
+
+class ConsultationProfile(models.Model):
+    """Expected consultation minutes of a doctor by weekday and hour.
+
+    Built from the whole history by ``build_consultation_profiles``; cells
+    with few samples lean on the doctor's hour across weekdays, then on the
+    doctor's overall mean. ``PRIOR_WEIGHT`` is how many of today's
+    consultations the profile counts as when blended with them.
+    """
+
+    PRIOR_WEIGHT = 5
+
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="consultation_profiles")
+    weekday = models.PositiveSmallIntegerField()  # 0 = Monday
+    hour = models.PositiveSmallIntegerField()     # local time
+    samples = models.IntegerField(default=0)
+    mean = models.FloatField()
+    p50 = models.FloatField(null=True, blank=True)
+    p90 = models.FloatField(null=True, blank=True)
+    built_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['doctor', 'weekday', 'hour'], name='unique_profile_per_doctor_slot',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor.name} - day {self.weekday} {self.hour:02d}h ({self.mean:.1f} min)"
+
+
+class ArchivedToken(models.Model):
+    """A token of a closed day, moved out of ``Token`` by ``archive_tokens``.
+
+    Keeps the original id and columns, so analytics can read both tables alike.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="archived_tokens")
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_tokens")
+    token_number = models.IntegerField()
+    status = models.CharField(max_length=20, choices=Token.STATUS_CHOICES)
+    date = models.DateField()
+    created_at = models.DateTimeField()
+    start_time = models.DateTimeField(null=True, blank=True)
+    end_time = models.DateTimeField(null=True, blank=True)
+    actual_duration = models.FloatField(null=True, blank=True)
+    version = models.BigIntegerField(default=0)
+    priority = models.PositiveSmallIntegerField(choices=Token.PRIORITY_CHOICES, default=0)
+    ranked_at = models.DateTimeField(default=timezone.now)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['doctor', 'date'], name='archived_token_doctor_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor.name} - Token {self.token_number} ({self.date}, archived)"
+
+
+class QueueEvent(models.Model):
+    """One change to a token in a doctor's queue, appended by the write that made it.
+
+    The id is the journal's sequence number. Token and patient ids are plain
+    columns so events outlive archived and deleted tokens; ``token_number``
+    and ``version`` are the token's after the change.
+    """
+
+    KIND_CHOICES = (
+        ('JOINED', 'Joined'),
+        ('CALLED', 'Called'),
+        ('COMPLETED', 'Completed'),
+        ('SKIPPED', 'Skipped'),
+        ('CANCELLED', 'Cancelled'),
+        ('SWAPPED', 'Swapped'),
+        ('FORCE_COMPLETED', 'Force completed'),
+        ('DELETED', 'Deleted'),
+        ('PRIORITIZED', 'Priority changed'),
+    )
+
+    # Status each kind leaves the token in; DELETED removes it, PRIORITIZED keeps it
+    STATUS_AFTER = {
+        'JOINED': 'WAITING',
+        'CALLED': 'SERVING',
+        'COMPLETED': 'COMPLETED',
+        'SKIPPED': 'SKIPPED',
+        'CANCELLED': 'CANCELLED',
+        'SWAPPED': 'WAITING',
+        'FORCE_COMPLETED': 'COMPLETED',
+    }
 
+    id = models.BigAutoField(primary_key=True)
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name="queue_events")
+    date = models.DateField()
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    token_id = models.BigIntegerField()
+    patient_id = models.IntegerField()
+    token_number = models.IntegerField()
+    version = models.BigIntegerField(default=0)
+    priority = models.PositiveSmallIntegerField(default=0)
+    ranked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Replaying a doctor's day in order
+            models.Index(fields=['doctor', 'date', 'id'], name='queue_event_doctor_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} {self.doctor_id}/{self.token_number}"
+
+
+class QueueEventCursor(models.Model):
+    """How far a named consumer has read the ``QueueEvent`` journal."""
+
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
@@ -0,0 +1,222 @@
+"""
+Offline construction and evaluation of ``ConsultationProfile``.
+
+The profile is computed in one vectorized pass over every timed consultation
+in the history: durations are binned by (doctor, weekday, hour) with
+``np.bincount`` and percentiles taken from one lexsort. A cell's mean is
+shrunk towards the doctor's mean for that hour (and that towards the
+doctor's overall mean) by ``SHRINKAGE`` pseudo-samples, so sparse cells stay
+sensible. Weekday and hour are extracted by the database in the project's
+time zone. History includes archived tokens.
+
+NumPy is only needed here, by the management commands; the engine reads
+the stored rows.
+"""
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay
+
+from .archive import token_history
+from .engine import (
+    TIMED_STATUSES, blend_duration, default_consultation_minutes, estimate_wait, profile_slot,
+)
+from .models import ConsultationProfile
+
+
+SHRINKAGE = 10
+SLOTS = 7 * 24
+
+
+def _history(until, since=None):
+    filters = {
+        'status__in': TIMED_STATUSES,
+        'actual_duration__isnull': False,
+        'start_time__isnull': False,
+        'date__lt': until,
+    }
+    if since is not None:
+        filters['date__gte'] = since
+
+    rows = token_history(lambda tokens: tokens.filter(**filters).annotate(
+        weekday=ExtractIsoWeekDay('start_time'), hour=ExtractHour('start_time'),
+    ).values_list('doctor_id', 'weekday', 'hour', 'actual_duration'))
+
+    data = np.array(list(rows), dtype=np.float64).reshape(-1, 4)
+    return (
+        data[:, 0].astype(np.int64),
+        data[:, 1].astype(np.int64) - 1,  # ISO 1..7 -> 0 = Monday
+        data[:, 2].astype(np.int64),
+        data[:, 3],
+    )
+
+
+def _cell_percentiles(durations, starts, counts, pct):
+    # Linear interpolation inside each cell's slice of the sorted durations
+    position = starts + (counts - 1) * pct / 100
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    return durations[low] + (durations[high] - durations[low]) * (position - low)
+
+
+def build_profiles(until, since=None):
+    """Unsaved ``ConsultationProfile`` rows (all 168 slots per doctor) from tokens before ``until``."""
+    doctor_ids, weekdays, hours, durations = _history(until, since)
+    if not len(durations):
+        return []
+
+    doctors, doctor_index = np.unique(doctor_ids, return_inverse=True)
+    n_doctors = len(doctors)
+    cells = doctor_index * SLOTS + weekdays * 24 + hours
+    doctor_hours = doctor_index * 24 + hours
+
+    counts = np.bincount(cells, minlength=n_doctors * SLOTS)
+    totals = np.bincount(cells, weights=durations, minlength=n_doctors * SLOTS)
+
+    doctor_means = (
+        np.bincount(doctor_index, weights=durations, minlength=n_doctors)
+        / np.bincount(doctor_index, minlength=n_doctors)
+    )
+    hour_counts = np.bincount(doctor_hours, minlength=n_doctors * 24)
+    hour_totals = np.bincount(doctor_hours, weights=durations, minlength=n_doctors * 24)
+    hour_means = (hour_totals + SHRINKAGE * np.repeat(doctor_means, 24)) / (hour_counts + SHRINKAGE)
+
+    # Parent of every cell: the same doctor and hour across weekdays
+    cell_doctor, cell_slot = np.divmod(np.arange(n_doctors * SLOTS), SLOTS)
+    parent = hour_means[cell_doctor * 24 + cell_slot % 24]
+    means = (totals + SHRINKAGE * parent) / (counts + SHRINKAGE)
+
+    order = np.lexsort((durations, cells))
+    sorted_cells, sorted_durations = cells[order], durations[order]
+    present = np.flatnonzero(counts)
+    starts = np.searchsorted(sorted_cells, present)
+    p50 = _cell_percentiles(sorted_durations, starts, counts[present], 50)
+    p90 = _cell_percentiles(sorted_durations, starts, counts[present], 90)
+    percentiles = {int(cell): (float(a), float(b)) for cell, a, b in zip(present, p50, p90)}
+
+    profiles = []
+    for cell in range(n_doctors * SLOTS):
+        doctor, slot = divmod(cell, SLOTS)
+        cell_p50, cell_p90 = percentiles.get(cell, (None, None))
+        profiles.append(ConsultationProfile(
+            doctor_id=int(doctors[doctor]),
+            weekday=slot // 24,
+            hour=slot % 24,
+            samples=int(counts[cell]),
+            mean=float(means[cell]),
+            p50=cell_p50,
+            p90=cell_p90,
+        ))
+    return profiles
+
+
+def save_profiles(profiles):
+    doctor_ids = {profile.doctor_id for profile in profiles}
+    with transaction.atomic():
+        ConsultationProfile.objects.filter(doctor_id__in=doctor_ids).delete()
+        ConsultationProfile.objects.bulk_create(profiles, batch_size=1000)
+
+
+def _lookup(profiles):
+    lookup = defaultdict(lambda: [None] * SLOTS)
+    for profile in profiles:
+        lookup[profile.doctor_id][profile.weekday * 24 + profile.hour] = profile.mean
+    return lookup
+
+
+def replay_day(tokens, previous_mean, profile):
+    """``(actual, baseline, model)`` wait minutes for each called token of one doctor's day.
+
+    Each token's wait is predicted as of its ``created_at``. That means
+    reconstructing who was waiting, who was being served and which
+    consultations had finished by then. The baseline is the estimator
+    before profiles (today's mean, else the previous day's, else the
+    default).
+    """
+    finished = sorted(
+        (token['end_time'], token['actual_duration']) for token in tokens
+        if token['end_time'] is not None and token['actual_duration'] is not None
+    )
+    results = []
+
+    for token in tokens:
+        if token['start_time'] is None:
+            continue
+        at = token['created_at']
+
+        done = [duration for end_time, duration in finished if end_time <= at]
+        live_count = len(done)
+        live_mean = sum(done) / live_count if live_count else None
+
+        ahead = sum(
+            1 for other in tokens
+            if (other['ranked_at'], other['token_number']) < (token['ranked_at'], token['token_number'])
+            and other['created_at'] <= at
+            and (other['start_time'] is None or other['start_time'] > at)
+            and other['status'] != 'CANCELLED'
+        )
+        serving = [
+            other for other in tokens
+            if other['start_time'] is not None and other['start_time'] <= at
+            and (other['end_time'] is None or other['end_time'] > at)
+        ]
+        serving_minutes = (at - serving[0]['start_time']).total_seconds() / 60 if serving else None
+
+        baseline_avg = live_mean if live_count else previous_mean
+        if profile is not None and None not in profile:
+            model_avg = blend_duration(profile[profile_slot(at)], live_count, live_mean)
+        else:
+            model_avg = baseline_avg
+
+        actual = (token['start_time'] - at).total_seconds() / 60
+        results.append((
+            actual,
+            estimate_wait(baseline_avg, ahead, serving_minutes),
+            estimate_wait(model_avg, ahead, serving_minutes),
+        ))
+    return results
+
+
+def evaluate(holdout_start, holdout_end):
+    """ETA errors on days ``holdout_start``..``holdout_end`` for a profile built on earlier days."""
+    lookup = _lookup(build_profiles(holdout_start))
+
+    tokens = token_history(lambda tokens: tokens.filter(date__range=(holdout_start, holdout_end)).values(
+        'doctor_id', 'date', 'token_number', 'status', 'ranked_at',
+        'created_at', 'start_time', 'end_time', 'actual_duration',
+    ))
+    days = defaultdict(list)
+    for token in tokens:
+        days[(token['doctor_id'], token['date'])].append(token)
+    for day_tokens in days.values():
+        day_tokens.sort(key=lambda token: (token['ranked_at'], token['token_number']))
+
+    results = []
+    previous = {}
+    for (doctor_id, day), day_tokens in sorted(days.items()):
+        durations = [t['actual_duration'] for t in day_tokens if t['actual_duration'] is not None]
+        previous_mean = previous.get(doctor_id, default_consultation_minutes())
+        profile = lookup.get(doctor_id)
+        results.extend(replay_day(day_tokens, previous_mean, profile))
+        if durations:
+            previous[doctor_id] = sum(durations) / len(durations)
+
+    if not results:
+        return None
+    actual, baseline, model = np.array(results).T
+    return {
+        "predictions": len(actual),
+        "baseline": _errors(baseline - actual),
+        "model": _errors(model - actual),
+    }
+
+
+def _errors(error):
+    absolute = np.abs(error)
+    return {
+        "mae": round(float(absolute.mean()), 2),
+        "median_ae": round(float(np.median(absolute)), 2),
+        "p90_ae": round(float(np.percentile(absolute, 90)), 2),
+        "bias": round(float(error.mean()), 2),
+    }
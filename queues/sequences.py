@@ -0,0 +1,97 @@
+"""
+Per-doctor, per-day token number allocation and queue versions.
+
+Numbers come from a ``TokenSequence`` counter row that is bumped with a single
+conditional UPDATE, so concurrent joins to the same doctor serialize on that
+one row instead of racing on ``max(token_number) + 1``.
+
+The same row carries the doctor's queue version: every change to the queue
+bumps it and stamps the changed tokens, so dashboards can ask for just the
+tokens changed since the version they last saw.
+"""
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Max
+
+from .models import Token, TokenSequence
+
+
+def _supports_update_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 35)
+    return False
+
+
+def _increment(doctor_id, day, new_number):
+    """Bump the counter row and return ``(last_number, version)``, or None if there is no row yet."""
+    if _supports_update_returning():
+        table = connection.ops.quote_name(TokenSequence._meta.db_table)
+        assignments = "version = version + 1"
+        if new_number:
+            assignments += ", last_number = last_number + 1"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET {assignments} "
+                f"WHERE doctor_id = %s AND date = %s RETURNING last_number, version",
+                [doctor_id, connection.ops.adapt_datefield_value(day)],
+            )
+            return cursor.fetchone()
+
+    changes = {'version': F('version') + 1}
+    if new_number:
+        changes['last_number'] = F('last_number') + 1
+
+    sequence = TokenSequence.objects.filter(doctor_id=doctor_id, date=day)
+    if not sequence.update(**changes):
+        return None
+    # The UPDATE holds the row lock until commit, so this reads our own values
+    return sequence.values_list('last_number', 'version').get()
+
+
+def _allocate(doctor_id, day, new_number):
+    row = _increment(doctor_id, day, new_number)
+    if row is not None:
+        return row
+
+    # First change of the day: seed from tokens issued before the counter
+    # existed, and continue the doctor's versions from earlier days
+    last_number = Token.objects.filter(doctor_id=doctor_id, date=day).aggregate(
+        last=Max('token_number')
+    )['last'] or 0
+    last_version = TokenSequence.objects.filter(doctor_id=doctor_id).aggregate(
+        last=Max('version')
+    )['last'] or 0
+
+    row = (last_number + 1 if new_number else last_number, last_version + 1)
+    try:
+        with transaction.atomic():
+            TokenSequence.objects.create(
+                doctor_id=doctor_id, date=day, last_number=row[0], version=row[1],
+            )
+        return row
+    except IntegrityError:
+        # Another request created the row first
+        return _increment(doctor_id, day, new_number)
+
+
+def next_token_number(doctor_id, day):
+    """Allocate the next token number for a doctor's day.
+
+    Returns ``(token_number, version)``. Must be called inside
+    ``transaction.atomic()`` together with the insert of the token, so a
+    rolled back join gives its number back.
+    """
+    return _allocate(doctor_id, day, new_number=True)
+
+
+def next_queue_version(doctor_id, day):
+    """Bump a doctor's queue version for a change on ``day``; call inside the write's transaction."""
+    return _allocate(doctor_id, day, new_number=False)[1]
+
+
+async def acurrent_queue_version(doctor_id, day):
+    return await TokenSequence.objects.filter(doctor_id=doctor_id, date=day).values_list(
+        'version', flat=True
+    ).afirst() or 0
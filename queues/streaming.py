@@ -0,0 +1,152 @@
+"""
+Fan-out of live queue deltas to Server-Sent Events subscribers.
+
+Every change is encoded once into a per-doctor ring buffer. Subscribers of a
+doctor's queue all await one shared future per event loop, so publishing
+costs one wake-up per loop no matter how many clients are connected, and an
+idle connection is just a suspended coroutine.
+
+The broadcaster lives in one process and only sees the changes made there.
+Changes made by other workers reach it through ``queue_engine``: while a
+doctor's queue has subscribers, one task per event loop has the engine check
+the queue every ``QUEUE_ENGINE_SYNC_SECONDS``, however many clients are
+connected. A queue reloaded because another worker changed it is published
+as a ``reloaded`` delta with no tokens, upon which clients re-fetch their
+status.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Channel:
+
+    def __init__(self, backlog):
+        self.seq = 0
+        self.events = deque(maxlen=backlog)  # (seq, encoded SSE frame)
+        self.waiters = {}                    # event loop -> shared future
+        self.subscribers = {}                # event loop -> number of subscribers
+        self.pollers = {}                    # event loop -> polling task
+
+
+class QueueBroadcaster:
+
+    def __init__(self, backlog=64):
+        self._backlog = backlog
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def _channel(self, doctor_id):
+        channel = self._channels.get(doctor_id)
+        if channel is None:
+            channel = self._channels[doctor_id] = _Channel(self._backlog)
+        return channel
+
+    def publish(self, doctor_id, delta):
+        """Encode ``delta`` once and wake every subscriber of ``doctor_id``."""
+        with self._lock:
+            channel = self._channel(doctor_id)
+            channel.seq += 1
+            channel.events.append((channel.seq, encode_event(channel.seq, 'queue', delta)))
+            waiters, channel.waiters = channel.waiters, {}
+
+        for loop, future in waiters.items():
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_wake, future)
+
+    def last_seq(self, doctor_id):
+        # Doesn't create a channel: only publish and subscribe do, for known doctors
+        with self._lock:
+            channel = self._channels.get(doctor_id)
+            return channel.seq if channel is not None else 0
+
+    def _join(self, channel, loop, poll, poll_seconds):
+        with self._lock:
+            channel.subscribers[loop] = channel.subscribers.get(loop, 0) + 1
+            if poll is not None and loop not in channel.pollers:
+                channel.pollers[loop] = loop.create_task(_poll(poll, poll_seconds))
+
+    def _leave(self, channel, loop):
+        with self._lock:
+            channel.subscribers[loop] -= 1
+            if channel.subscribers[loop]:
+                return
+            del channel.subscribers[loop]
+            poller = channel.pollers.pop(loop, None)
+        if poller is not None:
+            poller.cancel()
+
+    async def subscribe(self, doctor_id, last_seq, poll=None, poll_seconds=None):
+        """Yield encoded SSE frames for ``doctor_id`` published after ``last_seq``.
+
+        While the channel has subscribers on this event loop, the first one's
+        ``poll()`` is awaited every ``poll_seconds``; it may publish to the
+        channel.
+        """
+        loop = asyncio.get_running_loop()
+        quiet_since = time.monotonic()
+        with self._lock:
+            channel = self._channel(doctor_id)
+        self._join(channel, loop, poll, poll_seconds)
+
+        try:
+            while True:
+                with self._lock:
+                    frames = [frame for seq, frame in channel.events if seq > last_seq]
+                    missed = channel.events and channel.events[0][0] > last_seq + 1
+                    last_seq = channel.seq
+                    if not frames:
+                        future = channel.waiters.get(loop)
+                        if future is None:
+                            future = channel.waiters[loop] = loop.create_future()
+
+                if frames:
+                    if missed:
+                        # Fell behind the ring buffer; the client should re-fetch status
+                        yield encode_event(last_seq, 'resync', {"doctor_id": doctor_id})
+                    for frame in frames:
+                        yield frame
+                    quiet_since = time.monotonic()
+                    continue
+
+                try:
+                    timeout = quiet_since + HEARTBEAT_SECONDS - time.monotonic()
+                    await asyncio.wait_for(asyncio.shield(future), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    quiet_since = time.monotonic()
+        finally:
+            self._leave(channel, loop)
+
+
+async def _poll(poll, poll_seconds):
+    while True:
+        await asyncio.sleep(poll_seconds)
+        try:
+            await poll()
+        except Exception:
+            # A failed check is retried next interval; subscribers keep waiting
+            logger.exception("Cross-worker queue check failed")
+
+
+def encode_event(seq, event, data):
+    payload = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return f"id: {seq}\nevent: {event}\ndata: {payload}\n\n".encode()
+
+
+broadcaster = QueueBroadcaster()
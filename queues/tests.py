@@ -1,3 +1,1075 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.query import QuerySet
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from swaps.models import ArchivedSwapRequest, SwapRequest
+from users.authentication import ClaimsJWTAuthentication, ClaimsUser, access
+from users.serializers import ClaimsTokenObtainPairSerializer
+from . import analytics, directory, journal
+from .archive import archive_before, token_history
+from .engine import DepartmentIndex, DoctorQueue, TokenState, default_consultation_minutes, estimate_wait, queue_engine
+from .models import ArchivedToken, ConsultationProfile, Doctor, DoctorDailyRollup, DoctorDayStats, DoctorDirectoryVersion, QueueEvent, QueueEventCursor, Token, TokenSequence
+from .sequences import next_queue_version
+from .streaming import broadcaster
+
+try:
+    import numpy as np
+    from .prediction import SHRINKAGE, build_profiles, evaluate, save_profiles
+except ImportError:
+    np = None
+
+
+class ConcurrentJoinTests(TransactionTestCase):
+    """Many patients joining the same doctor at once get distinct numbers."""
+
+    joins = 50
+
+    def setUp(self):
+        queue_engine.reset()
+        self.doctor = Doctor.objects.create(name="Stress", department="ENT")
+        self.patients = [
+            User.objects.create(username=f"patient-{i}")
+            for i in range(self.joins)
+        ]
+
+    def join(self, patient, barrier, responses):
+        client = APIClient()
+        client.force_authenticate(patient)
+        barrier.wait()
+        try:
+            responses.append(client.post('/api/queues/join/', {'doctor_id': self.doctor.id}))
+        finally:
+            connection.close()
+
+    def test_no_duplicate_token_numbers(self):
+        barrier = threading.Barrier(self.joins)
+        responses = []
+        threads = [
+            threading.Thread(target=self.join, args=(patient, barrier, responses))
+            for patient in self.patients
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([r.status_code for r in responses], [200] * self.joins)
+
+        numbers = sorted(
+            Token.objects.filter(doctor=self.doctor, date=timezone.now().date())
+            .values_list('token_number', flat=True)
+        )
+        self.assertEqual(numbers, list(range(1, self.joins + 1)))
+        self.assertEqual(sorted(r.data['token_number'] for r in responses), numbers)
+
+
+def _state(token_id, number, status='WAITING', joined=None, **fields):
+    joined = joined or timezone.now()
+    return TokenState(
+        id=token_id, doctor_id=1, patient_id=100 + token_id, token_number=number,
+        status=status, date=joined.date(), ranked_at=joined, created_at=joined, **fields,
+    )
+
+
+class DuplicateNumbersMigrationTests(TransactionTestCase):
+    """0005 renumbers numbers handed out twice before adding the unique constraint."""
+
+    before = [('queues', '0004_token_actual_duration_token_end_time_and_more')]
+    after = [('queues', '0005_token_token_doctor_queue_idx_and_more')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_renumbered(self):
+        apps = self.migrate(self.before)
+        Doctor, Token = apps.get_model('queues', 'Doctor'), apps.get_model('queues', 'Token')
+        User = apps.get_model('auth', 'User')
+        doctor = Doctor.objects.create(name="Migrated", department="ENT")
+        today, yesterday = datetime.date(2026, 1, 2), datetime.date(2026, 1, 1)
+        numbers = [(today, 1), (today, 2), (today, 2), (today, 3), (today, 2), (yesterday, 2), (yesterday, 2)]
+        tokens = [
+            Token.objects.create(
+                doctor=doctor, patient=User.objects.create(username=f"migrated-{i}"), token_number=number, date=day,
+            )
+            for i, (day, number) in enumerate(numbers)
+        ]
+
+        apps = self.migrate(self.after)
+        Token = apps.get_model('queues', 'Token')
+        self.assertEqual(
+            list(Token.objects.filter(id__in=[t.id for t in tokens]).order_by('id').values_list('token_number', flat=True)),
+            [1, 2, 4, 3, 5, 2, 3],
+        )
+
+
+class DoctorQueueTests(SimpleTestCase):
+    """Rank and ETA of the in-memory queue, and how changes are applied."""
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.queue = DoctorQueue(1, self.now.date())
+        self.queue.fallback_minutes = 10
+        for number in (1, 2, 3):
+            self.queue.apply(_state(number, number, joined=self.now + datetime.timedelta(seconds=number)))
+
+    def test_rank_and_eta(self):
+        status = self.queue.status_for(103, self.now)
+        self.assertEqual(status['people_ahead'], 2)
+        self.assertEqual(status['total_in_queue'], 3)
+        # Nobody serving: the first ahead is called now, the second after one consultation
+        self.assertEqual(status['estimated_wait_minutes'], 10)
+
+    def test_eta_counts_the_running_consultation(self):
+        serving = _state(1, 1, 'SERVING', joined=self.now, start_time=self.now - datetime.timedelta(minutes=4))
+        self.queue.apply(serving)
+
+        status = self.queue.status_for(103, self.now)
+        self.assertEqual(status['currently_serving'], 1)
+        self.assertEqual(status['people_ahead'], 1)
+        self.assertEqual(status['estimated_wait_minutes'], 6)
+
+    def test_apply_moves_and_remove_forgets(self):
+        self.queue.apply(_state(2, 2, 'CANCELLED', version=5))
+        self.assertEqual(self.queue.status_for(103, self.now)['people_ahead'], 1)
+        self.assertIsNone(self.queue.status_for(102, self.now))
+
+        self.queue.remove(_state(1, 1, version=6))
+        self.assertEqual(self.queue.status_for(103, self.now)['people_ahead'], 0)
+        self.assertNotIn(1, self.queue.tokens)
+        self.assertEqual(self.queue.version, 6)
+
+    def test_completed_consultation_counts_once(self):
+        done = _state(1, 1, 'COMPLETED', actual_duration=20.0)
+        self.queue.apply(done)
+        self.queue.apply(done)
+        self.assertEqual(self.queue.stats.count, 1)
+        self.assertEqual(self.queue.average_duration(self.now), 20.0)
+
+
+class PriorityTests(TestCase):
+    """Higher classes go first by their head start, but not past longer waits."""
+
+    def setUp(self):
+        queue_engine.reset()
+        self.staff = User.objects.create(username="triage-doctor", is_staff=True)
+        self.doctor = Doctor.objects.create(name="Triage", department="ENT", user=self.staff)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        now = timezone.now()
+        self.tokens = []
+        for number, minutes_ago in enumerate((40, 20, 0), start=1):
+            joined = now - datetime.timedelta(minutes=minutes_ago)
+            token = Token.objects.create(
+                doctor=self.doctor, patient=User.objects.create(username=f"triage-{number}"),
+                token_number=number, date=now.date(), ranked_at=joined,
+            )
+            Token.objects.filter(id=token.id).update(created_at=joined)
+            self.tokens.append(token)
+
+    def prioritize(self, token, priority):
+        return self.client.post('/api/queues/priority/', {'token_id': token.id, 'priority': priority})
+
+    def call_order(self):
+        return [self.client.post('/api/queues/call-next/').data['token_number'] for _ in self.tokens]
+
+    def test_urgent_goes_before_recent_joins_only(self):
+        self.assertEqual(self.prioritize(self.tokens[2], 1).status_code, 200)
+        # 30 minutes of head start: past the one who joined 20 minutes ago, not the one at 40
+        self.assertEqual(queue_engine.status_for(self.doctor.id, self.tokens[1].patient_id)['people_ahead'], 2)
+        self.assertEqual(self.call_order(), [1, 3, 2])
+
+    def test_emergency_goes_first(self):
+        self.prioritize(self.tokens[2], 2)
+        self.assertEqual(queue_engine.status_for(self.doctor.id, self.tokens[2].patient_id)['people_ahead'], 0)
+        self.assertEqual(self.call_order(), [3, 1, 2])
+
+    def test_back_to_normal(self):
+        self.prioritize(self.tokens[2], 2)
+        self.prioritize(self.tokens[2], 0)
+        self.assertEqual(self.call_order(), [1, 2, 3])
+
+    def test_refused(self):
+        self.assertEqual(self.prioritize(self.tokens[0], 5).status_code, 400)
+        self.client.post('/api/queues/call-next/')
+        self.assertEqual(self.prioritize(self.tokens[0], 1).status_code, 404)  # no longer waiting
+
+        patient = APIClient()
+        patient.force_authenticate(self.tokens[1].patient)
+        response = patient.post('/api/queues/priority/', {'token_id': self.tokens[1].id, 'priority': 2})
+        self.assertEqual(response.status_code, 403)
+
+    def test_eta_expects_urgent_arrivals(self):
+        now = timezone.now()
+        queue = DoctorQueue(self.doctor.id, now.date())
+        queue.fallback_minutes = 10
+        # Six urgent patients in the first hour: one every 10 minutes
+        for i in range(6):
+            queue.apply(_state(10 + i, 10 + i, 'COMPLETED', joined=now - datetime.timedelta(minutes=60), priority=1))
+        for number in (1, 2, 3):
+            queue.apply(_state(number, number, joined=now + datetime.timedelta(seconds=number)))
+
+        # Two ahead: one consultation, plus the one urgent arrival expected meanwhile
+        self.assertEqual(queue.status_for(103, now)['estimated_wait_minutes'], 20)
+
+
+class QueueEngineTests(TestCase):
+    """Loading, day rollover and changes made outside this process."""
+
+    def setUp(self):
+        queue_engine.reset()
+        self.doctor = Doctor.objects.create(name="Engine", department="ENT")
+        self.patient = User.objects.create(username="engine-patient")
+        self.today = timezone.now().date()
+
+    def join(self):
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/queues/join/', {'doctor_id': self.doctor.id})
+        self.assertEqual(response.status_code, 200)
+        return Token.objects.get(doctor=self.doctor, patient=self.patient, date=self.today)
+
+    def test_unknown_doctor(self):
+        with self.assertRaises(Doctor.DoesNotExist):
+            queue_engine.get(self.doctor.id + 1000)
+
+    def test_new_day_reloads_the_queue(self):
+        self.join()
+        self.assertIsNotNone(queue_engine.status_for(self.doctor.id, self.patient.id))
+
+        tomorrow = timezone.now() + datetime.timedelta(days=1)
+        with mock.patch('queues.engine.timezone.now', return_value=tomorrow):
+            queue = queue_engine.get(self.doctor.id)
+            self.assertEqual(queue.date, tomorrow.date())
+            self.assertIsNone(queue.status_for(self.patient.id))
+
+    @override_settings(QUEUE_ENGINE_SYNC_SECONDS=0)
+    def test_write_from_another_process_is_picked_up(self):
+        token = self.join()
+        self.assertIsNotNone(queue_engine.status_for(self.doctor.id, self.patient.id))
+
+        # Another worker cancels the token: the version moves, this engine hears nothing
+        with transaction.atomic():
+            Token.objects.filter(id=token.id).update(
+                status='CANCELLED', version=next_queue_version(self.doctor.id, self.today),
+            )
+
+        self.assertIsNone(queue_engine.status_for(self.doctor.id, self.patient.id))
+
+    def test_change_committed_while_loading_is_kept(self):
+        token = self.join()
+        queue_engine.reset()
+        load_many = queue_engine._load_many
+
+        def load_then_cancel(doctor_ids, day):
+            queues = load_many(doctor_ids, day)
+            # Committed (and applied by another thread) after the rows were read
+            token.status = 'CANCELLED'
+            token.version = queues[self.doctor.id].loaded_version + 1
+            queue_engine._apply([TokenState.from_token(token)], 'cancelled')
+            return queues
+
+        with mock.patch.object(queue_engine, '_load_many', side_effect=load_then_cancel):
+            queue = queue_engine.get(self.doctor.id)
+        self.assertIsNone(queue.status_for(self.patient.id))
+
+    def test_async_status_does_not_wait_for_the_lock(self):
+        self.join()
+        queue_engine.get(self.doctor.id)
+        released = threading.Event()
+
+        def hold_lock():
+            with queue_engine._lock:
+                released.wait(5)
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+
+        async def status_while_locked():
+            task = asyncio.ensure_future(queue_engine.astatus_for(self.doctor.id, self.patient.id))
+            # The loop keeps running while the lock is held elsewhere
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            released.set()
+            return await task
+
+        try:
+            with mock.patch.object(queue_engine, '_sync_due', return_value=False):
+                status = async_to_sync(status_while_locked)()
+        finally:
+            released.set()
+            holder.join()
+        self.assertEqual(status['your_token'], 1)
+
+    def test_admin_delete_goes_through_the_queue(self):
+        token = self.join()
+        version = TokenSequence.objects.get(doctor=self.doctor, date=self.today).version
+        with self.captureOnCommitCallbacks(execute=True):
+            site._registry[Token].delete_queryset(None, Token.objects.filter(id=token.id))
+
+        self.assertFalse(Token.objects.filter(id=token.id).exists())
+        self.assertGreater(TokenSequence.objects.get(doctor=self.doctor, date=self.today).version, version)
+        self.assertEqual(QueueEvent.objects.filter(token_id=token.id).latest('id').kind, 'DELETED')
+        self.assertIsNone(queue_engine.status_for(self.doctor.id, self.patient.id))
+
+
+class DoctorDayStatsTests(TestCase):
+    """Running day statistics and the engine's estimate before today has data."""
+
+    def setUp(self):
+        queue_engine.reset()
+        self.doctor = Doctor.objects.create(name="Stats", department="ENT")
+        self.today = timezone.now().date()
+
+    def stats(self):
+        return DoctorDayStats.objects.get(doctor=self.doctor, date=self.today)
+
+    def test_first_consultation_creates_the_row(self):
+        DoctorDayStats.record(self.doctor.id, self.today, 10.0)
+
+        stats = self.stats()
+        self.assertEqual((stats.count, stats.total, stats.total_squares, stats.ewma), (1, 10.0, 100.0, 10.0))
+
+    def test_later_consultations_update_in_one_query(self):
+        DoctorDayStats.record(self.doctor.id, self.today, 10.0)
+        with self.assertNumQueries(1):
+            DoctorDayStats.record(self.doctor.id, self.today, 20.0)
+        DoctorDayStats.record(self.doctor.id, self.today, 5.0)
+
+        stats = self.stats()
+        self.assertEqual((stats.count, stats.total, stats.total_squares), (3, 35.0, 525.0))
+        self.assertAlmostEqual(stats.mean, 35.0 / 3)
+        ewma = 10.0 + DoctorDayStats.EWMA_ALPHA * (20.0 - 10.0)
+        ewma += DoctorDayStats.EWMA_ALPHA * (5.0 - ewma)
+        self.assertAlmostEqual(stats.ewma, ewma)
+
+    def test_row_created_concurrently_is_added_to(self):
+        DoctorDayStats.record(self.doctor.id, self.today, 10.0)
+        real_update = QuerySet.update
+        updates = []
+
+        def racing_update(queryset, **kwargs):
+            # The first update misses the row, as if another worker created it just after
+            updates.append(kwargs)
+            return 0 if len(updates) == 1 else real_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=racing_update):
+            DoctorDayStats.record(self.doctor.id, self.today, 20.0)
+
+        self.assertEqual(len(updates), 2)
+        stats = self.stats()
+        self.assertEqual((stats.count, stats.total), (2, 30.0))
+        self.assertEqual(DoctorDayStats.objects.filter(doctor=self.doctor).count(), 1)
+
+    def test_engine_falls_back_to_the_previous_days_ewma(self):
+        DoctorDayStats.objects.create(
+            doctor=self.doctor, date=self.today - datetime.timedelta(days=3),
+            count=4, total=80.0, total_squares=1700.0, ewma=30.0,
+        )
+        DoctorDayStats.objects.create(
+            doctor=self.doctor, date=self.today - datetime.timedelta(days=1),
+            count=2, total=16.0, total_squares=130.0, ewma=12.0,
+        )
+
+        self.assertEqual(queue_engine.get(self.doctor.id).average_duration(), 12.0)
+
+    def test_engine_uses_todays_stats_once_recorded(self):
+        DoctorDayStats.objects.create(
+            doctor=self.doctor, date=self.today - datetime.timedelta(days=1),
+            count=2, total=16.0, total_squares=130.0, ewma=12.0,
+        )
+        DoctorDayStats.record(self.doctor.id, self.today, 20.0)
+        DoctorDayStats.record(self.doctor.id, self.today, 30.0)
+
+        self.assertEqual(queue_engine.get(self.doctor.id).average_duration(), 25.0)
+
+
+@skipIf(np is None, "NumPy is not installed")
+class PredictionTests(TestCase):
+    """Profiles binned in one vectorized pass, and the ETAs they produce."""
+
+    def setUp(self):
+        queue_engine.reset()
+        self.doctor = Doctor.objects.create(name="Profile", department="ENT")
+        self.other = Doctor.objects.create(name="Other", department="ENT")
+        self.patient = User.objects.create(username="profile-patient")
+        self.numbers = {}
+        # Mondays and a Tuesday in January 2026, 9:00 and 10:00 UTC
+        self.history = {
+            (self.doctor, 0, 9): [4.0, 10.0, 6.0, 20.0],
+            (self.doctor, 0, 10): [12.0],
+            (self.doctor, 1, 9): [8.0, 14.0],
+            (self.other, 0, 9): [30.0, 40.0],
+        }
+        for (doctor, weekday, hour), durations in self.history.items():
+            for week, duration in enumerate(durations):
+                day = datetime.date(2026, 1, 5 + weekday + 7 * (week % 2))
+                self.consult(doctor, self.at(day, hour, week), duration)
+
+    def at(self, day, hour, minute=0):
+        return timezone.make_aware(datetime.datetime.combine(day, datetime.time(hour, minute)))
+
+    def consult(self, doctor, start, duration, created_at=None):
+        created_at = created_at or start
+        number = self.numbers[doctor.id, start.date()] = self.numbers.get((doctor.id, start.date()), 0) + 1
+        token = Token.objects.create(
+            doctor=doctor, patient=self.patient, token_number=number, date=start.date(), status='COMPLETED',
+            start_time=start, end_time=start + datetime.timedelta(minutes=duration), actual_duration=duration,
+        )
+        Token.objects.filter(id=token.id).update(created_at=created_at, ranked_at=created_at)
+
+    def profile(self, doctor, weekday, hour, profiles):
+        return next(
+            profile for profile in profiles
+            if (profile.doctor_id, profile.weekday, profile.hour) == (doctor.id, weekday, hour)
+        )
+
+    def test_cell_matches_a_direct_computation(self):
+        profiles = build_profiles(datetime.date(2026, 2, 1))
+        self.assertEqual(len(profiles), 2 * 168)
+
+        everything = [d for (doctor, _, _), ds in self.history.items() if doctor == self.doctor for d in ds]
+        at_nine = self.history[self.doctor, 0, 9] + self.history[self.doctor, 1, 9]
+        cell = np.array(self.history[self.doctor, 0, 9])
+        hour_mean = (sum(at_nine) + SHRINKAGE * np.mean(everything)) / (len(at_nine) + SHRINKAGE)
+        expected_mean = (cell.sum() + SHRINKAGE * hour_mean) / (len(cell) + SHRINKAGE)
+
+        monday_nine = self.profile(self.doctor, 0, 9, profiles)
+        self.assertEqual(monday_nine.samples, 4)
+        self.assertAlmostEqual(monday_nine.mean, expected_mean)
+        self.assertAlmostEqual(monday_nine.p50, np.percentile(cell, 50))
+        self.assertAlmostEqual(monday_nine.p90, np.percentile(cell, 90))
+
+    def test_empty_cells_shrink_to_the_doctors_mean(self):
+        profiles = build_profiles(datetime.date(2026, 2, 1))
+
+        sunday_night = self.profile(self.doctor, 6, 3, profiles)
+        self.assertEqual(sunday_night.samples, 0)
+        self.assertAlmostEqual(sunday_night.mean, np.mean([8.0, 14.0, 4.0, 10.0, 6.0, 20.0, 12.0]))
+        self.assertIsNone(sunday_night.p50)
+        # Another doctor's consultations stay in their own cells
+        self.assertAlmostEqual(self.profile(self.other, 6, 3, profiles).mean, 35.0)
+
+    def test_engine_estimate_uses_the_profile(self):
+        profiles = build_profiles(datetime.date(2026, 2, 1))
+        save_profiles(profiles)
+        monday_nine = self.profile(self.doctor, 0, 9, profiles).mean
+        monday = self.at(datetime.date(2026, 2, 2), 9, 30)
+
+        queue = queue_engine.get(self.doctor.id)
+        self.assertAlmostEqual(queue.average_duration(monday), monday_nine)
+
+        queue.stats.add(30.0)
+        weight = ConsultationProfile.PRIOR_WEIGHT
+        self.assertAlmostEqual(queue.average_duration(monday), (weight * monday_nine + 30.0) / (weight + 1))
+
+    def test_evaluate_replays_held_out_days(self):
+        holdout = datetime.date(2026, 1, 19)
+        # Called a minute after arriving; the next arrives 9 minutes into that consultation
+        self.consult(self.doctor, self.at(holdout, 8, 51), 15.0, created_at=self.at(holdout, 8, 50))
+        self.consult(self.doctor, self.at(holdout, 9, 6), 15.0, created_at=self.at(holdout, 9))
+
+        results = evaluate(holdout, holdout)
+
+        model_avg = self.profile(self.doctor, 0, 9, build_profiles(holdout)).mean
+        self.assertEqual(results["predictions"], 2)
+        self.assertEqual(results["baseline"]["bias"], round((-1 + estimate_wait(default_consultation_minutes(), 0, 9) - 6) / 2, 2))
+        self.assertEqual(results["model"]["bias"], round((-1 + estimate_wait(model_avg, 0, 9) - 6) / 2, 2))
+        self.assertNotEqual(results["model"], results["baseline"])
+
+
+class MyQueuesTests(TestCase):
+    """Every queue the patient waits in today, authenticated from token claims alone."""
+
+    def setUp(self):
+        queue_engine.reset()
+        access.clear()
+        self.today = timezone.now().date()
+        self.patient = User.objects.create(username="many-queues")
+        self.auth = f'Bearer {ClaimsTokenObtainPairSerializer.get_token(self.patient).access_token}'
+        self.doctors = [Doctor.objects.create(name=f"Many {i}", department="ENT") for i in range(4)]
+
+        busy, quiet, yesterday, done = self.doctors
+        for number in (1, 2):
+            Token.objects.create(
+                doctor=busy, patient=User.objects.create(username=f"ahead-{number}"),
+                token_number=number, date=self.today,
+            )
+        self.token(busy, 3)
+        self.token(quiet, 1)
+        self.token(yesterday, 1, date=self.today - datetime.timedelta(days=1))
+        self.token(done, 1, status='COMPLETED')
+
+    def token(self, doctor, number, **fields):
+        fields.setdefault('date', self.today)
+        return Token.objects.create(doctor=doctor, patient=self.patient, token_number=number, **fields)
+
+    def test_claims_user_id_is_the_primary_key(self):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=self.auth)
+        user, _ = ClaimsJWTAuthentication().authenticate(request)
+        self.assertIsInstance(user, ClaimsUser)
+        self.assertEqual(user.id, self.patient.id)
+        self.assertIsInstance(user.id, int)
+
+    def test_my_queues(self):
+        response = APIClient().get('/api/queues/my-queues/', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(queue['doctor_id'], queue['your_token'], queue['people_ahead']) for queue in response.data['queues']],
+            [(self.doctors[1].id, 1, 0), (self.doctors[0].id, 3, 2)],
+        )
+
+    def test_queue_status(self):
+        response = APIClient().get(
+            '/api/queues/status/', {'doctor_id': self.doctors[0].id}, HTTP_AUTHORIZATION=self.auth,
+        )
+        self.assertEqual(response.json()['people_ahead'], 2)
+
+
+class OccupancyTests(TestCase):
+    """Staff see waiting counts per doctor, for a department or the whole hospital."""
+
+    def setUp(self):
+        queue_engine.reset()
+        directory._forget()
+        access.clear()
+        self.today = timezone.now().date()
+        self.staff = User.objects.create(username="occupancy-staff", is_staff=True)
+        self.ear = Doctor.objects.create(name="Ear", department="ENT")
+        self.nose = Doctor.objects.create(name="Nose", department="ENT")
+        self.heart = Doctor.objects.create(name="Heart", department="Cardiology")
+        for doctor, count in ((self.ear, 2), (self.nose, 0), (self.heart, 3)):
+            for number in range(1, count + 1):
+                Token.objects.create(
+                    doctor=doctor, patient=User.objects.create(username=f"{doctor.name}-{number}"),
+                    token_number=number, date=self.today,
+                )
+
+    def occupancy(self, user, **params):
+        auth = f'Bearer {ClaimsTokenObtainPairSerializer.get_token(user).access_token}'
+        return APIClient().get('/api/queues/occupancy/', params, HTTP_AUTHORIZATION=auth)
+
+    def test_department(self):
+        response = self.occupancy(self.staff, department="ENT")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["department"], "ENT")
+        self.assertEqual(response.data["waiting"], 2)
+        self.assertEqual(
+            {row["doctor_id"]: row["waiting"] for row in response.data["doctors"]},
+            {self.ear.id: 2, self.nose.id: 0},
+        )
+
+    def test_whole_hospital(self):
+        response = self.occupancy(self.staff)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data["department"])
+        self.assertEqual(response.data["waiting"], 5)
+        self.assertEqual(
+            {row["doctor_id"]: (row["department"], row["waiting"]) for row in response.data["doctors"]},
+            {self.ear.id: ("ENT", 2), self.nose.id: ("ENT", 0), self.heart.id: ("Cardiology", 3)},
+        )
+
+    def test_staff_only(self):
+        patient = User.objects.create(username="occupancy-patient")
+        self.assertEqual(self.occupancy(patient).status_code, 403)
+
+
+class StreamingTests(TestCase):
+    """Channels exist only for known doctors; other workers' changes reach subscribers."""
+
+    def setUp(self):
+        queue_engine.reset()
+        self.doctor = Doctor.objects.create(name="Stream", department="ENT")
+        self.patient = User.objects.create(username="stream-patient")
+        self.today = timezone.now().date()
+
+    def test_unknown_doctor_opens_no_channel(self):
+        response = self.client.get(
+            '/api/queues/stream/', {'doctor_id': self.doctor.id + 1000},
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.patient)}',
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(broadcaster.last_seq(self.doctor.id + 1000), 0)
+        self.assertNotIn(self.doctor.id + 1000, broadcaster._channels)
+
+    @override_settings(QUEUE_ENGINE_SYNC_SECONDS=0)
+    def test_change_by_another_worker_is_published(self):
+        token = Token.objects.create(doctor=self.doctor, patient=self.patient, token_number=1, date=self.today)
+        queue_engine.get(self.doctor.id)
+        last_seq = broadcaster.last_seq(self.doctor.id)
+
+        # Another worker calls the patient: the version moves, nothing is published here
+        with transaction.atomic():
+            Token.objects.filter(id=token.id).update(
+                status='SERVING', version=next_queue_version(self.doctor.id, self.today),
+            )
+
+        async def first_frame():
+            frames = broadcaster.subscribe(
+                self.doctor.id, last_seq,
+                poll=lambda: queue_engine.aget(self.doctor.id), poll_seconds=0.01,
+            )
+            return await asyncio.wait_for(frames.__anext__(), 5)
+
+        frame = async_to_sync(first_frame)().decode()
+        self.assertIn('"event":"reloaded"', frame)
+        self.assertIn('"currently_serving":1', frame)
+
+    def test_subscribers_share_one_check(self):
+        polls = []
+
+        async def poll():
+            polls.append(None)
+            if len(polls) == 3:
+                broadcaster.publish(self.doctor.id, {"event": "reloaded"})
+
+        async def subscribe_many():
+            last_seq = broadcaster.last_seq(self.doctor.id)
+            streams = [
+                broadcaster.subscribe(self.doctor.id, last_seq, poll=poll, poll_seconds=0.01)
+                for _ in range(10)
+            ]
+            frames = await asyncio.wait_for(asyncio.gather(*(stream.__anext__() for stream in streams)), 5)
+            channel = broadcaster._channels[self.doctor.id]
+            poller = channel.pollers[asyncio.get_running_loop()]
+            for stream in streams:
+                await stream.aclose()
+            await asyncio.sleep(0)
+            return frames, poller, channel
+
+        frames, poller, channel = async_to_sync(subscribe_many)()
+        self.assertEqual(len(frames), 10)
+        # One check per interval for the channel, not one per subscriber
+        self.assertEqual(len(polls), 3)
+        self.assertTrue(poller.cancelled())
+        self.assertEqual(channel.pollers, {})
+        self.assertEqual(channel.subscribers, {})
+
+
+class FullQueueDeltaTests(TestCase):
+    """``full_queue?since=`` answers the same in every worker."""
+
+    def setUp(self):
+        queue_engine.reset()
+        self.staff = User.objects.create(username="delta-doctor", is_staff=True)
+        self.doctor = Doctor.objects.create(name="Delta", department="ENT", user=self.staff)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.auth = f'Bearer {AccessToken.for_user(self.staff)}'
+        for i in range(3):
+            patient = APIClient()
+            patient.force_authenticate(User.objects.create(username=f"delta-{i}"))
+            patient.post('/api/queues/join/', {'doctor_id': self.doctor.id})
+
+    def full_queue(self, **params):
+        return self.client.get('/api/queues/full-queue/', params, HTTP_AUTHORIZATION=self.auth)
+
+    def test_removals_seen_by_a_fresh_worker(self):
+        version = self.full_queue().json()['version']
+        deleted = Token.objects.get(doctor=self.doctor, token_number=2)
+        self.client.delete(f'/api/queues/delete-token/{deleted.id}/')
+        urgent = Token.objects.get(doctor=self.doctor, token_number=3)
+        self.client.post('/api/queues/priority/', {'token_id': urgent.id, 'priority': 1})
+
+        # A worker that never saw the deletion
+        queue_engine.reset()
+        delta = self.full_queue(since=version).json()
+        self.assertEqual(delta['removed'], [deleted.id])
+        self.assertEqual([row['token_number'] for row in delta['changed']], [3])
+        self.assertEqual(self.full_queue(since=delta['version']).status_code, 304)
+
+    def test_version_from_before_today_gets_the_whole_queue(self):
+        response = self.full_queue(since=0).json()
+        self.assertEqual(response['total_tokens'], 3)
+        self.assertNotIn('removed', response)
+
+
+class JournalTests(TestCase):
+
+    def setUp(self):
+        queue_engine.reset()
+        self.staff = User.objects.create(username="journal-doctor", is_staff=True)
+        self.doctor = Doctor.objects.create(name="Journal", department="ENT", user=self.staff)
+        self.today = timezone.now().date()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.patients = []
+        for i in range(4):
+            patient = APIClient()
+            patient.force_authenticate(User.objects.create(username=f"journal-{i}"))
+            patient.post('/api/queues/join/', {'doctor_id': self.doctor.id})
+            self.patients.append(patient)
+        self.joined = QueueEvent.objects.latest('id').id
+
+        self.client.post('/api/queues/call-next/')
+        self.client.post('/api/queues/call-next/')
+        self.patients[2].post('/api/queues/cancel/', {'doctor_id': self.doctor.id})
+        last = Token.objects.get(doctor=self.doctor, token_number=4)
+        self.client.post('/api/queues/priority/', {'token_id': last.id, 'priority': 1})
+
+    def test_replay_matches_the_live_queue(self):
+        queue = journal.replay(self.doctor.id, self.today)
+        self.assertEqual(
+            {state.id: (state.token_number, state.status) for state in queue.tokens.values()},
+            {token.id: (token.token_number, token.status) for token in Token.objects.filter(doctor=self.doctor)},
+        )
+        self.assertEqual(queue.serving.token_number, 2)
+        self.assertEqual(queue.version, queue_engine.get(self.doctor.id).version)
+
+        out = StringIO()
+        call_command('replay_queue', self.doctor.id, verify=True, stdout=out)
+        self.assertIn("Replay matches all 4 live token(s)", out.getvalue())
+
+    def test_replay_up_to_a_sequence_number(self):
+        queue = journal.replay(self.doctor.id, self.today, upto=self.joined)
+        self.assertIsNone(queue.serving)
+        self.assertEqual([number for _, number in queue.waiting], [1, 2, 3, 4])
+
+    def test_consumer_resumes_after_a_failed_batch(self):
+        def broken(events):
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            journal.consume('rollups', broken, limit=3)
+        self.assertFalse(QueueEventCursor.objects.filter(name='rollups').exists())
+
+        seen = []
+        while journal.consume('rollups', seen.extend, limit=3):
+            pass
+        self.assertEqual([event.id for event in seen], list(QueueEvent.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(QueueEventCursor.objects.get(name='rollups').position, seen[-1].id)
+
+    def test_events_endpoint(self):
+        response = self.client.get('/api/queues/events/', {'after': self.joined, 'doctor_id': self.doctor.id}).json()
+        self.assertEqual(
+            [event['kind'] for event in response['events']],
+            ['CALLED', 'COMPLETED', 'CALLED', 'CANCELLED', 'PRIORITIZED'],
+        )
+        self.assertEqual(response['last_seq'], response['events'][-1]['seq'])
+        self.assertEqual(
+            self.client.get('/api/queues/events/', {'after': response['last_seq']}).json(),
+            {'events': [], 'last_seq': response['last_seq']},
+        )
+
+    def test_events_endpoint_refuses_bad_parameters(self):
+        for params in (
+            {'limit': -1}, {'limit': 0}, {'limit': 'x'}, {'limit': ''}, {'limit': '1.5'},
+            {'after': -1}, {'after': 'x'}, {'doctor_id': 'x'},
+        ):
+            response = self.client.get('/api/queues/events/', params)
+            self.assertEqual(response.status_code, 400, params)
+        self.assertEqual(len(self.client.get('/api/queues/events/', {'limit': 1}).json()['events']), 1)
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.doctor = Doctor.objects.create(name="Archive", department="ENT")
+        self.today = timezone.now().date()
+        self.yesterday = self.today - datetime.timedelta(days=1)
+        self.tokens = {}
+        for number, (day, status) in enumerate([
+            (self.yesterday, 'COMPLETED'), (self.yesterday, 'SKIPPED'), (self.yesterday, 'CANCELLED'),
+            (self.yesterday, 'WAITING'), (self.yesterday, 'SERVING'), (self.today, 'COMPLETED'),
+        ], start=1):
+            self.tokens[number] = Token.objects.create(
+                doctor=self.doctor, patient=User.objects.create(username=f"archive-{number}"),
+                token_number=number, date=day, status=status,
+            )
+        self.swap = SwapRequest.objects.create(from_token=self.tokens[1], to_token=self.tokens[2])
+
+    def live_ids(self):
+        return set(Token.objects.values_list('id', flat=True))
+
+    def test_finished_tokens_archived(self):
+        self.assertEqual(archive_before(self.today, batch_size=2), (3, 1))
+        self.assertEqual(archive_before(self.today, batch_size=2), (0, 0))
+
+        self.assertEqual(self.live_ids(), {self.tokens[n].id for n in (4, 5, 6)})
+        self.assertEqual(
+            set(ArchivedToken.objects.values_list('id', 'status')),
+            {(self.tokens[n].id, self.tokens[n].status) for n in (1, 2, 3)},
+        )
+        self.assertEqual(ArchivedSwapRequest.objects.get().status, 'EXPIRED')
+        # History reads both tables
+        self.assertEqual(
+            sorted(token_history(lambda tokens: tokens.filter(doctor=self.doctor).values_list('token_number', flat=True))),
+            [1, 2, 3, 4, 5, 6],
+        )
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as export_dir:
+            self.assertEqual(archive_before(self.today, export_dir=export_dir), (3, 1))
+            [name] = os.listdir(export_dir)
+            with gzip.open(os.path.join(export_dir, name), 'rt') as fh:
+                rows = [json.loads(line) for line in fh]
+
+        self.assertEqual([row['kind'] for row in rows], ['token'] * 3 + ['swap'])
+        self.assertEqual([row['token_number'] for row in rows[:3]], [1, 2, 3])
+        self.assertFalse(ArchivedToken.objects.exists())
+        self.assertEqual(self.live_ids(), {self.tokens[n].id for n in (4, 5, 6)})
+
+    def test_command_reports_tokens_left_open(self):
+        out = StringIO()
+        call_command('archive_tokens', keep_days=0, stdout=out)
+        output = out.getvalue()
+        self.assertIn("Archived 3 token(s) and 1 swap request(s)", output)
+        self.assertIn("2 token(s) dated before", output)
+
+
+class AnalyticsTests(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create(username="analyst", is_staff=True)
+        self.doctors = [Doctor.objects.create(name=f"Rollup {i}", department="ENT") for i in range(2)]
+        self.today = timezone.now().date()
+        self.days = [self.today - datetime.timedelta(days=2), self.today - datetime.timedelta(days=1)]
+        first, second = self.days
+        self.token(0, first, 'COMPLETED', duration=10, wait=5)
+        self.token(0, first, 'COMPLETED', duration=20, wait=15)
+        self.token(0, first, 'CANCELLED')
+        self.token(0, second, 'COMPLETED', duration=30, wait=0)
+        self.token(0, second, 'SKIPPED')
+        self.token(0, self.today, 'WAITING')
+        self.token(1, first, 'COMPLETED', duration=6, wait=2)
+
+    def token(self, doctor, day, status, duration=None, wait=None):
+        joined = timezone.make_aware(datetime.datetime.combine(day, datetime.time(9)))
+        token = Token.objects.create(
+            doctor=self.doctors[doctor], patient=User.objects.create(username=f"rollup-{Token.objects.count()}"),
+            token_number=Token.objects.filter(doctor=self.doctors[doctor], date=day).count() + 1, date=day,
+            status=status, actual_duration=duration,
+            start_time=joined + datetime.timedelta(minutes=wait) if wait is not None else None,
+        )
+        Token.objects.filter(id=token.id).update(created_at=joined)
+
+    def get(self, **params):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        return client.get('/api/queues/analytics/', params)
+
+    def test_rollup(self):
+        self.assertEqual(analytics.rollup_all(self.today), {self.doctors[0].id: 2, self.doctors[1].id: 1})
+        self.assertEqual(analytics.rollup_all(self.today), {self.doctors[0].id: 0, self.doctors[1].id: 0})
+
+        day = DoctorDailyRollup.objects.get(doctor=self.doctors[0], date=self.days[0])
+        self.assertEqual((day.tokens_issued, day.completed, day.cancelled, day.consultations), (3, 2, 1, 2))
+        self.assertEqual((day.duration_mean, day.duration_p50, day.duration_p90), (15, 15, 19))
+        self.assertEqual((day.waits, day.wait_mean), (2, 10))
+        self.assertFalse(DoctorDailyRollup.objects.filter(date=self.today).exists())
+
+    def test_recompute_reads_archived_days(self):
+        analytics.rollup_all(self.today)
+        before = list(DoctorDailyRollup.objects.order_by('doctor_id', 'date').values(*analytics.ROLLUP_FIELDS))
+        archive_before(self.today)
+
+        analytics.rollup_all(self.today, since=self.days[0])
+        after = list(DoctorDailyRollup.objects.order_by('doctor_id', 'date').values(*analytics.ROLLUP_FIELDS))
+        self.assertEqual(after, before)
+
+    def test_range_totals_are_exact(self):
+        analytics.rollup_all(self.today)
+        response = self.get(doctor_id=self.doctors[0].id, start=self.days[0], end=self.days[1]).json()
+
+        self.assertEqual([day['date'] for day in response['days']], [str(day) for day in self.days])
+        summary = response['summary']
+        self.assertEqual((summary['tokens_issued'], summary['completed'], summary['skipped']), (5, 3, 1))
+        # Over all consultations, not the mean of the daily means (22.5)
+        self.assertEqual(summary['avg_consultation_minutes'], 20)
+        self.assertAlmostEqual(summary['avg_wait_minutes'], 20 / 3)
+
+    def test_every_doctor(self):
+        analytics.rollup_all(self.today)
+        doctors = self.get().json()['doctors']
+        self.assertEqual([row['doctor_id'] for row in doctors], [doctor.id for doctor in self.doctors])
+        self.assertEqual(doctors[1]['avg_consultation_minutes'], 6)
+
+    def test_refused(self):
+        self.assertEqual(self.get(start=self.days[1], end=self.days[0]).status_code, 400)
+        self.assertEqual(self.get(start='yesterday').status_code, 400)
+        self.assertEqual(self.get(doctor_id='x').status_code, 400)
+
+        patient = APIClient()
+        patient.force_authenticate(User.objects.create(username="curious"))
+        self.assertEqual(patient.get('/api/queues/analytics/').status_code, 403)
+
+
+class DirectoryTests(TestCase):
+
+    def setUp(self):
+        directory._forget()
+        self.doctors = [
+            Doctor.objects.create(name="Ear", department="ENT"),
+            Doctor.objects.create(name="Nose", department="ent "),
+            Doctor.objects.create(name="Heart", department="Cardiology"),
+        ]
+        self.client = APIClient()
+
+    def listing(self, **params):
+        return self.client.get('/api/queues/doctors/', params)
+
+    def test_etag(self):
+        response = self.listing()
+        self.assertEqual([row['name'] for row in response.data], ["Ear", "Nose", "Heart"])
+        etag = response.headers['ETag']
+
+        cached = self.client.get('/api/queues/doctors/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.headers['ETag'], etag)
+
+        ent = self.listing(department='ENT')
+        self.assertEqual([row['name'] for row in ent.data], ["Ear", "Nose"])
+        self.assertNotEqual(ent.headers['ETag'], etag)
+        self.assertEqual(self.listing(department='Nowhere').data, [])
+
+    @override_settings(DOCTOR_DIRECTORY_SYNC_SECONDS=3600)
+    def test_cached_within_the_sync_interval(self):
+        self.listing()
+        with self.assertNumQueries(0):
+            self.listing()
+
+    @override_settings(DOCTOR_DIRECTORY_SYNC_SECONDS=3600)
+    def test_saved_doctor(self):
+        etag = self.listing().headers['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctors[0].name = "Throat"
+            self.doctors[0].save()
+
+        response = self.client.get('/api/queues/doctors/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['name'], "Throat")
+
+    @override_settings(DOCTOR_DIRECTORY_SYNC_SECONDS=3600)
+    def test_deleted_doctor(self):
+        self.listing()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctors[2].delete()
+        self.assertEqual([row['name'] for row in self.listing().data], ["Ear", "Nose"])
+
+    @override_settings(DOCTOR_DIRECTORY_SYNC_SECONDS=0)
+    def test_changed_by_another_worker(self):
+        self.listing()
+        # What another worker's save does, without this process's signal handlers
+        Doctor.objects.filter(id=self.doctors[1].id).update(name="Sinus")
+        DoctorDirectoryVersion.objects.filter(pk=1).update(token='changed-elsewhere')
+
+        self.assertEqual(self.listing().data[1]['name'], "Sinus")
+
+
+class DepartmentIndexTests(SimpleTestCase):
+    """Doctors in order of when they could call a patient joining now."""
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def queue(self, doctor_id, waiting):
+        queue = DoctorQueue(doctor_id, self.now.date())
+        queue.fallback_minutes = 10
+        self.add_waiting(queue, waiting)
+        return queue
+
+    def add_waiting(self, queue, count):
+        start = len(queue.tokens)
+        for number in range(start + 1, start + count + 1):
+            queue.apply(_state(queue.doctor_id * 100 + number, number, joined=self.now))
+
+    def test_soonest_free_first(self):
+        queues = {1: self.queue(1, 3), 2: self.queue(2, 2), 3: self.queue(3, 0)}
+        index = DepartmentIndex('v1', self.now.date(), queues)
+        self.assertEqual(index.least_loaded(self.now), 3)
+
+        self.add_waiting(queues[3], 3)
+        index.push(queues[3], self.now)
+        self.assertEqual(index.least_loaded(self.now), 2)
+        # The superseded entry of doctor 3 was dropped on the way
+        self.assertEqual(sum(1 for entry in index.heap if entry[2] == 3), 1)
+
+    def test_ties_go_to_the_shorter_queue_then_the_lower_id(self):
+        # One waiting and nobody serving: called right away, like an idle doctor
+        index = DepartmentIndex('v1', self.now.date(), {1: self.queue(1, 1), 2: self.queue(2, 0), 3: self.queue(3, 0)})
+        self.assertEqual(index.least_loaded(self.now), 2)
+
+    def test_rekeyed_when_a_queue_outgrew_its_entry(self):
+        queues = {1: self.queue(1, 0), 2: self.queue(2, 2)}
+        index = DepartmentIndex('v1', self.now.date(), queues)
+        # Changed without a push, as when a consultation overruns its estimate
+        self.add_waiting(queues[1], 3)
+
+        self.assertEqual(index.least_loaded(self.now), 2)
+        self.assertEqual(index.entries[1][1], 3)
+
+
+class DepartmentJoinTests(TestCase):
+
+    def setUp(self):
+        queue_engine.reset()
+        directory._forget()
+        self.today = timezone.now().date()
+        self.busy = Doctor.objects.create(name="Busy", department="ENT")
+        self.quiet = Doctor.objects.create(name="Quiet", department="ENT")
+        Doctor.objects.create(name="Heart", department="Cardiology")
+        for doctor, count in ((self.busy, 2), (self.quiet, 1)):
+            for number in range(1, count + 1):
+                Token.objects.create(
+                    doctor=doctor, patient=User.objects.create(username=f"{doctor.name}-{number}"),
+                    token_number=number, date=self.today,
+                )
+        self.patient = User.objects.create(username="department-patient")
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def join(self, **data):
+        return self.client.post('/api/queues/join/', data)
+
+    def test_least_loaded_doctor(self):
+        response = self.join(department='ent')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['doctor_id'], response.data['token_number']), (self.quiet.id, 2))
+
+        again = self.join(department='ENT')
+        self.assertEqual(again.status_code, 400)
+        self.assertEqual(again.data['doctor_id'], self.quiet.id)
+
+    def test_unknown_department(self):
+        self.assertEqual(self.join(department='Dermatology').status_code, 404)
+
+    def test_rebuilt_when_the_directory_changes(self):
+        self.assertEqual(queue_engine.least_loaded('ENT'), self.quiet.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            new = Doctor.objects.create(name="New", department="ENT")
+        self.assertEqual(queue_engine.least_loaded('ENT'), new.id)
+
+    def test_open_token_of_an_earlier_day_does_not_block(self):
+        Token.objects.create(
+            doctor=self.busy, patient=self.patient, token_number=7,
+            date=self.today - datetime.timedelta(days=3),
+        )
+        self.assertEqual(self.join(department='ENT').status_code, 200)
+        self.assertEqual(self.join(doctor_id=self.busy.id).status_code, 200)
@@ -1,17 +1,24 @@
 from django.urls import path
-from .views import join_queue, call_next,queue_status,full_queue,cancel_token,skip_token,delete_token,force_complete  
+from .views import list_doctors, join_queue, call_next,queue_status,my_queues,full_queue,department_occupancy,cancel_token,skip_token,set_priority,delete_token,force_complete,queue_stream,queue_analytics,queue_events
 
 
 urlpatterns = [
+    path('doctors/', list_doctors),
     path('join/', join_queue),
     path('call-next/', call_next),
     path('status/', queue_status),
+    path('my-queues/', my_queues),
+    path('stream/', queue_stream),
     path('full-queue/', full_queue),
+    path('occupancy/', department_occupancy),
     path('cancel/', cancel_token),
     path('skip/', skip_token),
+    path('priority/', set_priority),
     path('full-queue/', full_queue),
     path('delete-token/<int:token_id>/', delete_token),
     path('force-complete/', force_complete),
+    path('analytics/', queue_analytics),
+    path('events/', queue_events),
 
 
 ]
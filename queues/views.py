@@ -1,53 +1,84 @@
-from rest_framework.decorators import api_view, permission_classes
+import datetime
+
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
-from .models import Doctor, Token
-
-
-# 🔹 List Doctors (with optional department filter)
+from django.utils.http import parse_etags
+from . import analytics, directory, journal
+from .models import Doctor, DoctorDayStats, QueueEvent, Token
+from .engine import queue_engine
+from .sequences import acurrent_queue_version, next_queue_version, next_token_number
+from .streaming import broadcaster, encode_event
+from smartqueue.throttling import FullQueueThrottle, MyQueuesThrottle, QueueStatusThrottle
+from notifications.outbox import enqueue_turn_notices
+from users.authentication import ClaimsJWTAuthentication, async_view
+
+
+# 🔹 List Doctors (with optional department filter), served from the directory cache
 @api_view(['GET'])
 def list_doctors(request):
-    department = request.query_params.get('department')
+    rows, etag = directory.listing(request.query_params.get('department'))
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
 
-    if department:
-        doctors = Doctor.objects.filter(department__iexact=department)
-    else:
-        doctors = Doctor.objects.all()
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        return Response(status=304, headers=headers)
 
-    data = [
-        {
-            "id": doctor.id,
-            "name": doctor.name,
-            "department": doctor.department
-        }
-        for doctor in doctors
-    ]
-
-    return Response(data)
+    return Response(rows, headers=headers)
 
 
 # 🔹 Patient joins queue (NO multiple active tokens allowed)
+# Either a doctor_id, or a department to be given its least loaded doctor
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def join_queue(request):
     doctor_id = request.data.get('doctor_id')
+    department = request.data.get('department')
+
+    if not doctor_id and not department:
+        return Response({"error": "doctor_id or department is required"}, status=400)
+
+    # Tokens of earlier days left open don't count: the queue is today's
+    today = timezone.now().date()
 
     if not doctor_id:
-        return Response({"error": "doctor_id is required"}, status=400)
+        doctors, _ = directory.listing(department)
+
+        # 🚫 One active token per department
+        active_token = Token.objects.filter(
+            doctor_id__in=[doctor['id'] for doctor in doctors],
+            patient=request.user,
+            status__in=['WAITING', 'SERVING'],
+            date=today
+        ).first()
+
+        if active_token:
+            return Response({
+                "error": "You already have an active appointment in this department",
+                "doctor_id": active_token.doctor_id,
+                "token_number": active_token.token_number,
+                "status": active_token.status
+            }, status=400)
+
+        doctor_id = queue_engine.least_loaded(department)
+        if doctor_id is None:
+            return Response({"error": "Department not found"}, status=404)
 
     try:
         doctor = Doctor.objects.get(id=doctor_id)
     except Doctor.DoesNotExist:
         return Response({"error": "Doctor not found"}, status=404)
 
-    today = timezone.now().date()
-
     # 🚫 Block if user already has active token
     active_token = Token.objects.filter(
         doctor=doctor,
         patient=request.user,
-        status__in=['WAITING', 'SERVING']
+        status__in=['WAITING', 'SERVING'],
+        date=today
     ).first()
 
     if active_token:
@@ -57,111 +88,145 @@ def join_queue(request):
             "status": active_token.status
         }, status=400)
 
-    # 🔢 Generate next token number
-    last_token = Token.objects.filter(
-        doctor=doctor,
-        date=today
-    ).order_by('-token_number').first()
+    # 🔢 Generate next token number (atomic per doctor/day counter)
+    with transaction.atomic():
+        new_token_number, version = next_token_number(doctor.id, today)
 
-    new_token_number = last_token.token_number + 1 if last_token else 1
-
-    Token.objects.create(
-        doctor=doctor,
-        patient=request.user,
-        token_number=new_token_number,
-        date=today,
-        status='WAITING'
-    )
+        token = Token.objects.create(
+            doctor=doctor,
+            patient=request.user,
+            token_number=new_token_number,
+            date=today,
+            status='WAITING',
+            version=version
+        )
+        journal.record('JOINED', token, at=token.created_at)
+        queue_engine.apply(token, event='joined')
 
     return Response({
         "message": "Joined queue successfully",
+        "doctor_id": doctor.id,
+        "doctor_name": doctor.name,
         "token_number": new_token_number
     })
 
 
-# 🔹 Queue Status (Dynamic Intelligent Estimation)
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def queue_status(request):
-    doctor_id = request.query_params.get('doctor_id')
+# 🔹 Queue Status (Dynamic Intelligent Estimation, served from memory on the event loop)
+@async_view(throttle=QueueStatusThrottle)
+async def queue_status(request):
+    doctor_id = request.GET.get('doctor_id')
 
     if not doctor_id:
-        return Response({"error": "doctor_id required"}, status=400)
+        return JsonResponse({"error": "doctor_id required"}, status=400)
 
-    today = timezone.now().date()
+    try:
+        doctor_id = int(doctor_id)
+    except ValueError:
+        return JsonResponse({"error": "Invalid doctor_id"}, status=400)
 
     try:
-        doctor = Doctor.objects.get(id=doctor_id)
+        status = await queue_engine.astatus_for(doctor_id, request.user.id)
     except Doctor.DoesNotExist:
-        return Response({"error": "Doctor not found"}, status=404)
+        return JsonResponse({"error": "Doctor not found"}, status=404)
 
-    # Current serving
-    current_token = Token.objects.filter(
-        doctor=doctor,
-        status='SERVING',
-        date=today
-    ).first()
+    if status is None:
+        return JsonResponse({"message": "You are not in queue"})
 
-    current_number = current_token.token_number if current_token else 0
+    return JsonResponse(status)
 
-    # Patient token
-    patient_token = Token.objects.filter(
-        doctor=doctor,
-        patient=request.user,
+
+# 🔹 All of the patient's queues today at once (one query, statuses served from memory)
+@api_view(['GET'])
+@authentication_classes([ClaimsJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@throttle_classes([MyQueuesThrottle])
+def my_queues(request):
+    tokens = Token.objects.filter(
+        patient_id=request.user.id,
         status__in=['WAITING', 'SERVING'],
-        date=today
-    ).first()
+        date=timezone.now().date(),
+    ).values_list('doctor_id', 'doctor__name', 'doctor__department')
+    doctors = {doctor_id: (name, department) for doctor_id, name, department in tokens}
 
-    if not patient_token:
-        return Response({"message": "You are not in queue"})
+    statuses = queue_engine.statuses_for(doctors, request.user.id)
 
-    people_ahead = Token.objects.filter(
-        doctor=doctor,
-        status='WAITING',
-        date=today,
-        token_number__lt=patient_token.token_number
-    ).count()
+    queues = [
+        {
+            "doctor_id": doctor_id,
+            "doctor_name": doctors[doctor_id][0],
+            "department": doctors[doctor_id][1],
+            **status,
+        }
+        for doctor_id, status in statuses.items()
+    ]
+    queues.sort(key=lambda queue: queue["estimated_wait_minutes"])
+    return Response({"queues": queues})
 
-    # 🔥 Calculate dynamic average time
-    completed_tokens = Token.objects.filter(
-        doctor=doctor,
-        date=today,
-        status='COMPLETED',
-        actual_duration__isnull=False
-    )
-
-    if completed_tokens.exists():
-        avg_time = sum(t.actual_duration for t in completed_tokens) / completed_tokens.count()
-    else:
-        avg_time = doctor.consultation_time
-
-    # 🔥 Remaining time of current serving
-    remaining_time = 0
-
-    if current_token and current_token.start_time:
-        time_spent = (timezone.now() - current_token.start_time).total_seconds() / 60
-        remaining_time = max(avg_time - time_spent, 0)
-
-    # 🔥 Final estimated wait
-    if people_ahead > 0:
-        estimated_wait = remaining_time + (people_ahead - 1) * avg_time
-    else:
-        estimated_wait = remaining_time
-
-    total_in_queue = Token.objects.filter(
-        doctor=doctor,
-        status='WAITING',
-        date=today
-    ).count()
 
-    return Response({
-        "currently_serving": current_number,
-        "your_token": patient_token.token_number,
-        "people_ahead": people_ahead,
-        "estimated_wait_minutes": round(estimated_wait, 1),
-        "average_consultation_time": round(avg_time, 1),
-        "total_in_queue": total_in_queue
-    })
+async def _authenticate(request):
+    try:
+        result = await ClaimsJWTAuthentication().aauthenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+# 🔹 Live queue updates (Server-Sent Events, serve under ASGI)
+async def queue_stream(request):
+    if request.method != 'GET':
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    user = await _authenticate(request)
+    if user is None:
+        return JsonResponse({"error": "Authentication required"}, status=401)
+
+    try:
+        doctor_id = int(request.GET.get('doctor_id', ''))
+    except ValueError:
+        return JsonResponse({"error": "doctor_id required"}, status=400)
+
+    try:
+        await queue_engine.aget(doctor_id)
+    except Doctor.DoesNotExist:
+        return JsonResponse({"error": "Doctor not found"}, status=404)
+
+    # Anything published after this point is replayed after the snapshot
+    last_seq = broadcaster.last_seq(doctor_id)
+    status = await queue_engine.astatus_for(doctor_id, user.id)
+
+    async def check_other_workers():
+        # Publishes a 'reloaded' delta if another worker changed the queue
+        await queue_engine.aget(doctor_id)
+
+    async def events():
+        yield encode_event(last_seq, 'snapshot', status or {"message": "You are not in queue"})
+        async for frame in broadcaster.subscribe(
+            doctor_id, last_seq, poll=check_other_workers, poll_seconds=settings.QUEUE_ENGINE_SYNC_SECONDS,
+        ):
+            yield frame
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _finish_serving(token, status, version):
+    """End the serving token's consultation and add its duration to the day's stats."""
+    token.status = status
+    token.end_time = timezone.now()
+    token.version = version
+
+    if token.start_time:
+        duration = (
+            token.end_time - token.start_time
+        ).total_seconds() / 60
+        token.actual_duration = duration
+
+    token.save()
+
+    if token.actual_duration is not None:
+        DoctorDayStats.record(token.doctor_id, token.date, token.actual_duration)
 
 
 # 🔹 Doctor calls next patient
@@ -175,43 +240,45 @@ def call_next(request):
 
     today = timezone.now().date()
 
-    # Complete current serving
-    current_token = Token.objects.filter(
-        doctor=doctor,
-        status='SERVING',
-        date=today
-    ).first()
-
-    if current_token:
-        current_token.status = 'COMPLETED'
-        current_token.end_time = timezone.now()
+    with transaction.atomic():
+        current_token = Token.objects.filter(
+            doctor=doctor,
+            status='SERVING',
+            date=today
+        ).first()
 
-        if current_token.start_time:
-            duration = (
-                current_token.end_time - current_token.start_time
-            ).total_seconds() / 60
-            current_token.actual_duration = duration
+        # Priority first, then join order: a seek on token_doctor_queue_idx
+        next_token = Token.objects.filter(
+            doctor=doctor,
+            status='WAITING',
+            date=today
+        ).order_by('ranked_at', 'token_number').first()
 
-        current_token.save()
+        if current_token or next_token:
+            version = next_queue_version(doctor.id, today)
 
-    # Move next
-    next_token = Token.objects.filter(
-        doctor=doctor,
-        status='WAITING',
-        date=today
-    ).order_by('token_number').first()
+        # Complete current serving
+        if current_token:
+            _finish_serving(current_token, 'COMPLETED', version)
+            journal.record('COMPLETED', current_token, at=current_token.end_time)
+            queue_engine.apply(current_token, event='completed')
 
-    if not next_token:
-        return Response({"message": "No patients waiting"})
+        # Move next
+        if not next_token:
+            return Response({"message": "No patients waiting"})
 
-    next_token.status = 'SERVING'
-    next_token.start_time = timezone.now()
-    next_token.save()
+        next_token.status = 'SERVING'
+        next_token.start_time = timezone.now()
+        next_token.version = version
+        next_token.save()
+        journal.record('CALLED', next_token, at=next_token.start_time)
+        queue_engine.apply(next_token, event='called')
+        enqueue_turn_notices(doctor, today)
 
-    return Response({
-        "message": "Next patient called",
-        "token_number": next_token.token_number
-    })
+        return Response({
+            "message": "Next patient called",
+            "token_number": next_token.token_number
+        })
 
 
 # 🔹 Cancel token
@@ -235,8 +302,12 @@ def cancel_token(request):
     except Token.DoesNotExist:
         return Response({"error": "No active token found"}, status=404)
 
-    token.status = 'COMPLETED'
-    token.save()
+    with transaction.atomic():
+        token.status = 'CANCELLED'
+        token.version = next_queue_version(token.doctor_id, today)
+        token.save()
+        journal.record('CANCELLED', token)
+        queue_engine.apply(token, event='cancelled')
 
     return Response({"message": "Token cancelled successfully"})
 
@@ -252,64 +323,154 @@ def skip_token(request):
 
     today = timezone.now().date()
 
-    current_token = Token.objects.filter(
-        doctor=doctor,
-        status='SERVING',
-        date=today
-    ).first()
-
-    if not current_token:
-        return Response({"error": "No patient currently serving"}, status=404)
+    with transaction.atomic():
+        current_token = Token.objects.filter(
+            doctor=doctor,
+            status='SERVING',
+            date=today
+        ).first()
 
-    current_token.status = 'SKIPPED'
-    current_token.end_time = timezone.now()
+        if not current_token:
+            return Response({"error": "No patient currently serving"}, status=404)
 
-    if current_token.start_time:
-        duration = (
-            current_token.end_time - current_token.start_time
-        ).total_seconds() / 60
-        current_token.actual_duration = duration
+        _finish_serving(current_token, 'SKIPPED', next_queue_version(doctor.id, today))
+        journal.record('SKIPPED', current_token, at=current_token.end_time)
+        queue_engine.apply(current_token, event='skipped')
 
-    current_token.save()
+        return Response({"message": "Patient skipped"})
 
-    return Response({"message": "Patient skipped"})
 
-# 🔹 Admin views full queue (monitor dashboard)
-@api_view(['GET'])
+# 🔹 Staff set a waiting token's priority (triage); it moves up the call order by
+# its head start, patients can't declare it themselves
+@api_view(['POST'])
 @permission_classes([IsAdminUser])
-def full_queue(request):
+def set_priority(request):
+    token_id = request.data.get('token_id')
     try:
-        doctor = Doctor.objects.get(user=request.user)
+        priority = int(request.data.get('priority'))
+    except (TypeError, ValueError):
+        priority = None
+    if priority not in dict(Token.PRIORITY_CHOICES):
+        return Response({"error": "Invalid priority"}, status=400)
+
+    with transaction.atomic():
+        try:
+            token = Token.objects.select_for_update().get(id=token_id, status='WAITING')
+        except (Token.DoesNotExist, ValueError, TypeError):
+            return Response({"error": "Waiting token not found"}, status=404)
+
+        token.priority = priority
+        token.ranked_at = Token.rank_time(token.created_at, priority)
+        token.version = next_queue_version(token.doctor_id, token.date)
+        token.save(update_fields=['priority', 'ranked_at', 'version'])
+        journal.record('PRIORITIZED', token)
+        queue_engine.apply(token, event='prioritized')
+        enqueue_turn_notices(token.doctor, token.date)
+
+    return Response({
+        "message": "Priority updated",
+        "token_number": token.token_number,
+        "priority": token.priority,
+    })
+
+async def _queue_rows(tokens):
+    # One joined projection instead of loading each token's patient
+    return [
+        {
+            "id": row["id"],
+            "token_number": row["token_number"],
+            "patient_username": row["patient__username"],
+            "patient_id": row["patient_id"],
+            "status": row["status"],
+            "priority": row["priority"],
+            "start_time": row["start_time"],
+            "end_time": row["end_time"],
+            "actual_duration": row["actual_duration"]
+        }
+        async for row in tokens.values(
+            'id', 'token_number', 'patient__username', 'patient_id', 'status', 'priority',
+            'start_time', 'end_time', 'actual_duration',
+        )
+    ]
+
+
+# 🔹 Admin views full queue (monitor dashboard, ?since=<version> for changes only)
+@async_view(admin=True, throttle=FullQueueThrottle)
+async def full_queue(request):
+    try:
+        doctor = await Doctor.objects.aget(user_id=request.user.id)
     except Doctor.DoesNotExist:
-        return Response({"error": "Doctor profile not found"}, status=404)
+        return JsonResponse({"error": "Doctor profile not found"}, status=404)
+
+    since = request.GET.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return JsonResponse({"error": "Invalid since"}, status=400)
 
     today = timezone.now().date()
+    version = await acurrent_queue_version(doctor.id, today)
+
+    if since == version:
+        return HttpResponse(status=304)
 
     tokens = Token.objects.filter(
         doctor=doctor,
         date=today
-    ).order_by('token_number')
-
-    queue_data = []
-
-    for token in tokens:
-        queue_data.append({
-            "id": token.id,
-            "token_number": token.token_number,
-            "patient_username": token.patient.username,
-            "patient_id": token.patient.id,
-            "status": token.status,
-            "start_time": token.start_time,
-            "end_time": token.end_time,
-            "actual_duration": token.actual_duration
-        })
-
-    return Response({
+    ).order_by('ranked_at', 'token_number')
+
+    if since is not None and since < version:
+        # Deletions come from the journal, so any worker can answer; a version
+        # from before today's first change gets the whole queue instead
+        events = QueueEvent.objects.filter(doctor=doctor, date=today)
+        first = await events.order_by('id').values_list('version', flat=True).afirst()
+        if first is not None and since >= first:
+            removed = events.filter(kind='DELETED', version__gt=since).values_list('token_id', flat=True)
+            return JsonResponse({
+                "doctor": doctor.name,
+                "version": version,
+                "since": since,
+                "changed": await _queue_rows(tokens.filter(version__gt=since)),
+                "removed": [token_id async for token_id in removed]
+            })
+
+    queue_data = await _queue_rows(tokens)
+
+    return JsonResponse({
         "doctor": doctor.name,
-        "total_tokens": tokens.count(),
+        "version": version,
+        "total_tokens": len(queue_data),
         "queue": queue_data
     })
 
+# 🔹 Occupancy of every doctor in a department (or the hospital), served from memory
+@api_view(['GET'])
+@authentication_classes([ClaimsJWTAuthentication])
+@permission_classes([IsAdminUser])
+def department_occupancy(request):
+    department = request.query_params.get('department')
+    doctors, _ = directory.listing(department)
+
+    occupancy = queue_engine.occupancy([doctor['id'] for doctor in doctors])
+
+    rows = [
+        {
+            "doctor_id": doctor['id'],
+            "doctor_name": doctor['name'],
+            "department": doctor['department'],
+            **occupancy[doctor['id']],
+        }
+        for doctor in doctors
+        if doctor['id'] in occupancy
+    ]
+    return Response({
+        "department": department,
+        "waiting": sum(row["waiting"] for row in rows),
+        "doctors": rows,
+    })
+
+
 @api_view(['DELETE'])
 @permission_classes([IsAdminUser])
 def delete_token(request, token_id):
@@ -318,7 +479,11 @@ def delete_token(request, token_id):
     except Token.DoesNotExist:
         return Response({"error": "Token not found"}, status=404)
 
-    token.delete()
+    with transaction.atomic():
+        token.version = next_queue_version(token.doctor_id, token.date)
+        journal.record('DELETED', token)
+        queue_engine.remove(token, event='deleted')
+        token.delete()
 
     return Response({"message": "Token deleted successfully"})
 
@@ -332,8 +497,91 @@ def force_complete(request):
     except Token.DoesNotExist:
         return Response({"error": "Token not found"}, status=404)
 
-    token.status = 'COMPLETED'
-    token.end_time = timezone.now()
-    token.save()
+    with transaction.atomic():
+        token.status = 'COMPLETED'
+        token.end_time = timezone.now()
+        token.version = next_queue_version(token.doctor_id, token.date)
+        token.save()
+        journal.record('FORCE_COMPLETED', token, at=token.end_time)
+        queue_engine.apply(token, event='force_completed')
 
     return Response({"message": "Token marked as completed"})
+
+
+def _parse_range(request):
+    """``(start, end)`` from the query string; defaults to the 30 days ending today."""
+    try:
+        end = request.query_params.get('end')
+        end = datetime.date.fromisoformat(end) if end else timezone.now().date()
+        start = request.query_params.get('start')
+        start = datetime.date.fromisoformat(start) if start else end - datetime.timedelta(days=29)
+    except ValueError:
+        return None
+    return (start, end) if start <= end else None
+
+
+# 🔹 Analytics over the daily rollups (filled by the rollup_daily command)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def queue_analytics(request):
+    date_range = _parse_range(request)
+    if date_range is None:
+        return Response({"error": "Invalid start/end (YYYY-MM-DD, start <= end)"}, status=400)
+    start, end = date_range
+
+    doctor_id = request.query_params.get('doctor_id')
+    if not doctor_id:
+        return Response({
+            "start": start,
+            "end": end,
+            "doctors": analytics.doctors_range(start, end),
+        })
+
+    try:
+        doctor_id = int(doctor_id)
+    except ValueError:
+        return Response({"error": "Invalid doctor_id"}, status=400)
+
+    days, summary = analytics.doctor_range(doctor_id, start, end)
+    return Response({
+        "doctor_id": doctor_id,
+        "start": start,
+        "end": end,
+        "summary": summary,
+        "days": days,
+    })
+
+
+# 🔹 Tail the queue event journal (?after=<seq>, optional doctor_id, limit up to 1000)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def queue_events(request):
+    try:
+        after = int(request.query_params.get('after', 0))
+        limit = min(int(request.query_params.get('limit', 500)), 1000)
+        doctor_id = request.query_params.get('doctor_id')
+        doctor_id = int(doctor_id) if doctor_id else None
+    except ValueError:
+        return Response({"error": "after, limit and doctor_id must be integers"}, status=400)
+    if after < 0 or limit < 1:
+        return Response({"error": "after must not be negative and limit must be positive"}, status=400)
+
+    events = journal.tail(after, doctor_id, limit)
+
+    return Response({
+        "events": [
+            {
+                "seq": event.id,
+                "kind": event.kind,
+                "doctor_id": event.doctor_id,
+                "date": event.date,
+                "token_id": event.token_id,
+                "patient_id": event.patient_id,
+                "token_number": event.token_number,
+                "version": event.version,
+                "at": event.created_at,
+            }
+            for event in events
+        ],
+        "last_seq": events[-1].id if events else after,
+    })
@@ -3,6 +3,10 @@ ASGI config for smartqueue project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The live queue stream (``/api/queues/stream/``) is an async view that holds a
+connection open per subscriber, so serve it with an ASGI server, e.g.
+``uvicorn smartqueue.asgi:application``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
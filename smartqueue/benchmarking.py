@@ -0,0 +1,122 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks run against a throwaway database created with Django's test
+database machinery, so they never touch the development data. Throttling
+is off meanwhile: the bucket file is shared with the running site, and the
+scratch users reuse real user ids.
+"""
+import contextlib
+import json
+import subprocess
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import override_settings
+
+
+@contextlib.contextmanager
+def isolated_database(name=None, verbosity=0):
+    """Create, migrate and finally destroy a scratch copy of the default DB.
+
+    ``name`` overrides the test database name; give SQLite a file path when
+    several threads need their own connections to the same database.
+    """
+    if name:
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = name
+
+    rest_framework = dict(settings.REST_FRAMEWORK)
+    rest_framework['DEFAULT_THROTTLE_RATES'] = dict.fromkeys(rest_framework.get('DEFAULT_THROTTLE_RATES', {}))
+
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of ``samples``."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(samples_ms):
+    return {
+        "count": len(samples_ms),
+        "mean_ms": round(sum(samples_ms) / len(samples_ms), 3) if samples_ms else 0.0,
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "p99_ms": round(percentile(samples_ms, 99), 3),
+    }
+
+
+def time_call(func, repeat):
+    """Run ``func`` ``repeat`` times and return each duration in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, results):
+    with open(path, 'w') as fh:
+        json.dump(results, fh, indent=2, default=str)
+
+
+class EndpointRecorder:
+    """Latency and SQL query count of every request, grouped by endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def call(self, endpoint, func, *args, **kwargs):
+        executed = []
+
+        def count_queries(execute, sql, params, many, context):
+            executed.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_queries):
+            start = time.perf_counter()
+            response = func(*args, **kwargs)
+            elapsed = (time.perf_counter() - start) * 1000
+
+        self.latencies[endpoint].append(elapsed)
+        self.queries[endpoint].append(len(executed))
+        self.statuses[endpoint][response.status_code] += 1
+        return response
+
+    def report(self):
+        report = {}
+        for endpoint, samples in sorted(self.latencies.items()):
+            queries = self.queries[endpoint]
+            busy_seconds = sum(samples) / 1000
+            report[endpoint] = {
+                **summarize(samples),
+                "throughput_rps": round(len(samples) / busy_seconds, 1) if busy_seconds else 0.0,
+                "queries_mean": round(sum(queries) / len(queries), 2),
+                "queries_max": max(queries),
+                "statuses": dict(self.statuses[endpoint]),
+            }
+        return report
@@ -0,0 +1,243 @@
+"""
+Per-endpoint request metrics in Prometheus text format.
+
+``MetricsMiddleware`` records, for every URL pattern, a latency histogram,
+the number and total time of SQL queries and the response size. ``/metrics``
+(see ``smartqueue/urls.py``) serves them to staff users and to scrapers
+connecting from ``METRICS_ALLOWED_IPS``. Both are off unless
+``METRICS_ENABLED`` is set in settings.
+
+Each thread writes to its own shard, so recording a request never takes a
+lock; a scrape sums the shards. A scrape can see a request half-recorded,
+which Prometheus tolerates as long as counters only ever go up.
+"""
+import contextvars
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Requests that matched no URL pattern share one label, so random paths
+# can't blow up the number of series
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+class RouteStats:
+    __slots__ = ('buckets', 'count', 'latency_sum', 'queries', 'sql_seconds',
+                 'response_bytes', 'statuses')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.latency_sum = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.response_bytes = 0
+        self.statuses = {}
+
+    def merge(self, other):
+        for i, value in enumerate(other.buckets):
+            self.buckets[i] += value
+        self.count += other.count
+        self.latency_sum += other.latency_sum
+        self.queries += other.queries
+        self.sql_seconds += other.sql_seconds
+        self.response_bytes += other.response_bytes
+        for status, value in list(other.statuses.items()):
+            self.statuses[status] = self.statuses.get(status, 0) + value
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'routes', None)
+        if shard is None:
+            shard = self._local.routes = {}
+            # Only taken once per thread
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def record(self, route, method, status, seconds, queries, sql_seconds, response_bytes):
+        shard = self._shard()
+        stats = shard.get((route, method))
+        if stats is None:
+            stats = shard[(route, method)] = RouteStats()
+
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                stats.buckets[i] += 1
+                break
+        stats.count += 1
+        stats.latency_sum += seconds
+        stats.queries += queries
+        stats.sql_seconds += sql_seconds
+        stats.response_bytes += response_bytes
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    def snapshot(self):
+        """Totals per ``(route, method)`` across all threads."""
+        with self._shards_lock:
+            shards = list(self._shards)
+
+        totals = {}
+        for shard in shards:
+            for key, stats in list(shard.items()):
+                totals.setdefault(key, RouteStats()).merge(stats)
+        return totals
+
+    def reset(self):
+        with self._shards_lock:
+            self._shards = []
+        self._local = threading.local()
+
+    def render(self):
+        """The snapshot in Prometheus text exposition format (0.0.4)."""
+        totals = sorted(self.snapshot().items())
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        name = 'smartqueue_http_request_duration_seconds'
+        family(name, 'histogram', "Request latency by URL pattern.")
+        for (route, method), stats in totals:
+            labels = _labels(route=route, method=method)
+            cumulative = 0
+            for bound, value in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += value
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {stats.count}')
+            lines.append(f'{name}_sum{{{labels}}} {stats.latency_sum:.6f}')
+            lines.append(f'{name}_count{{{labels}}} {stats.count}')
+
+        name = 'smartqueue_http_responses_total'
+        family(name, 'counter', "Responses by URL pattern and status code.")
+        for (route, method), stats in totals:
+            for status, value in sorted(stats.statuses.items()):
+                labels = _labels(route=route, method=method, status=status)
+                lines.append(f'{name}{{{labels}}} {value}')
+
+        counters = (
+            ('smartqueue_db_queries_total', "SQL queries run while serving requests.",
+             lambda stats: stats.queries),
+            ('smartqueue_db_query_seconds_total', "Time spent in SQL queries.",
+             lambda stats: f"{stats.sql_seconds:.6f}"),
+            ('smartqueue_http_response_bytes_total', "Response body bytes (streaming responses excluded).",
+             lambda stats: stats.response_bytes),
+        )
+        for name, help_text, value in counters:
+            family(name, 'counter', help_text)
+            for (route, method), stats in totals:
+                lines.append(f'{name}{{{_labels(route=route, method=method)}}} {value(stats)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+registry = MetricsRegistry()
+
+
+# Per request [query count, SQL seconds]; a context variable follows the
+# request into the threads that run sync code under ASGI
+_current_sql = contextvars.ContextVar('metrics_sql', default=None)
+
+
+def _count_queries(execute, query, params, many, context):
+    sql = _current_sql.get()
+    if sql is None:
+        return execute(query, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(query, params, many, context)
+    finally:
+        sql[0] += 1
+        sql[1] += time.perf_counter() - start
+
+
+def _install_wrapper(sender, connection, **kwargs):
+    if _count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_queries)
+
+
+class MetricsMiddleware:
+    """Record latency, SQL and response size of each request against its URL pattern.
+
+    Put it first in ``MIDDLEWARE`` so the latency covers the whole stack. It
+    runs natively under both WSGI and ASGI, so async views stay on the event loop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Only while metrics are on: the wrapper is a function call on every query.
+        # Connections opened later get it from connection_created
+        connection_created.connect(_install_wrapper)
+        for connection in connections.all(initialized_only=True):
+            _install_wrapper(None, connection)
+
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        sql = [0, 0.0]
+        token = _current_sql.set(sql)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_sql.reset(token)
+        self.record(request, response, time.perf_counter() - start, sql)
+        return response
+
+    async def __acall__(self, request):
+        sql = [0, 0.0]
+        token = _current_sql.set(sql)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_sql.reset(token)
+        self.record(request, response, time.perf_counter() - start, sql)
+        return response
+
+    def record(self, request, response, seconds, sql):
+        match = getattr(request, 'resolver_match', None)
+        route = '/' + match.route if match is not None else UNMATCHED_ROUTE
+        size = 0 if response.streaming else len(response.content)
+        registry.record(route, request.method, response.status_code, seconds, sql[0], sql[1], size)
+
+
+def metrics_view(request):
+    # REMOTE_ADDR, not X-Forwarded-For: a forwarded address is up to the client
+    allowed = request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+    user = getattr(request, 'user', None)
+    if not allowed and not (user is not None and user.is_active and user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,82 @@
+"""
+Django's stock middleware, without a thread hop per hook under ASGI.
+
+For an async request, ``MiddlewareMixin`` runs every ``process_request`` and
+``process_response`` through ``sync_to_async``: with the default stack that
+is a dozen trips to a worker thread per request, which cost the async views
+more than the views themselves. These subclasses run the hooks that only do
+in-memory work directly on the event loop, and keep the trip for the cases
+that can reach the database (saving a modified session, storing messages,
+CSRF tokens kept in the session). WSGI requests are unaffected.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import middleware as auth
+from django.contrib.messages import middleware as messages
+from django.contrib.sessions import middleware as sessions
+from django.middleware import clickjacking, common, csrf, security
+
+
+class InlineHooksMixin:
+
+    def request_needs_thread(self, request):
+        return False
+
+    def response_needs_thread(self, request, response):
+        return False
+
+    async def __acall__(self, request):
+        response = None
+        if hasattr(self, 'process_request'):
+            if self.request_needs_thread(request):
+                response = await sync_to_async(self.process_request, thread_sensitive=True)(request)
+            else:
+                response = self.process_request(request)
+
+        response = response or await self.get_response(request)
+
+        if hasattr(self, 'process_response'):
+            if self.response_needs_thread(request, response):
+                response = await sync_to_async(self.process_response, thread_sensitive=True)(request, response)
+            else:
+                response = self.process_response(request, response)
+        return response
+
+
+class SecurityMiddleware(InlineHooksMixin, security.SecurityMiddleware):
+    pass
+
+
+class SessionMiddleware(InlineHooksMixin, sessions.SessionMiddleware):
+
+    def response_needs_thread(self, request, response):
+        session = getattr(request, 'session', None)
+        return session is not None and (session.modified or settings.SESSION_SAVE_EVERY_REQUEST)
+
+
+class CommonMiddleware(InlineHooksMixin, common.CommonMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(InlineHooksMixin, csrf.CsrfViewMiddleware):
+
+    def request_needs_thread(self, request):
+        return settings.CSRF_USE_SESSIONS
+
+    def response_needs_thread(self, request, response):
+        return settings.CSRF_USE_SESSIONS
+
+
+class AuthenticationMiddleware(InlineHooksMixin, auth.AuthenticationMiddleware):
+    pass
+
+
+class MessageMiddleware(InlineHooksMixin, messages.MessageMiddleware):
+
+    def response_needs_thread(self, request, response):
+        storage = getattr(request, '_messages', None)
+        return storage is not None and (storage.used or storage.added_new)
+
+
+class XFrameOptionsMiddleware(InlineHooksMixin, clickjacking.XFrameOptionsMiddleware):
+    pass
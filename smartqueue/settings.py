@@ -10,6 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import hashlib
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,16 +44,18 @@ INSTALLED_APPS = [
     'users',
     'queues',
     'swaps',
+    'notifications',
 ]
 
+# The stock middleware, minus a thread hop per hook for async views (see smartqueue/middleware.py)
 MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'smartqueue.middleware.SecurityMiddleware',
+    'smartqueue.middleware.SessionMiddleware',
+    'smartqueue.middleware.CommonMiddleware',
+    'smartqueue.middleware.CsrfViewMiddleware',
+    'smartqueue.middleware.AuthenticationMiddleware',
+    'smartqueue.middleware.MessageMiddleware',
+    'smartqueue.middleware.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'smartqueue.urls'
@@ -80,6 +85,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file (not the in-memory default) so concurrency tests get real
+        # SQLite locking across threads
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -122,8 +132,14 @@ STATIC_URL = 'static/'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
+    # Token buckets of smartqueue.throttling (burst up to the rate, then keep to it)
+    'DEFAULT_THROTTLE_RATES': {
+        'queue_status': '60/min',
+        'my_queues': '30/min',
+        'full_queue': '120/min',
+    },
 }
 
 from datetime import timedelta
@@ -131,4 +147,64 @@ from datetime import timedelta
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(hours=5),  # increase to 1 hour
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
+    "TOKEN_OBTAIN_SERIALIZER": "users.serializers.ClaimsTokenObtainPairSerializer",
 }
+
+# Verified tokens / users kept per process by users.authentication
+AUTH_CACHE_MAX_ENTRIES = 10000
+AUTH_CACHE_TTL = 60  # seconds
+# Cached users and token claims are checked against the users' is_active,
+# is_staff and password, re-read from the database this often (seconds)
+AUTH_SYNC_SECONDS = 1.0
+
+# Minutes assumed per consultation until a doctor has completed tokens today
+QUEUE_DEFAULT_CONSULTATION_MINUTES = 10
+
+# How often (seconds) each process checks its in-memory queues against the
+# TokenSequence versions, to pick up changes made by other workers
+QUEUE_ENGINE_SYNC_SECONDS = 1.0
+
+# How often (seconds) each process checks the doctor directory's version in
+# the database, to pick up doctors changed by other workers
+DOCTOR_DIRECTORY_SYNC_SECONDS = 1.0
+
+# Head start in the call order per priority class (Token.PRIORITY_CHOICES), in
+# minutes: an urgent patient goes before anyone who joined less than 30 minutes
+# earlier, but not before those who have waited longer
+QUEUE_PRIORITY_HEAD_START_MINUTES = {1: 30, 2: 240}
+
+# Per-endpoint latency / SQL metrics, served in Prometheus format at /metrics
+# to staff users and to scrapers from METRICS_ALLOWED_IPS (route names and
+# traffic are not for the public)
+METRICS_ENABLED = False
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+
+if METRICS_ENABLED:
+    MIDDLEWARE.insert(0, 'smartqueue.metrics.MetricsMiddleware')
+
+# Throttle buckets, in a file shared by every worker of this checkout on the
+# host (named after BASE_DIR, so other checkouts keep their own). The test
+# runner gives the suite a temporary file
+THROTTLE_BUCKET_FILE = os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+    'smartqueue-throttle-' + hashlib.blake2b(str(BASE_DIR).encode(), digest_size=6).hexdigest(),
+)
+THROTTLE_BUCKET_SLOTS = 65536
+
+TEST_RUNNER = 'smartqueue.testing.TestRunner'
+
+# "Your turn is near" notices go out at these numbers of people ahead (0: next)
+NOTIFY_PEOPLE_AHEAD = (5, 2, 0)
+
+# Delivery of the notification outbox by dispatch_notifications: the sink
+# (notifications.sinks.FileSink writes NOTIFICATION_FILE), and retries with
+# backoff doubling from NOTIFICATION_RETRY_SECONDS
+NOTIFICATION_SINK = 'notifications.sinks.LogSink'
+NOTIFICATION_FILE = BASE_DIR / 'notifications.jsonl'
+NOTIFICATION_MAX_ATTEMPTS = 5
+NOTIFICATION_RETRY_SECONDS = 30
+
+# Password hashing for signup/login runs in this many processes (0: threads),
+# with at most PASSWORD_HASHING_MAX_PENDING jobs before answering 503
+PASSWORD_HASHING_WORKERS = 2
+PASSWORD_HASHING_MAX_PENDING = 64
@@ -0,0 +1,29 @@
+"""
+Test runner that keeps the suite off state shared with the running site.
+
+The throttle buckets live in a file every worker on the host maps
+(``THROTTLE_BUCKET_FILE``); tests count against a temporary one instead.
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+from smartqueue import throttling
+
+
+class TestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._bucket_directory = tempfile.TemporaryDirectory()
+        self._bucket_file = settings.THROTTLE_BUCKET_FILE
+        settings.THROTTLE_BUCKET_FILE = os.path.join(self._bucket_directory.name, 'throttle')
+        throttling._store = None
+
+    def teardown_test_environment(self, **kwargs):
+        throttling._store = None
+        settings.THROTTLE_BUCKET_FILE = self._bucket_file
+        self._bucket_directory.cleanup()
+        super().teardown_test_environment(**kwargs)
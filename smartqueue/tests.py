@@ -0,0 +1,234 @@
+import multiprocessing
+import os
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from queues.models import Doctor
+from users.serializers import ClaimsTokenObtainPairSerializer
+from .metrics import _count_queries, _install_wrapper, metrics_view, registry
+from . import settings as project_settings
+from .throttling import WAYS, BucketStore, bucket_store
+
+STOCK_MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+INLINE_MIDDLEWARE = [path.replace(path.rsplit('.', 1)[0], 'smartqueue.middleware') for path in STOCK_MIDDLEWARE]
+
+# Headers the stack is responsible for
+CHECKED_HEADERS = (
+    'X-Frame-Options', 'X-Content-Type-Options', 'Referrer-Policy',
+    'Cross-Origin-Opener-Policy', 'Location', 'Vary',
+)
+
+
+class InlineMiddlewareTests(TestCase):
+    """smartqueue.middleware answers ASGI requests exactly as the stock classes do."""
+
+    def setUp(self):
+        User.objects.create_superuser('admin', password='secret-pass-1')
+
+    async def scenario(self):
+        """Admin login through CSRF and the session; what the client sees at each step."""
+        client = AsyncClient(enforce_csrf_checks=True)
+        seen = []
+
+        async def step(response):
+            seen.append((
+                response.status_code,
+                {name: response.headers.get(name) for name in CHECKED_HEADERS},
+                sorted(response.cookies),
+            ))
+            return response
+
+        await step(await client.get('/admin/login/'))
+        # No CSRF token: rejected
+        await step(await client.post('/admin/login/', {'username': 'admin', 'password': 'secret-pass-1'}))
+        csrf_token = client.cookies['csrftoken'].value
+        # Logging in saves the session and rotates the CSRF token
+        await step(await client.post('/admin/login/', {
+            'username': 'admin', 'password': 'secret-pass-1', 'csrfmiddlewaretoken': csrf_token,
+        }))
+        await step(await client.get('/admin/'))
+        # Slash appended by CommonMiddleware
+        await step(await client.get('/admin'))
+        return seen
+
+    async def run_with(self, middleware):
+        with override_settings(MIDDLEWARE=middleware):
+            return await self.scenario()
+
+    async def test_same_as_stock(self):
+        stock = await self.run_with(STOCK_MIDDLEWARE)
+        inline = await self.run_with(INLINE_MIDDLEWARE)
+
+        self.assertEqual([status for status, _, _ in stock], [200, 403, 302, 200, 301])
+        self.assertEqual(stock[0][1]['X-Frame-Options'], 'DENY')
+        self.assertIn('sessionid', stock[2][2])
+        self.assertEqual(inline, stock)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        registry.reset()
+
+    def uninstall(self):
+        connection_created.disconnect(_install_wrapper)
+        for connection in connections.all(initialized_only=True):
+            if _count_queries in connection.execute_wrappers:
+                connection.execute_wrappers.remove(_count_queries)
+
+    def test_off_by_default(self):
+        new_connection = connections.create_connection('default')
+        new_connection.ensure_connection()
+        self.addCleanup(new_connection.close)
+
+        self.assertFalse(settings.METRICS_ENABLED)
+        self.assertNotIn(_count_queries, new_connection.execute_wrappers)
+        self.assertEqual(Client().get('/metrics').status_code, 404)
+
+    def scrape(self, remote_addr, user):
+        request = RequestFactory().get('/metrics', REMOTE_ADDR=remote_addr)
+        request.user = user
+        return metrics_view(request)
+
+    @override_settings(METRICS_ALLOWED_IPS=('10.0.0.9',))
+    def test_access(self):
+        staff = User.objects.create_user('staff', is_staff=True)
+        patient = User.objects.create_user('patient')
+
+        self.assertEqual(self.scrape('10.0.0.9', AnonymousUser()).status_code, 200)
+        self.assertEqual(self.scrape('10.0.0.9', patient).status_code, 200)
+        self.assertEqual(self.scrape('203.0.113.7', AnonymousUser()).status_code, 403)
+        self.assertEqual(self.scrape('203.0.113.7', patient).status_code, 403)
+        self.assertEqual(self.scrape('203.0.113.7', staff).status_code, 200)
+
+    @override_settings(MIDDLEWARE=['smartqueue.metrics.MetricsMiddleware'] + STOCK_MIDDLEWARE)
+    def test_recorded_by_route(self):
+        self.addCleanup(self.uninstall)
+        Client().get('/api/users/me/')
+        Client().get('/no/such/page/')
+
+        text = self.scrape('127.0.0.1', AnonymousUser()).content.decode()
+        self.assertIn(
+            'smartqueue_http_responses_total{route="/api/users/me/",method="GET",status="401"} 1', text,
+        )
+        self.assertIn('smartqueue_http_request_duration_seconds_count{route="<unmatched>",method="GET"} 1', text)
+        self.assertIn(_count_queries, connections['default'].execute_wrappers)
+
+
+def _draw(path, attempts, results):
+    store = BucketStore(path, 64)
+    results.put(sum(store.take('shared', 25, 60) == 0 for _ in range(attempts)))
+
+
+class BucketStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'buckets')
+
+    def test_burst_then_refill(self):
+        store = BucketStore(self.path, 64)
+        self.assertEqual([store.take('key', 3, 60, now=100) for _ in range(3)], [0, 0, 0])
+        self.assertEqual(store.take('key', 3, 60, now=100), 20)  # one token every 20s
+        self.assertEqual(store.take('other', 3, 60, now=100), 0)
+        self.assertEqual(store.take('key', 3, 60, now=120), 0)
+        self.assertGreater(store.take('key', 3, 60, now=120), 0)
+
+    def test_shared_between_instances(self):
+        # As two workers mapping the same file
+        first, second = BucketStore(self.path, 64), BucketStore(self.path, 64)
+        self.assertEqual(first.take('key', 1, 60, now=100), 0)
+        self.assertGreater(second.take('key', 1, 60, now=100), 0)
+
+    def test_longest_idle_evicted_from_a_full_set(self):
+        store = BucketStore(self.path, WAYS)  # a single set
+        for i in range(WAYS):
+            store.take(f'key-{i}', 1, 60, now=100 + i)
+        store.take('newcomer', 1, 60, now=200)
+        # key-0 lost its slot and starts over with a full bucket; the others kept theirs
+        self.assertEqual(store.take('key-0', 1, 60, now=101), 0)
+        self.assertGreater(store.take(f'key-{WAYS - 1}', 1, 60, now=108), 0)
+
+    def test_processes_share_one_bucket(self):
+        # Forked: the workers touch the bucket file only, never the database
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        workers = [context.Process(target=_draw, args=(self.path, 20, results)) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        taken = sum(results.get(timeout=60) for _ in workers)
+        for worker in workers:
+            worker.join()
+        self.assertEqual(taken, 25)
+
+
+    def test_suite_has_its_own_file(self):
+        self.assertNotEqual(settings.THROTTLE_BUCKET_FILE, project_settings.THROTTLE_BUCKET_FILE)
+        self.assertTrue(settings.THROTTLE_BUCKET_FILE.startswith(tempfile.gettempdir()))
+        self.assertEqual(bucket_store().path, settings.THROTTLE_BUCKET_FILE)
+
+class ThrottleTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch('smartqueue.throttling._store', BucketStore(os.path.join(directory.name, 'buckets'), 64))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.doctor = Doctor.objects.create(name="Throttle", department="ENT")
+        self.users = [User.objects.create_user(f'throttled-{i}') for i in range(2)]
+
+    def get(self, path, user):
+        token = ClaimsTokenObtainPairSerializer.get_token(user).access_token
+        return Client().get(path, {'doctor_id': self.doctor.id}, HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def rates(self, **rates):
+        return override_settings(REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK,
+            'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], **rates},
+        })
+
+    def test_async_view(self):
+        with self.rates(queue_status='2/min'):
+            statuses = [self.get('/api/queues/status/', self.users[0]).status_code for _ in range(2)]
+            throttled = self.get('/api/queues/status/', self.users[0])
+            other_user = self.get('/api/queues/status/', self.users[1])
+
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(throttled.status_code, 429)
+        self.assertEqual(throttled.headers['Retry-After'], '30')
+        self.assertIn("Expected available in 30 seconds", throttled.json()['detail'])
+        self.assertEqual(other_user.status_code, 200)
+
+    def test_drf_view_answers_alike(self):
+        with self.rates(my_queues='1/min', queue_status='1/min'):
+            self.get('/api/queues/my-queues/', self.users[0])
+            self.get('/api/queues/status/', self.users[0])
+            drf = self.get('/api/queues/my-queues/', self.users[0])
+            plain = self.get('/api/queues/status/', self.users[0])
+
+        self.assertEqual((drf.status_code, plain.status_code), (429, 429))
+        self.assertEqual(drf.headers['Retry-After'], plain.headers['Retry-After'])
+        self.assertEqual(drf.json(), plain.json())
+
+    def test_rate_of_none_turns_it_off(self):
+        with self.rates(queue_status=None):
+            statuses = {self.get('/api/queues/status/', self.users[0]).status_code for _ in range(5)}
+        self.assertEqual(statuses, {200})
@@ -0,0 +1,165 @@
+"""
+Token-bucket throttling shared by every worker on the host.
+
+Clients that lose their connection tend to come back polling in a tight
+loop. ``SharedBucketThrottle`` gives each (endpoint, user) pair a token
+bucket: ``THROTTLE_RATES`` style ``"120/min"`` rates are both the bucket
+size and its refill rate, so a client may burst up to the rate and then
+keep to it on average.
+
+The buckets live in a memory-mapped file (``THROTTLE_BUCKET_FILE``, in
+``/dev/shm`` where there is one) so that all workers of a deployment
+count against the same buckets. The file is a fixed table of
+``THROTTLE_BUCKET_SLOTS`` slots, grouped in sets of ``WAYS``: a key hashes
+to one set, and a check reads and writes that set only, under a byte-range
+lock on it. When a set is full, the bucket left idle the longest makes
+room; a bucket idle for a whole period has refilled anyway, so under
+normal load nothing is lost, and the file never grows.
+
+Without ``fcntl`` (Windows) the lock only holds within a process.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Slot: key hash (0 when free), tokens left, time of the last update
+SLOT = struct.Struct('=Qdd')
+WAYS = 8
+SET = struct.Struct('=' + 'Qdd' * WAYS)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """``"120/min"`` -> (120, 60): requests per period in seconds."""
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+class BucketStore:
+    """Fixed-size table of token buckets in a file mapped by every process."""
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.sets = max(slots // WAYS, 1)
+        self._file = None
+        self._map = None
+        self._open_lock = threading.Lock()
+        # Byte-range locks belong to the process, so threads need their own
+        self._locks = [threading.Lock() for _ in range(64)]
+
+    def _open(self):
+        with self._open_lock:
+            if self._map is None:
+                size = self.sets * SET.size
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                self._map = mmap.mmap(fd, size)
+                self._file = fd
+        return self._map
+
+    def take(self, key, capacity, period, now=None):
+        """Take a token from the bucket of ``key``.
+
+        Returns 0 when one was taken, otherwise the seconds until the bucket
+        holds one again.
+        """
+        buckets = self._map or self._open()
+        now = time.time() if now is None else now
+        rate = capacity / period
+
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+        index = digest % self.sets
+        digest = digest or 1
+        offset = index * SET.size
+
+        with self._locks[index % len(self._locks)]:
+            if fcntl is not None:
+                fcntl.lockf(self._file, fcntl.LOCK_EX, SET.size, offset)
+            try:
+                row = SET.unpack_from(buckets, offset)
+                keys = row[0::3]
+                if digest in keys:
+                    way = keys.index(digest)
+                    tokens, updated = row[way * 3 + 1], row[way * 3 + 2]
+                    tokens = min(capacity, tokens + max(now - updated, 0) * rate)
+                else:
+                    # A free slot, else the one idle the longest
+                    way = min(range(WAYS), key=lambda w: (keys[w] != 0, row[w * 3 + 2]))
+                    tokens = capacity
+
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0
+                else:
+                    wait = (1 - tokens) / rate
+                SLOT.pack_into(buckets, offset + way * SLOT.size, digest, tokens, now)
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(self._file, fcntl.LOCK_UN, SET.size, offset)
+        return wait
+
+
+_store = None
+
+
+def bucket_store():
+    global _store
+    if _store is None:
+        _store = BucketStore(settings.THROTTLE_BUCKET_FILE, settings.THROTTLE_BUCKET_SLOTS)
+    return _store
+
+
+class SharedBucketThrottle(BaseThrottle):
+    """Per-user (or per-IP when anonymous) token bucket for one endpoint.
+
+    The rate comes from ``DEFAULT_THROTTLE_RATES[scope]``; a rate of None
+    turns the throttle off.
+    """
+
+    scope = None
+    wait_seconds = None
+
+    def allow_request(self, request, view):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if rate is None:
+            return True
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            ident = f"user:{user.pk}"
+        else:
+            ident = f"ip:{self.get_ident(request)}"
+
+        capacity, period = parse_rate(rate)
+        self.wait_seconds = bucket_store().take(f"{self.scope}:{ident}", capacity, period)
+        return self.wait_seconds == 0
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class QueueStatusThrottle(SharedBucketThrottle):
+    scope = 'queue_status'
+
+
+class MyQueuesThrottle(SharedBucketThrottle):
+    scope = 'my_queues'
+
+
+class FullQueueThrottle(SharedBucketThrottle):
+    scope = 'full_queue'
@@ -14,6 +14,7 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 from django.urls import path, include
@@ -25,4 +26,7 @@ urlpatterns = [
     path('api/swaps/', include('swaps.urls')),
 ]
 
+if settings.METRICS_ENABLED:
+    from smartqueue.metrics import metrics_view
 
+    urlpatterns.append(path('metrics', metrics_view))
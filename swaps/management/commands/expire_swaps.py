@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from swaps.models import SwapRequest
+
+
+class Command(BaseCommand):
+    help = (
+        "Mark PENDING swap requests past their expiry as EXPIRED. Requests read as "
+        "expired as soon as expires_at passes; this only cleans up the stored status."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--interval', type=float,
+            help="Keep running and sweep every INTERVAL seconds",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            expired = SwapRequest.objects.expire_stale(options['batch_size'])
+            if expired or options['verbosity'] > 1:
+                self.stdout.write(f"Expired {expired} swap request(s)")
+
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 06:59
+
+import swaps.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swaps', '0002_swaprequest_expires_at_alter_swaprequest_from_token_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='swaprequest',
+            name='expires_at',
+            field=models.DateTimeField(default=swaps.models.default_expiry),
+        ),
+        migrations.AddIndex(
+            model_name='swaprequest',
+            index=models.Index(fields=['status', 'expires_at'], name='swap_status_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0.2 on 2026-10-18 07:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swaps', '0003_alter_swaprequest_expires_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedSwapRequest',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('from_token_id', models.BigIntegerField(db_index=True)),
+                ('to_token_id', models.BigIntegerField(db_index=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('ACCEPTED', 'Accepted'), ('REJECTED', 'Rejected'), ('EXPIRED', 'Expired')], max_length=10)),
+                ('created_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -4,6 +4,33 @@ from datetime import timedelta
 from queues.models import Token
 
 
+SWAP_LIFETIME = timedelta(minutes=2)
+
+
+def default_expiry():
+    return timezone.now() + SWAP_LIFETIME
+
+
+class SwapRequestQuerySet(models.QuerySet):
+
+    def pending(self):
+        """Requests that can still be accepted (expiry is applied at read time)."""
+        return self.filter(status='PENDING', expires_at__gte=timezone.now())
+
+    def stale(self):
+        """PENDING rows past their expiry that the sweeper hasn't marked yet."""
+        return self.filter(status='PENDING', expires_at__lt=timezone.now())
+
+    def expire_stale(self, batch_size=1000):
+        """Mark stale rows EXPIRED in batches; returns how many were updated."""
+        expired = 0
+        while True:
+            ids = list(self.stale().values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return expired
+            expired += self.filter(id__in=ids, status='PENDING').update(status='EXPIRED')
+
+
 class SwapRequest(models.Model):
 
     STATUS_CHOICES = [
@@ -34,8 +61,41 @@ class SwapRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     expires_at = models.DateTimeField(
-        default=timezone.now() + timedelta(minutes=2)
+        default=default_expiry
     )
 
+    objects = SwapRequestQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='swap_status_expiry_idx'),
+        ]
+
+    @property
+    def effective_status(self):
+        if self.status == 'PENDING' and self.expires_at < timezone.now():
+            return 'EXPIRED'
+        return self.status
+
+    def __str__(self):
+        return f"{self.from_token.token_number} → {self.to_token.token_number} ({self.effective_status})"
+
+
+class ArchivedSwapRequest(models.Model):
+    """A swap request of a closed day, moved out with its tokens by ``archive_tokens``.
+
+    The token ids refer to ``ArchivedToken`` (or, for a token left open on
+    that day, still to ``Token``); they are plain columns so each archived
+    chunk stands on its own.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    from_token_id = models.BigIntegerField(db_index=True)
+    to_token_id = models.BigIntegerField(db_index=True)
+    status = models.CharField(max_length=10, choices=SwapRequest.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    expires_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
     def __str__(self):
-        return f"{self.from_token.token_number} → {self.to_token.token_number} ({self.status})"
+        return f"Swap {self.from_token_id} → {self.to_token_id} ({self.status}, archived)"
@@ -0,0 +1,141 @@
+"""
+Executing swap requests.
+
+A swap, or a chain of swaps that forms a cycle (A→B→C→A), is applied in one
+transaction: the tokens are locked, renumbered with bulk updates and the
+requests marked ACCEPTED together. Each requester takes the number, and the
+place in the call order (``ranked_at``), of the token they asked for.
+"""
+from django.db import transaction
+
+from queues import journal
+from queues.engine import queue_engine
+from queues.models import Token
+from queues.sequences import next_queue_version
+from .models import SwapRequest
+
+
+class SwapError(Exception):
+    pass
+
+
+def _renumber(tokens, new_places, version):
+    # Token numbers are unique per doctor and day, so park everything on a
+    # negative number first; otherwise the exchange collides mid-update
+    for token in tokens:
+        token.token_number = -token.token_number
+    Token.objects.bulk_update(tokens, ['token_number'])
+
+    for token in tokens:
+        token.token_number, token.ranked_at = new_places[token.id]
+        token.version = version
+    Token.objects.bulk_update(tokens, ['token_number', 'ranked_at', 'version'])
+
+
+def execute_swaps(swaps, tokens=None):
+    """Apply ``swaps`` together; they must be PENDING and close a cycle over their tokens.
+
+    A single accepted request is the two-token cycle A→B plus the implied B→A.
+    Pass ``tokens`` if they are already locked. Must run inside
+    ``transaction.atomic()``.
+    """
+    token_ids = {swap.from_token_id for swap in swaps} | {swap.to_token_id for swap in swaps}
+    if tokens is None:
+        tokens = list(Token.objects.select_for_update().filter(id__in=token_ids).order_by('id'))
+    by_id = {token.id: token for token in tokens}
+
+    if len(tokens) != len(token_ids):
+        raise SwapError("One of the tokens is no longer eligible")
+    if any(token.status != 'WAITING' for token in tokens):
+        raise SwapError("One of the tokens is no longer eligible")
+    if len({(token.doctor_id, token.date) for token in tokens}) != 1:
+        raise SwapError("Doctor mismatch")
+
+    def place(token_id):
+        return by_id[token_id].token_number, by_id[token_id].ranked_at
+
+    new_places = {swap.from_token_id: place(swap.to_token_id) for swap in swaps}
+    if len(swaps) == 1:
+        swap = swaps[0]
+        new_places[swap.to_token_id] = place(swap.from_token_id)
+
+    if set(new_places) != token_ids:
+        raise SwapError("Swap requests do not form a closed chain")
+
+    version = next_queue_version(tokens[0].doctor_id, tokens[0].date)
+    _renumber(tokens, new_places, version)
+
+    SwapRequest.objects.filter(id__in=[swap.id for swap in swaps]).update(status='ACCEPTED')
+    for swap in swaps:
+        swap.status = 'ACCEPTED'
+    journal.record('SWAPPED', *tokens)
+    queue_engine.apply(*tokens, event='swapped')
+    return tokens
+
+
+def find_cycles(swaps):
+    """Cycles among ``swaps``, following each from_token to the token it asks for.
+
+    A patient has at most one pending request, so every token has at most one
+    outgoing edge and each cycle is found by walking forward once: O(n).
+    """
+    by_from = {swap.from_token_id: swap for swap in swaps}
+    visited = set()
+    cycles = []
+
+    for start in by_from:
+        path = []
+        position = {}
+        token_id = start
+        while token_id in by_from and token_id not in visited and token_id not in position:
+            position[token_id] = len(path)
+            path.append(by_from[token_id])
+            token_id = by_from[token_id].to_token_id
+
+        if token_id in position:
+            cycles.append(path[position[token_id]:])
+        visited.update(position)
+
+    return cycles
+
+
+def resolve_cycles(doctor_id):
+    """Execute every cycle of pending requests in a doctor's queue in one transaction.
+
+    Everyone in a cycle asked for the next person's number, so no further
+    acceptance is needed. Returns the executed cycles.
+    """
+    with transaction.atomic():
+        pending = list(
+            SwapRequest.objects.pending()
+            .select_for_update()
+            .filter(from_token__doctor_id=doctor_id, from_token__status='WAITING')
+        )
+        resolved = []
+        for cycle in find_cycles(pending):
+            try:
+                with transaction.atomic():
+                    execute_swaps(cycle)
+            except SwapError:
+                continue
+            resolved.append(cycle)
+        return resolved
+
+
+def resolve_cycle_through(swap):
+    """Execute the cycle closed by the new request ``swap``, if there is one."""
+    with transaction.atomic():
+        pending = list(
+            SwapRequest.objects.pending()
+            .select_for_update()
+            .filter(from_token__doctor_id=swap.from_token.doctor_id, from_token__status='WAITING')
+        )
+        for cycle in find_cycles(pending):
+            if any(request.id == swap.id for request in cycle):
+                try:
+                    with transaction.atomic():
+                        execute_swaps(cycle)
+                except SwapError:
+                    return None
+                return cycle
+        return None
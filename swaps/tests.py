@@ -1,3 +1,193 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from queues.engine import queue_engine
+from queues.models import Doctor, Token
+from .models import SwapRequest
+from .services import find_cycles, resolve_cycles
+
+
+class Edge:
+    """Stand-in for a SwapRequest in find_cycles."""
+
+    def __init__(self, from_token_id, to_token_id):
+        self.from_token_id = from_token_id
+        self.to_token_id = to_token_id
+
+
+class FindCyclesTests(SimpleTestCase):
+
+    def test_two_party(self):
+        a, b = Edge(1, 2), Edge(2, 1)
+        self.assertEqual(find_cycles([a, b]), [[a, b]])
+
+    def test_three_cycle_with_a_tail(self):
+        tail, a, b, c = Edge(9, 1), Edge(1, 2), Edge(2, 3), Edge(3, 1)
+        cycles = find_cycles([tail, a, b, c])
+        self.assertEqual(len(cycles), 1)
+        self.assertEqual({id(edge) for edge in cycles[0]}, {id(a), id(b), id(c)})
+
+    def test_open_chain(self):
+        self.assertEqual(find_cycles([Edge(1, 2), Edge(2, 3)]), [])
+
+
+class SwapTests(TestCase):
+
+    def setUp(self):
+        queue_engine.reset()
+        self.doctor = Doctor.objects.create(name="Swap", department="ENT")
+        self.today = timezone.now().date()
+        self.patients = [User.objects.create(username=f"swap-{i}") for i in range(4)]
+        self.tokens = [
+            Token.objects.create(doctor=self.doctor, patient=patient, token_number=number, date=self.today)
+            for number, patient in enumerate(self.patients, start=1)
+        ]
+
+    def ask(self, from_token, to_token, **fields):
+        return SwapRequest.objects.create(from_token=from_token, to_token=to_token, **fields)
+
+    def numbers(self):
+        return [token.token_number for token in Token.objects.filter(id__in=[t.id for t in self.tokens]).order_by('id')]
+
+    def test_resolve_two_party(self):
+        self.ask(self.tokens[0], self.tokens[1])
+        self.ask(self.tokens[1], self.tokens[0])
+
+        self.assertEqual(len(resolve_cycles(self.doctor.id)), 1)
+        self.assertEqual(self.numbers(), [2, 1, 3, 4])
+
+    def test_resolve_three_cycle(self):
+        t1, t2, t3, _ = self.tokens
+        swaps = [self.ask(t1, t2), self.ask(t2, t3), self.ask(t3, t1)]
+
+        self.assertEqual(len(resolve_cycles(self.doctor.id)), 1)
+        self.assertEqual(self.numbers(), [2, 3, 1, 4])
+        self.assertEqual(
+            set(SwapRequest.objects.filter(id__in=[s.id for s in swaps]).values_list('status', flat=True)),
+            {'ACCEPTED'},
+        )
+
+    def test_expired_request_breaks_the_cycle(self):
+        t1, t2, t3, _ = self.tokens
+        self.ask(t1, t2)
+        self.ask(t2, t3, expires_at=timezone.now() - timedelta(seconds=1))
+        self.ask(t3, t1)
+
+        self.assertEqual(resolve_cycles(self.doctor.id), [])
+        self.assertEqual(self.numbers(), [1, 2, 3, 4])
+
+    def test_token_no_longer_waiting_breaks_the_cycle(self):
+        t1, t2, t3, _ = self.tokens
+        self.ask(t1, t2)
+        self.ask(t2, t3)
+        self.ask(t3, t1)
+        Token.objects.filter(id=t3.id).update(status='CANCELLED')
+
+        self.assertEqual(resolve_cycles(self.doctor.id), [])
+        self.assertEqual(self.numbers(), [1, 2, 3, 4])
+
+    def test_request_ignores_tokens_of_earlier_days(self):
+        patient = self.patients[3]
+        Token.objects.create(
+            doctor=self.doctor, patient=patient, token_number=1,
+            date=self.today - timedelta(days=1),
+        )
+        client = APIClient()
+        client.force_authenticate(patient)
+
+        response = client.post('/api/swaps/request/', {'doctor_id': self.doctor.id, 'target_token': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(SwapRequest.objects.get(id=response.data['swap_id']).from_token, self.tokens[3])
+
+    def test_nearby_ignores_tokens_of_earlier_days(self):
+        patient = self.patients[3]
+        Token.objects.create(
+            doctor=self.doctor, patient=patient, token_number=1,
+            date=self.today - timedelta(days=1),
+        )
+        client = APIClient()
+        token = AccessToken.for_user(patient)
+
+        response = client.get(
+            '/api/swaps/nearby/', {'doctor_id': self.doctor.id}, HTTP_AUTHORIZATION=f'Bearer {token}',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['token_number'] for row in response.json()], [1, 2, 3])
+
+
+class ExpiryTests(TestCase):
+    """Requests read as expired at once; the sweeper only updates the stored status."""
+
+    def setUp(self):
+        queue_engine.reset()
+        self.doctor = Doctor.objects.create(name="Expiry", department="ENT")
+        self.today = timezone.now().date()
+        self.patients = [User.objects.create(username=f"expiry-{i}") for i in range(2)]
+        self.tokens = [
+            Token.objects.create(doctor=self.doctor, patient=patient, token_number=number, date=self.today)
+            for number, patient in enumerate(self.patients, start=1)
+        ]
+        self.past = timezone.now() - timedelta(seconds=1)
+
+    def ask(self, **fields):
+        return SwapRequest.objects.create(from_token=self.tokens[0], to_token=self.tokens[1], **fields)
+
+    def statuses(self, swaps):
+        return [SwapRequest.objects.get(id=swap.id).status for swap in swaps]
+
+    def test_expire_stale_sweeps_in_batches(self):
+        stale = [self.ask(expires_at=self.past) for _ in range(5)]
+        fresh = self.ask()
+        accepted = self.ask(status='ACCEPTED', expires_at=self.past)
+
+        # Three batches of ids and updates, then the empty read that ends the sweep
+        with self.assertNumQueries(7):
+            self.assertEqual(SwapRequest.objects.expire_stale(batch_size=2), 5)
+
+        self.assertEqual(self.statuses(stale), ['EXPIRED'] * 5)
+        self.assertEqual(self.statuses([fresh, accepted]), ['PENDING', 'ACCEPTED'])
+        self.assertEqual(SwapRequest.objects.expire_stale(), 0)
+
+    def test_expire_swaps_command(self):
+        stale = [self.ask(expires_at=self.past) for _ in range(2)]
+        fresh = self.ask()
+        out = StringIO()
+
+        call_command('expire_swaps', '--batch-size', '1', stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), "Expired 2 swap request(s)")
+        self.assertEqual(self.statuses(stale + [fresh]), ['EXPIRED', 'EXPIRED', 'PENDING'])
+
+    def test_expired_pending_request_cannot_be_accepted(self):
+        swap = self.ask(expires_at=self.past)
+        client = APIClient()
+        client.force_authenticate(self.patients[1])
+
+        response = client.post('/api/swaps/accept/', {'swap_id': swap.id})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"error": "Swap expired"})
+        self.assertEqual(self.statuses([swap]), ['PENDING'])
+        self.assertEqual(
+            list(Token.objects.filter(id__in=[t.id for t in self.tokens]).order_by('id').values_list('token_number', flat=True)),
+            [1, 2],
+        )
+
+    def test_my_swaps_reports_expiry_before_the_sweep(self):
+        stale = self.ask(expires_at=self.past)
+        fresh = self.ask()
+
+        response = APIClient().get(
+            '/api/swaps/mine/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.patients[0])}',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        statuses = {row['swap_id']: row['status'] for row in response.json()}
+        self.assertEqual(statuses, {stale.id: 'EXPIRED', fresh.id: 'PENDING'})
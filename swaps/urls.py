@@ -1,8 +1,11 @@
 from django.urls import path
-from .views import request_swap, accept_swap, reject_swap
+from .views import request_swap, accept_swap, reject_swap, my_swaps, nearby_tokens, resolve_swap_chains
 
 urlpatterns = [
     path('request/', request_swap),
     path('accept/', accept_swap),
     path('reject/', reject_swap),
+    path('mine/', my_swaps),
+    path('nearby/', nearby_tokens),
+    path('resolve-chains/', resolve_swap_chains),
 ]
@@ -1,20 +1,15 @@
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
-from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q
-from datetime import timedelta
+from django.http import JsonResponse
+from django.utils import timezone
 
-from queues.models import Token
+from queues.models import Doctor, Token
 from .models import SwapRequest
-
-
-# 🔥 Expire old swaps automatically
-def expire_old_swaps():
-    SwapRequest.objects.filter(
-        status='PENDING',
-        expires_at__lt=timezone.now()
-    ).update(status='EXPIRED')
+from .services import SwapError, execute_swaps, resolve_cycle_through, resolve_cycles
+from users.authentication import async_view
 
 
 # 🔹 Request Swap
@@ -22,27 +17,27 @@ def expire_old_swaps():
 @permission_classes([IsAuthenticated])
 def request_swap(request):
 
-    expire_old_swaps()
-
     doctor_id = request.data.get('doctor_id')
     target_token_number = request.data.get('target_token')
 
     if not doctor_id or not target_token_number:
         return Response({"error": "doctor_id and target_token required"}, status=400)
 
+    today = timezone.now().date()
+
     try:
         my_token = Token.objects.get(
             doctor_id=doctor_id,
             patient=request.user,
-            status='WAITING'
+            status='WAITING',
+            date=today
         )
     except Token.DoesNotExist:
         return Response({"error": "You are not in queue"}, status=404)
 
     # 🚫 Block if already has pending swap
-    if SwapRequest.objects.filter(
-        from_token__patient=request.user,
-        status='PENDING'
+    if SwapRequest.objects.pending().filter(
+        from_token__patient=request.user
     ).exists():
         return Response(
             {"error": "You already have a pending swap request"},
@@ -53,7 +48,8 @@ def request_swap(request):
         target_token = Token.objects.get(
             doctor_id=doctor_id,
             token_number=target_token_number,
-            status='WAITING'
+            status='WAITING',
+            date=today
         )
     except Token.DoesNotExist:
         return Response({"error": "Invalid target token"}, status=404)
@@ -62,19 +58,28 @@ def request_swap(request):
         return Response({"error": "Cannot swap with yourself"}, status=400)
 
     # 🚫 Prevent duplicate swap request
-    if SwapRequest.objects.filter(
+    if SwapRequest.objects.pending().filter(
         from_token=my_token,
-        to_token=target_token,
-        status='PENDING'
+        to_token=target_token
     ).exists():
         return Response({"error": "Swap already requested"}, status=400)
 
     swap = SwapRequest.objects.create(
         from_token=my_token,
-        to_token=target_token,
-        expires_at=timezone.now() + timedelta(minutes=2)
+        to_token=target_token
     )
 
+    # 🔁 If this request closes a chain (A→B→C→A), everyone in it gets their swap now
+    chain = resolve_cycle_through(swap)
+    if chain:
+        my_token.refresh_from_db(fields=['token_number'])
+        return Response({
+            "message": "Swap chain completed",
+            "swap_id": swap.id,
+            "chain": [link.id for link in chain],
+            "token_number": my_token.token_number
+        })
+
     return Response({
         "message": "Swap request sent",
         "swap_id": swap.id,
@@ -87,46 +92,32 @@ def request_swap(request):
 @permission_classes([IsAuthenticated])
 def accept_swap(request):
 
-    expire_old_swaps()
-
     swap_id = request.data.get('swap_id')
 
-    try:
-        swap = SwapRequest.objects.get(id=swap_id)
-    except SwapRequest.DoesNotExist:
-        return Response({"error": "Invalid swap request"}, status=404)
-
-    if swap.status != 'PENDING':
-        return Response({"error": "Swap already processed"}, status=400)
-
-    if swap.expires_at < timezone.now():
-        swap.status = 'EXPIRED'
-        swap.save()
-        return Response({"error": "Swap expired"}, status=400)
-
-    if swap.to_token.patient != request.user:
-        return Response({"error": "Not authorized"}, status=403)
-
-    # 🚫 Safety checks
-    if swap.from_token.status != 'WAITING' or swap.to_token.status != 'WAITING':
-        return Response(
-            {"error": "One of the tokens is no longer eligible"},
-            status=400
-        )
+    with transaction.atomic():
+        # Lock the request and both tokens in one query
+        try:
+            swap = SwapRequest.objects.select_for_update().select_related(
+                'from_token', 'to_token'
+            ).get(id=swap_id)
+        except SwapRequest.DoesNotExist:
+            return Response({"error": "Invalid swap request"}, status=404)
 
-    if swap.from_token.doctor != swap.to_token.doctor:
-        return Response({"error": "Doctor mismatch"}, status=400)
+        # Expiry is lazy: a stale PENDING row reads as EXPIRED until the sweeper marks it
+        if swap.effective_status == 'EXPIRED':
+            return Response({"error": "Swap expired"}, status=400)
 
-    # 🔁 Perform swap
-    temp = swap.from_token.token_number
-    swap.from_token.token_number = swap.to_token.token_number
-    swap.to_token.token_number = temp
+        if swap.status != 'PENDING':
+            return Response({"error": "Swap already processed"}, status=400)
 
-    swap.from_token.save()
-    swap.to_token.save()
+        if swap.to_token.patient_id != request.user.id:
+            return Response({"error": "Not authorized"}, status=403)
 
-    swap.status = 'ACCEPTED'
-    swap.save()
+        # 🔁 Perform swap (eligibility re-checked on the locked tokens)
+        try:
+            execute_swaps([swap], tokens=[swap.from_token, swap.to_token])
+        except SwapError as error:
+            return Response({"error": str(error)}, status=400)
 
     return Response({"message": "Swap successful"})
 
@@ -136,12 +127,10 @@ def accept_swap(request):
 @permission_classes([IsAuthenticated])
 def reject_swap(request):
 
-    expire_old_swaps()
-
     swap_id = request.data.get('swap_id')
 
     try:
-        swap = SwapRequest.objects.get(id=swap_id, status='PENDING')
+        swap = SwapRequest.objects.pending().get(id=swap_id)
     except SwapRequest.DoesNotExist:
         return Response({"error": "Invalid swap request"}, status=404)
 
@@ -155,62 +144,83 @@ def reject_swap(request):
 
 
 # 🔹 View My Swaps
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def my_swaps(request):
-
-    expire_old_swaps()
+@async_view()
+async def my_swaps(request):
 
     swaps = SwapRequest.objects.filter(
-        Q(from_token__patient=request.user) |
-        Q(to_token__patient=request.user)
-    ).order_by('-created_at')
+        Q(from_token__patient_id=request.user.id) |
+        Q(to_token__patient_id=request.user.id)
+    ).select_related('from_token', 'to_token').order_by('-created_at')
 
     data = []
 
-    for swap in swaps:
+    async for swap in swaps:
         data.append({
             "swap_id": swap.id,
             "from_token": swap.from_token.token_number,
             "to_token": swap.to_token.token_number,
-            "status": swap.status,
+            "status": swap.effective_status,
             "expires_at": swap.expires_at,
             "created_at": swap.created_at
         })
 
-    return Response(data)
+    return JsonResponse(data, safe=False)
 
 
 # 🔹 Nearby Tokens (For UI)
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def nearby_tokens(request):
+@async_view()
+async def nearby_tokens(request):
 
-    doctor_id = request.query_params.get('doctor_id')
+    doctor_id = request.GET.get('doctor_id')
 
     if not doctor_id:
-        return Response({"error": "doctor_id required"}, status=400)
+        return JsonResponse({"error": "doctor_id required"}, status=400)
 
     try:
-        my_token = Token.objects.get(
+        doctor_id = int(doctor_id)
+    except ValueError:
+        return JsonResponse({"error": "Invalid doctor_id"}, status=400)
+
+    try:
+        my_token = await Token.objects.aget(
             doctor_id=doctor_id,
-            patient=request.user,
-            status='WAITING'
+            patient_id=request.user.id,
+            status='WAITING',
+            date=timezone.now().date()
         )
     except Token.DoesNotExist:
-        return Response({"error": "You are not in queue"}, status=404)
+        return JsonResponse({"error": "You are not in queue"}, status=404)
 
     tokens = Token.objects.filter(
         doctor_id=doctor_id,
+        date=my_token.date,
         status='WAITING'
-    ).exclude(patient=request.user)
+    ).exclude(patient_id=request.user.id).order_by('ranked_at', 'token_number')
 
+    # One joined projection instead of loading each token's patient
     data = [
         {
-            "token_number": t.token_number,
-            "username": t.patient.username
+            "token_number": row["token_number"],
+            "username": row["patient__username"]
         }
-        for t in tokens
+        async for row in tokens.values('token_number', 'patient__username')
     ]
 
-    return Response(data)
+    return JsonResponse(data, safe=False)
+
+
+# 🔹 Doctor resolves every swap chain in their queue at once
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def resolve_swap_chains(request):
+    try:
+        doctor = Doctor.objects.get(user=request.user)
+    except Doctor.DoesNotExist:
+        return Response({"error": "Doctor profile not found"}, status=404)
+
+    chains = resolve_cycles(doctor.id)
+
+    return Response({
+        "message": f"Resolved {len(chains)} swap chain(s)",
+        "chains": [[swap.id for swap in chain] for chain in chains]
+    })
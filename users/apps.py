@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class UsersConfig(AppConfig):
     name = 'users'
+
+    def ready(self):
+        # Connects the auth cache invalidation signals
+        from . import authentication  # noqa: F401
@@ -0,0 +1,335 @@
+"""
+JWT authentication with in-process caching.
+
+``CachedJWTAuthentication`` (the default) keeps verified tokens and loaded
+users in bounded LRU caches with a TTL, so a client polling with the same
+token skips both the signature check and the ``User`` query.
+
+``ClaimsJWTAuthentication`` is for hot read endpoints that only need the
+user id and ``is_staff``: it builds the user from the token's claims and
+never loads it from the database.
+
+Both have async counterparts (``aauthenticate``) for the async views, which
+use ``async_view`` in place of DRF's decorators.
+
+Whether a cached user or a token's claims still hold is decided by
+``access``: the ``is_active``, ``is_staff`` and password of the users seen
+recently, read again from the database together at most every
+``AUTH_SYNC_SECONDS``. A change made anywhere (another worker, the admin,
+a ``QuerySet.update()``, a deletion) is therefore honoured by every
+process within that time. When it doesn't match, the request takes the
+database path, which refuses inactive, deleted and re-passworded users.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import JsonResponse
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed, Throttled
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+User = get_user_model()
+
+
+class LRUCache:
+    """Thread-safe LRU of at most ``maxsize`` entries, each expiring after ``ttl`` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+tokens = LRUCache(settings.AUTH_CACHE_MAX_ENTRIES, settings.AUTH_CACHE_TTL)
+users = LRUCache(settings.AUTH_CACHE_MAX_ENTRIES, settings.AUTH_CACHE_TTL)
+
+
+class AccessSnapshots:
+    """``(is_active, is_staff, password)`` of the users seen recently, per process.
+
+    The users asked for since the last read are read again in one batch once
+    it is AUTH_SYNC_SECONDS old; the others are dropped. A user not held
+    yet is read on its own.
+    """
+
+    batch_size = 500
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}  # user pk -> access fields, None for a deleted user
+        self._seen = set()    # user pks asked for since the last read
+        self._read_at = float('-inf')
+
+    def _held(self, pk):
+        """``(True, fields)`` if ``pk``'s snapshot is recent enough to use, else ``(False, None)``."""
+        snapshots = self._snapshots
+        if pk in snapshots and time.monotonic() - self._read_at < settings.AUTH_SYNC_SECONDS:
+            return True, snapshots[pk]
+        return False, None
+
+    def current(self, user_id):
+        """Access fields of ``user_id`` (a token claim), or None if there is no such user."""
+        pk = User._meta.pk.to_python(user_id)
+        self._seen.add(pk)
+        held, snapshot = self._held(pk)
+        if held:
+            return snapshot
+
+        with self._lock:
+            batch = time.monotonic() - self._read_at >= settings.AUTH_SYNC_SECONDS
+            if batch:
+                pks, self._seen = self._seen | {pk}, set()
+                self._read_at = time.monotonic()
+            else:
+                pks = {pk}
+
+        snapshots = dict.fromkeys(pks)
+        pks = list(pks)
+        for start in range(0, len(pks), self.batch_size):
+            rows = User.objects.filter(pk__in=pks[start:start + self.batch_size]).values_list(
+                'pk', 'is_active', 'is_staff', 'password',
+            )
+            for user_pk, *fields in rows:
+                snapshots[user_pk] = tuple(fields)
+
+        with self._lock:
+            if batch:
+                self._snapshots = snapshots
+            else:
+                self._snapshots.update(snapshots)
+        return snapshots[pk]
+
+    async def acurrent(self, user_id):
+        pk = User._meta.pk.to_python(user_id)
+        held, snapshot = self._held(pk)
+        if held:
+            self._seen.add(pk)
+            return snapshot
+        return await sync_to_async(self.current)(user_id)
+
+    def forget(self, pk):
+        with self._lock:
+            self._snapshots.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self._seen.clear()
+            self._read_at = float('-inf')
+
+
+access = AccessSnapshots()
+
+
+def _matches(user, snapshot):
+    return snapshot == (user.is_active, user.is_staff, user.password)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def get_validated_token(self, raw_token):
+        validated = tokens.get(raw_token)
+        if validated is None:
+            validated = super().get_validated_token(raw_token)
+            tokens.set(raw_token, validated, ttl=validated['exp'] - time.time())
+        return validated
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = users.get(user_id)
+        if user is not None and _matches(user, access.current(user_id)):
+            return user
+
+        user = super().get_user(validated_token)
+        users.set(user_id, user)
+        return user
+
+    # 🔹 Async views (see async_view)
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = users.get(user_id)
+        if user is not None and _matches(user, await access.acurrent(user_id)):
+            return user
+
+        user = await self._aload_user(validated_token)
+        users.set(user_id, user)
+        return user
+
+    async def _aload_user(self, validated_token):
+        # JWTAuthentication.get_user on the async ORM
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        try:
+            user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist as e:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+
+class ClaimsUser(TokenUser):
+    """``TokenUser`` whose id has the type of ``User.pk`` (simplejwt puts a string in the claim)."""
+
+    @cached_property
+    def id(self):
+        return User._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+
+
+class ClaimsJWTAuthentication(CachedJWTAuthentication):
+    """Authenticate from token claims alone: ``request.user`` is a ``ClaimsUser``.
+
+    Only for views that use nothing but ``user.id`` and ``user.is_staff``.
+    """
+
+    def get_user(self, validated_token):
+        user_id = self.claims_user_id(validated_token)
+        if user_id is None or not self.claims_current(validated_token, access.current(user_id)):
+            # Claims may be stale (or predate the is_staff claim): check the database
+            return super().get_user(validated_token)
+        return ClaimsUser(validated_token)
+
+    async def aget_user(self, validated_token):
+        user_id = self.claims_user_id(validated_token)
+        if user_id is None or not self.claims_current(validated_token, await access.acurrent(user_id)):
+            return await super().aget_user(validated_token)
+        return ClaimsUser(validated_token)
+
+    @staticmethod
+    def claims_user_id(validated_token):
+        """The user id of a token that carries every claim this needs, else None."""
+        if 'is_staff' not in validated_token:
+            return None
+        return validated_token.get(api_settings.USER_ID_CLAIM)
+
+    def claims_current(self, validated_token, snapshot):
+        """Whether the user (``access`` fields ``snapshot``) still exists and is active, has
+        the token's ``is_staff`` and, with CHECK_REVOKE_TOKEN, the password it was issued for."""
+        if snapshot is None:
+            return False
+        is_active, is_staff, password = snapshot
+        if api_settings.CHECK_USER_IS_ACTIVE and not is_active:
+            return False
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(password):
+            return False
+        return is_staff == validated_token['is_staff']
+
+
+def async_view(methods=('GET',), admin=False, authentication=ClaimsJWTAuthentication, throttle=None):
+    """JWT authentication, permission and throttle checks for plain async views.
+
+    DRF views are sync; under ASGI they all share one thread. Views wrapped
+    in this stay on the event loop and answer auth failures as DRF would.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+
+            try:
+                result = await authentication().aauthenticate(request)
+            except AuthenticationFailed as e:
+                data = e.detail if isinstance(e.detail, dict) else {"detail": e.detail}
+                return JsonResponse(data, status=401, headers={'WWW-Authenticate': 'Bearer'})
+            if result is None:
+                return JsonResponse(
+                    {"detail": "Authentication credentials were not provided."},
+                    status=401, headers={'WWW-Authenticate': 'Bearer'},
+                )
+
+            request.user = result[0]
+            if admin and not request.user.is_staff:
+                return JsonResponse({"detail": "You do not have permission to perform this action."}, status=403)
+
+            if throttle is not None:
+                checker = throttle()
+                if not checker.allow_request(request, None):
+                    exc = Throttled(checker.wait())
+                    return JsonResponse(
+                        {"detail": exc.detail}, status=exc.status_code,
+                        headers={'Retry-After': '%d' % exc.wait},
+                    )
+            return await view(request, *args, **kwargs)
+
+        return csrf_exempt(wrapper)
+
+    return decorator
+
+
+# Changes saved in this process apply at once; the others within AUTH_SYNC_SECONDS
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    access.forget(instance.pk)
@@ -0,0 +1,114 @@
+"""
+Password hashing off the request workers.
+
+PBKDF2 is deliberately slow, and at the morning login peak it would hold
+the workers that serve the cheap polling endpoints. Hashing and checking
+go to a dedicated process pool instead (``PASSWORD_HASHING_WORKERS``).
+At most ``PASSWORD_HASHING_MAX_PENDING`` jobs may be queued or running;
+beyond that ``HashingBusy`` is raised straight away, and the views answer
+503 rather than queue without bound.
+
+The helpers are coroutines for async views: under ASGI they await the pool
+without holding a thread, whereas sync views all run on the one thread ASGI
+shares between them. As with ``User.check_password``, a correct password
+stored with outdated hasher parameters is re-hashed (in the pool) and handed
+to the caller's ``setter`` to save.
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def _init_worker():
+    django.setup()
+
+
+def _make_password(password):
+    return hashers.make_password(password)
+
+
+def _check_password(password, encoded):
+    # The setter can't cross the process boundary: return the new hash instead
+    upgraded = []
+    valid = hashers.check_password(
+        password, encoded, setter=lambda raw: upgraded.append(hashers.make_password(raw)),
+    )
+    return valid, (upgraded[0] if upgraded else None)
+
+
+class HashingPool:
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.workers:
+                # Spawned, not forked: the server may have threads and open connections
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                )
+            else:
+                # No processes configured (tests, small deployments); hashlib
+                # releases the GIL, so threads still keep the event loop free
+                self._executor = ThreadPoolExecutor(thread_name_prefix='hashing')
+        return self._executor
+
+    def submit(self, func, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise HashingBusy()
+            self.pending += 1
+            try:
+                future = self._get_executor().submit(func, *args)
+            except BaseException:
+                self.pending -= 1
+                raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+            if not future.cancelled() and isinstance(future.exception(), BrokenExecutor):
+                # A worker died; start a fresh pool on the next submit
+                self._executor = None
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+pool = HashingPool(settings.PASSWORD_HASHING_WORKERS, settings.PASSWORD_HASHING_MAX_PENDING)
+
+
+async def _run(func, *args):
+    return await asyncio.wrap_future(pool.submit(func, *args))
+
+
+async def amake_password(password):
+    return await _run(_make_password, password)
+
+
+async def acheck_password(password, encoded, setter=None):
+    """``check_password`` in the pool; ``setter`` is awaited with the upgraded hash."""
+    valid, upgraded = await _run(_check_password, password, encoded)
+    if upgraded is not None and setter is not None:
+        await setter(upgraded)
+    return valid
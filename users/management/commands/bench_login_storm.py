@@ -0,0 +1,139 @@
+import asyncio
+import os
+import tempfile
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import include, path
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.views import TokenObtainPairView
+
+from queues.engine import queue_engine
+from queues.models import Doctor
+from smartqueue.benchmarking import isolated_database, summarize, write_results
+from users import hashing
+
+
+PASSWORD = 'storm-password-1'
+
+
+class LegacyURLConf:
+    # The login view before hashing moved off the request workers
+    urlpatterns = [
+        path('api/users/login/', TokenObtainPairView.as_view()),
+        path('', include('smartqueue.urls')),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure queue_status latency without and then during a login storm, through "
+        "Django's ASGI handler (where all sync views share one thread)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pollers', type=int, default=20)
+        parser.add_argument('--poll-interval', type=float, default=0.1, help="Seconds between polls")
+        parser.add_argument('--logins', type=int, default=8, help="Concurrent login clients")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per phase")
+        parser.add_argument('--legacy-login', action='store_true',
+                            help="Storm simplejwt's sync TokenObtainPairView instead")
+        parser.add_argument('--output', help="Write results as JSON to this path")
+
+    def handle(self, *args, **options):
+        self.options = options
+
+        # Views run on another thread than the setup, so use a file
+        with tempfile.TemporaryDirectory() as tmp, isolated_database(os.path.join(tmp, 'bench.sqlite3')):
+            queue_engine.reset()
+            self.setup()
+
+            if options['legacy_login']:
+                with override_settings(ROOT_URLCONF=LegacyURLConf):
+                    results = asyncio.run(self.measure())
+            else:
+                results = asyncio.run(self.measure())
+
+        results['config'] = {
+            key: options[key]
+            for key in ('pollers', 'poll_interval', 'logins', 'duration', 'legacy_login')
+        }
+        results['hashing_workers'] = hashing.pool.workers
+
+        for phase in ('quiet', 'storm'):
+            polls = results[f'polls_{phase}']
+            self.stdout.write(
+                f"queue_status ({phase}): {polls['count']} polls, p50 {polls['p50_ms']} ms, "
+                f"p95 {polls['p95_ms']} ms, p99 {polls['p99_ms']} ms"
+            )
+        logins = results['logins']
+        self.stdout.write(
+            f"login: {logins['count']} requests, p50 {logins['p50_ms']} ms, "
+            f"p99 {logins['p99_ms']} ms, statuses {logins['statuses']}"
+        )
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def setup(self):
+        doctor = Doctor.objects.create(name="Bench", department="Bench")
+        self.doctor_id = doctor.id
+
+        patients = User.objects.bulk_create(
+            User(username=f"bench-patient-{i}", password='!') for i in range(self.options['pollers'])
+        )
+        self.poll_tokens = [str(AccessToken.for_user(user)) for user in patients]
+
+        # One hash shared by every storm account; hashing each would take minutes
+        encoded = make_password(PASSWORD)
+        User.objects.bulk_create(
+            User(username=f"bench-login-{i}", password=encoded) for i in range(self.options['logins'])
+        )
+
+    async def measure(self):
+        # Start the hashing processes before the clock runs
+        await asyncio.gather(*(hashing.amake_password(PASSWORD) for _ in range(hashing.pool.workers or 1)))
+
+        quiet, _, _ = await self.phase(storm=False)
+        storm, logins, statuses = await self.phase(storm=True)
+        return {
+            "polls_quiet": summarize(quiet),
+            "polls_storm": summarize(storm),
+            "logins": {**summarize(logins), "statuses": statuses},
+        }
+
+    async def phase(self, storm):
+        deadline = time.perf_counter() + self.options['duration']
+        polls, logins, statuses = [], [], {}
+
+        async def poll(token):
+            client = AsyncClient()
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get(
+                    '/api/queues/status/', {'doctor_id': self.doctor_id},
+                    headers={'Authorization': f"Bearer {token}"},
+                )
+                polls.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(self.options['poll_interval'])
+
+        async def login(i):
+            client = AsyncClient()
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.post(
+                    '/api/users/login/', {'username': f"bench-login-{i}", 'password': PASSWORD},
+                    content_type='application/json',
+                )
+                logins.append((time.perf_counter() - start) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        tasks = [poll(token) for token in self.poll_tokens]
+        if storm:
+            tasks += [login(i) for i in range(self.options['logins'])]
+        await asyncio.gather(*tasks)
+        return polls, logins, statuses
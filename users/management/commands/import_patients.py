@@ -0,0 +1,188 @@
+import csv
+import gzip
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+FIELDS = ('username', 'email', 'password', 'first_name', 'last_name')
+
+
+def _init_worker():
+    # Spawned (not forked) workers start without configured settings; nothing
+    # at module level may touch the app registry before this runs
+    django.setup()
+
+
+def _text(value):
+    """A field as a stripped string; None for values that can't be one (objects, lists)."""
+    if value is None:
+        return ''
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        return str(value).strip()
+    return None
+
+
+def _hash_batch(rows):
+    # Rows without a password get an unusable one (they sign in after a reset)
+    return [make_password(row.get('password') or None) for row in rows]
+
+
+class Command(BaseCommand):
+    help = (
+        "Create patient accounts from a CSV or JSONL file (optionally .gz) with columns "
+        "username, email, password[, first_name, last_name]. Passwords are hashed in a "
+        "process pool and users inserted in batches; usernames that already exist are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help="Default: from the file extension")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Hashing processes; 0 hashes in this process")
+
+    def handle(self, *args, **options):
+        self.User = get_user_model()
+        self.created = self.existing = self.invalid = self.read = 0
+        self.start = self.last_report = time.perf_counter()
+
+        batches = self.batches(self.rows(options['path'], options['format']), options['batch_size'])
+
+        if options['workers'] == 0:
+            for batch in batches:
+                self.insert(batch, _hash_batch(batch))
+        else:
+            # Spawned: a forked child would share this process's database connection
+            spawn = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(options['workers'], mp_context=spawn, initializer=_init_worker) as pool:
+                # At most two batches per worker in flight, so memory stays flat
+                in_flight = deque()
+                for batch in batches:
+                    in_flight.append((batch, pool.submit(_hash_batch, batch)))
+                    if len(in_flight) >= 2 * options['workers']:
+                        batch, future = in_flight.popleft()
+                        self.insert(batch, future.result())
+                while in_flight:
+                    batch, future = in_flight.popleft()
+                    self.insert(batch, future.result())
+
+        self.progress(final=True)
+
+    # 🔹 Input
+
+    def rows(self, path, fmt):
+        if not os.path.exists(path):
+            raise CommandError(f"No such file: {path}")
+
+        name = path[:-3] if path.endswith('.gz') else path
+        fmt = fmt or ('jsonl' if name.endswith(('.jsonl', '.ndjson')) else 'csv')
+        raw = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+        with io.TextIOWrapper(raw, encoding='utf-8', newline='') as fh:
+            if fmt == 'csv':
+                yield from csv.DictReader(fh)
+            else:
+                for line_number, line in enumerate(fh, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        self.stderr.write(f"Line {line_number}: invalid JSON, skipped")
+                        yield {}
+
+    def batches(self, rows, size):
+        """Valid rows in batches, deduplicated within the batch and against the DB."""
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, size))
+            if not chunk:
+                return
+            self.read += len(chunk)
+
+            batch = {}
+            for row in chunk:
+                fields = {field: _text(row.get(field)) for field in FIELDS} if isinstance(row, dict) else {}
+                username = fields.get('username')
+                if not username or None in fields.values():
+                    self.invalid += 1
+                    continue
+                if username in batch:
+                    self.existing += 1
+                    continue
+                batch[username] = fields
+
+            taken = self.taken(batch)
+            self.existing += len(taken)
+            batch = [row for username, row in batch.items() if username not in taken]
+            if batch:
+                yield batch
+
+    def taken(self, usernames):
+        return set(self.User.objects.filter(username__in=list(usernames)).values_list('username', flat=True))
+
+    # 🔹 Output
+
+    def insert(self, batch, hashes):
+        users = [
+            self.User(
+                username=row['username'], email=row['email'], password=password,
+                first_name=row['first_name'], last_name=row['last_name'],
+            )
+            for row, password in zip(batch, hashes)
+        ]
+
+        # Earlier batches still hashing when this one was checked may have
+        # repeated a username, and signups keep running meanwhile
+        users = self.untaken(users)
+        try:
+            with transaction.atomic():
+                self.User.objects.bulk_create(users)
+            self.created += len(users)
+        except IntegrityError:
+            # A username taken since the check, or a row the database refuses
+            self.insert_each(self.untaken(users))
+
+        if time.perf_counter() - self.last_report >= 5:
+            self.progress()
+
+    def untaken(self, users):
+        taken = self.taken(user.username for user in users)
+        self.existing += len(taken)
+        return [user for user in users if user.username not in taken]
+
+    def insert_each(self, users):
+        for user in users:
+            try:
+                with transaction.atomic():
+                    self.User.objects.bulk_create([user])
+            except IntegrityError as error:
+                if self.taken([user.username]):
+                    self.existing += 1
+                else:
+                    self.invalid += 1
+                    self.stderr.write(f"{user.username}: {error}, skipped")
+            else:
+                self.created += 1
+
+    def progress(self, final=False):
+        self.last_report = time.perf_counter()
+        elapsed = self.last_report - self.start
+        rate = self.read / elapsed if elapsed else 0.0
+        message = (
+            f"{self.read} rows read, {self.created} created, {self.existing} existing, "
+            f"{self.invalid} invalid in {elapsed:.1f}s ({rate:.0f} rows/s)"
+        )
+        self.stdout.write(self.style.SUCCESS(message) if final else message)
@@ -0,0 +1,11 @@
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Login tokens that also carry ``is_staff``, for ``ClaimsJWTAuthentication``."""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['is_staff'] = user.is_staff
+        return token
@@ -1,3 +1,217 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, identify_hasher
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import Client, RequestFactory, TestCase, override_settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.views import TokenObtainPairView
+
+from . import hashing
+from .authentication import CachedJWTAuthentication, ClaimsJWTAuthentication, access, tokens, users
+from .management.commands.import_patients import Command as ImportPatients
+from .serializers import ClaimsTokenObtainPairSerializer
+
+
+class AccessInvalidationTests(TestCase):
+    """Cached users and token claims stop working when the user's access changes."""
+
+    def setUp(self):
+        access.clear()
+        tokens.clear()
+        users.clear()
+        self.user = User.objects.create_user('alice', password='alice-pass-1', is_staff=True)
+        self.token = str(ClaimsTokenObtainPairSerializer.get_token(self.user).access_token)
+
+    def authenticate(self, authentication):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        return authentication().authenticate(request)[0]
+
+    def aauthenticate(self, authentication):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        return async_to_sync(authentication().aauthenticate)(request)[0]
+
+    def assertRefused(self):
+        for authentication in (CachedJWTAuthentication, ClaimsJWTAuthentication):
+            with self.assertRaises(AuthenticationFailed):
+                self.authenticate(authentication)
+            with self.assertRaises(AuthenticationFailed):
+                self.aauthenticate(authentication)
+
+    def test_cached_within_the_sync_interval(self):
+        self.authenticate(CachedJWTAuthentication)
+        self.authenticate(ClaimsJWTAuthentication)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(CachedJWTAuthentication), self.user)
+            self.assertEqual(self.authenticate(ClaimsJWTAuthentication).id, self.user.id)
+            self.assertEqual(self.aauthenticate(ClaimsJWTAuthentication).id, self.user.id)
+
+    @override_settings(AUTH_SYNC_SECONDS=0)
+    def test_deactivated_without_signals(self):
+        self.authenticate(CachedJWTAuthentication)
+        self.authenticate(ClaimsJWTAuthentication)
+        # As another worker, or a bulk update, would do it
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        self.assertRefused()
+
+    @override_settings(AUTH_SYNC_SECONDS=3600)
+    def test_deactivated_in_this_process_applies_at_once(self):
+        self.authenticate(ClaimsJWTAuthentication)
+        self.user.is_active = False
+        self.user.save()
+        self.assertRefused()
+
+    @override_settings(AUTH_SYNC_SECONDS=0)
+    def test_is_staff_change(self):
+        self.assertTrue(self.authenticate(ClaimsJWTAuthentication).is_staff)
+        User.objects.filter(id=self.user.id).update(is_staff=False)
+
+        self.assertFalse(self.authenticate(ClaimsJWTAuthentication).is_staff)
+        self.assertFalse(self.aauthenticate(ClaimsJWTAuthentication).is_staff)
+        self.assertFalse(self.authenticate(CachedJWTAuthentication).is_staff)
+
+    @override_settings(AUTH_SYNC_SECONDS=0)
+    def test_deleted(self):
+        self.authenticate(CachedJWTAuthentication)
+        self.authenticate(ClaimsJWTAuthentication)
+        User.objects.filter(id=self.user.id).delete()
+        self.assertRefused()
+
+
+class ImportPatientsTests(TestCase):
+
+    def setUp(self):
+        User.objects.create_user('taken', password='taken-pass-1')
+
+    def run_import(self, rows, workers=0, **options):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as fh:
+            for row in rows:
+                fh.write((row if isinstance(row, str) else json.dumps(row)) + '\n')
+        self.addCleanup(os.remove, fh.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_patients', fh.name, workers=workers, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_import(self):
+        out, _ = self.run_import([
+            {'username': 'bob', 'email': 'bob@example.com', 'password': 'bob-pass-1'},
+            {'username': 123, 'first_name': 'Numbered'},
+            {'username': 'bob'},
+            {'username': 'taken'},
+            {'username': {'nested': True}},
+            {'username': 'carol', 'email': ['not', 'a', 'string']},
+            [1, 2],
+            'not json',
+            {'email': 'nobody@example.com'},
+        ])
+
+        self.assertIn("9 rows read, 2 created, 2 existing, 5 invalid", out)
+        self.assertTrue(User.objects.get(username='bob').check_password('bob-pass-1'))
+        self.assertEqual(User.objects.get(username='123').first_name, 'Numbered')
+        self.assertFalse(User.objects.get(username='123').has_usable_password())
+        self.assertFalse(User.objects.filter(username='carol').exists())
+
+    def test_spawned_workers(self):
+        out, _ = self.run_import([{'username': f'worker-{i}', 'password': 'pass'} for i in range(3)],
+                                 workers=1, batch_size=2)
+        self.assertIn("3 created", out)
+        self.assertTrue(User.objects.get(username='worker-2').check_password('pass'))
+
+    def test_row_refused_by_the_database(self):
+        bulk_create = User.objects.bulk_create
+
+        def refuse_dave(users):
+            if any(user.username == 'dave' for user in users):
+                raise IntegrityError("CHECK constraint failed")
+            return bulk_create(users)
+
+        with mock.patch.object(User.objects, 'bulk_create', side_effect=refuse_dave):
+            out, err = self.run_import([{'username': name} for name in ('dave', 'erin', 'frank')])
+
+        # Falls back to one row at a time instead of retrying the batch
+        self.assertIn("3 rows read, 2 created, 0 existing, 1 invalid", out)
+        self.assertIn("dave: CHECK constraint failed, skipped", err)
+
+    def test_username_taken_after_the_check(self):
+        taken = ImportPatients.taken
+        checks = []
+
+        def signup_after_checks(command, usernames):
+            # A signup lands between the checks and the insert
+            checks.append(list(usernames))
+            if len(checks) == 2:
+                User.objects.create_user('gina')
+                return set()
+            return taken(command, checks[-1])
+
+        with mock.patch.object(ImportPatients, 'taken', signup_after_checks):
+            out, _ = self.run_import([{'username': 'gina'}, {'username': 'hank'}])
+
+        self.assertIn("2 rows read, 1 created, 1 existing, 0 invalid", out)
+        self.assertTrue(User.objects.filter(username='hank').exists())
+
+
+class LoginTests(TestCase):
+    """The async login answers as TokenObtainPairView does."""
+
+    def setUp(self):
+        patcher = mock.patch.object(hashing, 'pool', hashing.HashingPool(0, 64))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        access.clear()
+        self.user = User.objects.create_user('alice', password='alice-pass-1')
+        User.objects.create_user('inactive', password='alice-pass-1', is_active=False)
+
+    def compare(self, body, content_type='application/json'):
+        stock = TokenObtainPairView.as_view()(RequestFactory().post('/', body, content_type=content_type))
+        stock.render()
+        response = Client().post('/api/users/login/', body, content_type=content_type)
+        self.assertEqual(response.status_code, stock.status_code, body)
+        self.assertEqual(response.headers.get('WWW-Authenticate'), stock.headers.get('WWW-Authenticate'), body)
+        if stock.status_code != 200:
+            self.assertEqual(response.json(), json.loads(stock.content), body)
+        return response
+
+    def test_errors_as_token_obtain_pair_view(self):
+        for body in (
+            {},
+            {'username': 'alice'},
+            {'username': '', 'password': ''},
+            {'username': 'alice', 'password': 'wrong'},
+            {'username': 'inactive', 'password': 'alice-pass-1'},
+            {'username': 'nobody', 'password': 'alice-pass-1'},
+            {'username': 5, 'password': 'alice-pass-1'},
+        ):
+            self.compare(json.dumps(body))
+        self.compare('not json')
+        self.compare('[1]')
+        self.compare('username=alice', content_type='application/x-www-form-urlencoded')
+
+    def test_tokens(self):
+        response = self.compare(json.dumps({'username': 'alice', 'password': 'alice-pass-1'}))
+        self.assertEqual(set(response.json()), {'refresh', 'access'})
+
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+        user, token = ClaimsJWTAuthentication().authenticate(request)
+        self.assertEqual((user.id, token['is_staff']), (self.user.id, False))
+
+    def test_outdated_hash_upgraded(self):
+        old = PBKDF2PasswordHasher().encode('alice-pass-1', 'saltsaltsalt', iterations=1000)
+        User.objects.filter(id=self.user.id).update(password=old)
+
+        response = self.compare(json.dumps({'username': 'alice', 'password': 'alice-pass-1'}))
+        self.assertEqual(response.status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertNotEqual(self.user.password, old)
+        self.assertFalse(identify_hasher(self.user.password).must_update(self.user.password))
+        self.assertTrue(self.user.check_password('alice-pass-1'))
+        # The tokens are issued for the new hash
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f"Bearer {response.json()['access']}")
+        self.assertEqual(CachedJWTAuthentication().authenticate(request)[0], self.user)
@@ -1,9 +1,8 @@
 from django.urls import path
-from .views import signup,get_user_details
-from rest_framework_simplejwt.views import TokenObtainPairView
+from .views import signup,get_user_details,login
 
 urlpatterns = [
     path('signup/', signup),
-    path('login/', TokenObtainPairView.as_view()),
+    path('login/', login),
     path('me/', get_user_details), 
 ]
@@ -1,39 +1,99 @@
+import json
+
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.views import TokenObtainPairView
+
+from . import hashing
+from .serializers import ClaimsTokenObtainPairSerializer
 
 User = get_user_model()
 
+# As TokenObtainPairView sends with its 401
+LOGIN_AUTHENTICATE_HEADER = f'{jwt_settings.AUTH_HEADER_TYPES[0]} realm="{TokenObtainPairView.www_authenticate_realm}"'
+
+
+def _request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
+
+
+def _busy():
+    return JsonResponse(
+        {"error": "Server busy, please retry"},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': '1'},
+    )
+
+
+def _upgrade_password(user):
+    # What User.check_password's setter does, given the hash from the pool
+    async def setter(encoded):
+        user.password = encoded
+        await user.asave(update_fields=['password'])
+    return setter
+
+
+# 🔹 SIGNUP (async: the password is hashed on the hashing pool)
+@csrf_exempt
+async def signup(request):
+    if request.method != 'POST':
+        return JsonResponse({"error": "Method not allowed"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
-# 🔹 SIGNUP
-@api_view(['POST'])
-def signup(request):
-    username = request.data.get('username')
-    email = request.data.get('email')
-    password = request.data.get('password')
+    data = _request_data(request)
+    if data is None:
+        return JsonResponse({"error": "Invalid request body"}, status=status.HTTP_400_BAD_REQUEST)
+
+    username = data.get('username')
+    email = data.get('email')
+    password = data.get('password')
 
     # Validate
     if not username or not password:
-        return Response(
+        return JsonResponse(
             {"error": "Username and password are required"},
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    if User.objects.filter(username=username).exists():
-        return Response(
+    if await User.objects.filter(username=username).aexists():
+        return JsonResponse(
             {"error": "Username already exists"},
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    user = User.objects.create_user(
-        username=username,
-        email=email,
-        password=password
+    try:
+        encoded = await hashing.amake_password(password)
+    except hashing.HashingBusy:
+        return _busy()
+
+    # What create_user does, with the hash computed off the event loop
+    user = User(
+        username=User.normalize_username(username),
+        email=User.objects.normalize_email(email),
+        password=encoded,
     )
+    try:
+        await user.asave()
+    except IntegrityError:
+        return JsonResponse(
+            {"error": "Username already exists"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
-    return Response(
+    return JsonResponse(
         {
             "message": "User created successfully",
             "user_id": user.id
@@ -42,6 +102,60 @@ def signup(request):
     )
 
 
+# 🔹 LOGIN (async replacement for TokenObtainPairView, same request and responses)
+@csrf_exempt
+async def login(request):
+    if request.method != 'POST':
+        return JsonResponse(
+            {"detail": f'Method "{request.method}" not allowed.'},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED, headers={'Allow': 'POST, OPTIONS'},
+        )
+
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError as error:
+            return JsonResponse({"detail": f"JSON parse error - {error}"}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        data = request.POST
+
+    # The serializer's fields only: required, blank and type errors as the view reports them
+    try:
+        credentials = ClaimsTokenObtainPairSerializer().to_internal_value(data)
+    except ValidationError as error:
+        return JsonResponse(error.detail, status=status.HTTP_400_BAD_REQUEST)
+    username = credentials[User.USERNAME_FIELD]
+    password = credentials['password']
+
+    try:
+        user = await User._default_manager.aget_by_natural_key(username)
+    except User.DoesNotExist:
+        user = None
+
+    try:
+        if user is None:
+            # Hash anyway so unknown usernames take as long as wrong passwords
+            await hashing.amake_password(password)
+            valid = False
+        else:
+            valid = await hashing.acheck_password(password, user.password, setter=_upgrade_password(user))
+    except hashing.HashingBusy:
+        return _busy()
+
+    if not valid or not jwt_settings.USER_AUTHENTICATION_RULE(user):
+        return JsonResponse(
+            {"detail": "No active account found with the given credentials"},
+            status=status.HTTP_401_UNAUTHORIZED,
+            headers={'WWW-Authenticate': LOGIN_AUTHENTICATE_HEADER},
+        )
+
+    refresh = ClaimsTokenObtainPairSerializer.get_token(user)
+    return JsonResponse({
+        "refresh": str(refresh),
+        "access": str(refresh.access_token),
+    })
+
+
 # 🔹 GET USER DETAILS (Protected)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])